@@ -21,7 +21,7 @@ from django.utils.text import Truncator
 from django.utils.translation import gettext_lazy as _
 
 from .fields import CommaSeparatedEmailField
-from .models import Attachment, Log, Email, EmailTemplate, STATUS
+from .models import Attachment, Log, Email, EmailTemplate, Recipient, STATUS
 from . import settings as post_office_settings
 from .sanitizer import clean_html
 
@@ -110,6 +110,29 @@ class EmailAdmin(admin.ModelAdmin):
     def get_queryset(self, request):
         return super().get_queryset(request).select_related('template')
 
+    def get_search_results(self, request, queryset, search_term):
+        results, use_distinct = super().get_search_results(request, queryset, search_term)
+        # Searching for an email address also matches the stored cc and bcc recipients
+        search_term = search_term.strip()
+        if post_office_settings.get_store_recipients() and '@' in search_term \
+                and ' ' not in search_term:
+            results |= queryset & Email.objects.with_recipient(search_term)
+        return results, use_distinct
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        # Keep the stored recipients in sync with the edited recipient fields
+        if post_office_settings.get_store_recipients() and \
+                (not change or {'to', 'cc', 'bcc'}.intersection(form.changed_data)):
+            obj.recipients.all().delete()
+            Recipient.objects.create_for_emails([obj])
+
+    def get_object(self, request, object_id, from_field=None):
+        obj = super().get_object(request, object_id, from_field)
+        if obj is not None:
+            Email.objects.prepare_messages([obj])
+        return obj
+
     def to_display(self, instance):
         return ', '.join(instance.to)
 
@@ -0,0 +1,172 @@
+import asyncio
+
+from django.core.mail import get_connection
+from django.core.mail.backends.smtp import EmailBackend as SMTPEmailBackend
+from django.core.mail.message import sanitize_address
+
+from .connections import connections
+from .logutils import setup_loghandlers
+from .mail import _update_statuses, get_queued, mark_sending
+from .models import prepare_email_messages
+from .settings import get_async_concurrency, get_backend, get_log_level
+from .throttle import get_throttle
+
+logger = setup_loghandlers("INFO")
+
+
+class AsyncSMTPBackend:
+    """
+    Sends ``EmailMessage`` objects through an ``aiosmtplib`` session, configured
+    like Django's SMTP backend ``connection``.
+    """
+
+    def __init__(self, connection):
+        self.host = connection.host
+        self.port = connection.port
+        self.username = connection.username
+        self.password = connection.password
+        self.use_tls = connection.use_tls
+        self.use_ssl = connection.use_ssl
+        self.timeout = connection.timeout
+        self.smtp = None
+
+    async def open(self):
+        if self.smtp is not None:
+            return
+        import aiosmtplib
+
+        smtp = aiosmtplib.SMTP(
+            hostname=self.host, port=self.port, timeout=self.timeout,
+            use_tls=self.use_ssl, start_tls=self.use_tls,
+        )
+        await smtp.connect()
+        if self.username and self.password:
+            await smtp.login(self.username, self.password)
+        self.smtp = smtp
+
+    async def close(self):
+        if self.smtp is None:
+            return
+        try:
+            await self.smtp.quit()
+        except Exception:
+            pass
+        finally:
+            self.smtp = None
+
+    async def send_message(self, email_message):
+        await self.open()
+        encoding = email_message.encoding or 'utf-8'
+        from_email = sanitize_address(email_message.from_email, encoding)
+        recipients = [sanitize_address(address, encoding) for address in email_message.recipients()]
+        message = email_message.message()
+        try:
+            await self.smtp.sendmail(from_email, recipients, message.as_bytes(linesep='\r\n'))
+        except Exception:
+            # The session may be in an undefined state, start afresh for the next email
+            await self.close()
+            raise
+
+
+class AsyncSender:
+    """
+    Sends out a batch of queued emails from a single thread, by running up to
+    ``ASYNC_CONCURRENCY`` SMTP sessions concurrently on an asyncio event loop.
+
+    Emails are fetched, rendered and their statuses persisted synchronously, exactly
+    as in ``mail._send_bulk()``. Emails using a backend other than Django's SMTP
+    backend are dispatched through the loop's default thread pool executor.
+    """
+
+    def __init__(self, log_level=None, concurrency=None):
+        if log_level is None:
+            log_level = get_log_level()
+        self.log_level = log_level
+        self.concurrency = concurrency or get_async_concurrency()
+        self._smtp_configs = {}
+        self.throttle = get_throttle()
+
+    def run(self):
+        emails = list(get_queued())
+        email_count = len(emails)
+        logger.info('Started sending %s emails asynchronously' % email_count)
+        if not emails:
+            return 0, 0, 0
+
+        mark_sending(emails)
+        sent_emails, failed_emails = [], []
+        prepared_emails = []
+        for email, exception in prepare_email_messages(emails):
+            if exception is None:
+                prepared_emails.append(email)
+            else:
+                failed_emails.append((email, exception))
+
+        if prepared_emails:
+            loop = asyncio.new_event_loop()
+            try:
+                loop.run_until_complete(self.send_all(prepared_emails, sent_emails, failed_emails))
+            finally:
+                loop.close()
+        connections.close()
+
+        num_failed, num_requeued = _update_statuses(sent_emails, failed_emails, self.log_level)
+        logger.info(
+            '%s emails attempted, %s sent, %s failed, %s requeued',
+            email_count, len(sent_emails), num_failed, num_requeued,
+        )
+        return len(sent_emails), num_failed, num_requeued
+
+    def get_smtp_connection(self, alias):
+        """
+        Returns Django's SMTP backend configured for ``alias``, or None if this
+        alias doesn't use SMTP.
+        """
+        if alias not in self._smtp_configs:
+            connection = get_connection(get_backend(alias))
+            if not isinstance(connection, SMTPEmailBackend):
+                connection = None
+            self._smtp_configs[alias] = connection
+        return self._smtp_configs[alias]
+
+    async def send_all(self, emails, sent_emails, failed_emails):
+        queue = asyncio.Queue()
+        for email in emails:
+            queue.put_nowait(email)
+        workers = [
+            asyncio.ensure_future(self.worker(queue, sent_emails, failed_emails))
+            for i in range(min(self.concurrency, len(emails)))
+        ]
+        await asyncio.gather(*workers)
+
+    async def worker(self, queue, sent_emails, failed_emails):
+        # Each worker keeps one session per backend alias open until the queue is drained
+        sessions = {}
+        loop = asyncio.get_event_loop()
+        try:
+            while not queue.empty():
+                email = queue.get_nowait()
+                alias = email.backend_alias or 'default'
+                try:
+                    if self.throttle is not None:
+                        await self.throttle.wait_async(email)
+                    smtp_connection = self.get_smtp_connection(alias)
+                    if smtp_connection is None:
+                        await loop.run_in_executor(None, self.dispatch, email)
+                    else:
+                        if alias not in sessions:
+                            sessions[alias] = AsyncSMTPBackend(smtp_connection)
+                        await sessions[alias].send_message(email.email_message())
+                except Exception as e:
+                    logger.debug('Failed to send email #%d' % email.id)
+                    failed_emails.append((email, e))
+                else:
+                    logger.debug('Successfully sent email #%d' % email.id)
+                    sent_emails.append(email)
+        finally:
+            for session in sessions.values():
+                await session.close()
+
+    def dispatch(self, email):
+        email.dispatch(log_level=self.log_level, commit=False,
+                       disconnect_after_delivery=False)
@@ -7,8 +7,11 @@ class PostOfficeConfig(AppConfig):
     verbose_name = _("Post Office")
 
     def ready(self):
-        from post_office import tasks
+        from post_office import tasks, wakeup
+        from post_office.settings import get_wakeup_config
         from post_office.signals import email_queued
 
         if hasattr(tasks, 'queued_mail_handler'):
             email_queued.connect(tasks.queued_mail_handler)
+        if get_wakeup_config():
+            email_queued.connect(wakeup.queued_mail_handler)
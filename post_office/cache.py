@@ -1,3 +1,6 @@
+from collections import OrderedDict
+from threading import Lock
+
 from django.template.defaultfilters import slugify
 
 from .settings import get_cache_backend
@@ -24,3 +27,60 @@ def get(name):
 
 def delete(name):
     return cache_backend.delete(get_cache_key(name))
+
+
+class LRUCache:
+    """
+    A process local, thread safe cache holding items whose sizes add up to at
+    most ``max_size``. The size of an item is given by ``get_size(value)``,
+    by default each item counts as one. Least recently used items are evicted
+    first.
+    """
+
+    def __init__(self, max_size, get_size=None):
+        self.get_size = get_size or (lambda value: 1)
+        self.size = 0
+        self._items = OrderedDict()
+        self._lock = Lock()
+        self.max_size = max_size
+
+    @property
+    def max_size(self):
+        return self._max_size
+
+    @max_size.setter
+    def max_size(self, max_size):
+        with self._lock:
+            self._max_size = max_size
+            self._evict()
+
+    def _evict(self):
+        while self.size > self._max_size:
+            self.size -= self._items.popitem(last=False)[1][1]
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                self._items.move_to_end(key)
+            except KeyError:
+                return default
+            return self._items[key][0]
+
+    def set(self, key, value):
+        size = self.get_size(value)
+        if size > self.max_size:
+            return
+        with self._lock:
+            if key in self._items:
+                self.size -= self._items.pop(key)[1]
+            self._items[key] = (value, size)
+            self.size += size
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self._items)
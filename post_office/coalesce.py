@@ -0,0 +1,138 @@
+import copy
+import smtplib
+from collections import OrderedDict
+from email.mime.base import MIMEBase
+
+from django.conf import settings
+from django.core.mail.backends.smtp import EmailBackend as SMTPEmailBackend
+from django.core.mail.message import sanitize_address
+
+from .connections import connections
+from .render import PrerenderedEmailMessage
+from .streaming import EmailBackend as StreamingEmailBackend, StreamingAttachment, get_streaming_attachments
+
+# Headers which may differ between coalesced messages, the To header of
+# a coalesced message doesn't disclose its recipients
+IGNORED_HEADERS = ('message-id', 'to')
+UNDISCLOSED_RECIPIENTS = 'undisclosed-recipients:;'
+
+
+def get_coalescing_key(email):
+    """
+    Returns a key identifying the content of the prepared message of ``email``,
+    equal for messages which only differ in their To and Bcc recipients and
+    Message-ID, or None if the message can't be coalesced.
+
+    Messages serialized by render processes can't be coalesced: their content
+    isn't known apart from their bytes, which also hold their own recipients.
+    """
+    message = email.email_message()
+    if isinstance(message, PrerenderedEmailMessage) or message.cc or not message.recipients():
+        return None
+
+    attachments = []
+    for attachment in message.attachments:
+        if isinstance(attachment, StreamingAttachment):
+            attachments.append(('streaming', attachment.attachment.pk))
+        elif isinstance(attachment, MIMEBase):
+            attachments.append(attachment.as_bytes())
+        else:
+            attachments.append(tuple(attachment))
+    headers = tuple(sorted(
+        (name.lower(), value) for name, value in message.extra_headers.items()
+        if name.lower() not in IGNORED_HEADERS
+    ))
+    return (
+        email.backend_alias or 'default', type(message), message.from_email, message.subject,
+        message.body, message.content_subtype, message.mixed_subtype,
+        tuple(getattr(message, 'alternatives', ())), tuple(attachments), headers,
+        tuple(message.reply_to), message.encoding,
+    )
+
+
+def coalesce_emails(emails, max_recipients):
+    """
+    Groups prepared ``emails`` with identical content, in lists of emails
+    having up to ``max_recipients`` recipients in total. Returns the list of
+    groups, in the order of their first email.
+    """
+    groups = []
+    open_groups = OrderedDict()
+    for email in emails:
+        key = get_coalescing_key(email)
+        recipient_count = len(email.email_message().recipients())
+        if key is None or recipient_count >= max_recipients:
+            groups.append([email])
+            continue
+        group = open_groups.get(key)
+        if group is None or group[1] + recipient_count > max_recipients:
+            group = [[], 0]
+            open_groups[key] = group
+            groups.append(group[0])
+        group[0].append(email)
+        group[1] += recipient_count
+    return groups
+
+
+def get_coalesced_message(emails):
+    """
+    Returns a message with the content of the first of ``emails``, sent to
+    the recipients of all of them as blind carbon copies.
+    """
+    message = copy.copy(emails[0].email_message())
+    recipients = []
+    for email in emails:
+        recipients.extend(email.email_message().recipients())
+    message.to, message.cc, message.bcc = [], [], recipients
+    message.extra_headers = {name: value for name, value in message.extra_headers.items()
+                             if name.lower() != 'to'}
+    message.extra_headers['To'] = UNDISCLOSED_RECIPIENTS
+    return message
+
+
+def send_message(message):
+    """
+    Sends ``message`` and returns the recipients refused by the server, as a
+    dict like the one returned by ``smtplib.SMTP.sendmail()``. Connections
+    other than Django's SMTP backend don't report refused recipients.
+    """
+    connection = message.connection
+    if not isinstance(connection, SMTPEmailBackend):
+        message.send()
+        return {}
+
+    encoding = message.encoding or settings.DEFAULT_CHARSET
+    from_email = sanitize_address(message.from_email, encoding)
+    recipients = [sanitize_address(address, encoding) for address in message.recipients()]
+    mime_message = message.message()
+    with connection._lock:
+        connection.open()
+        if connection.connection is None:
+            raise smtplib.SMTPServerDisconnected('Connection to %s failed' % connection.host)
+        if isinstance(connection, StreamingEmailBackend) and get_streaming_attachments(mime_message):
+            return connection.sendmail(from_email, recipients, mime_message)
+        return connection.connection.sendmail(from_email, recipients,
+                                              mime_message.as_bytes(linesep='\r\n'))
+
+
+def send_coalesced(emails):
+    """
+    Sends ``emails`` with identical content as a single message. Returns the
+    emails some recipients of which were refused by the server, as a list of
+    two tuples (email, exception); the other emails were delivered.
+    """
+    message = get_coalesced_message(emails)
+    with connections.sending(emails[0].backend_alias or 'default') as connection:
+        message.connection = connection
+        refused = send_message(message)
+    if not refused:
+        return []
+
+    encoding = message.encoding or settings.DEFAULT_CHARSET
+    failed_emails = []
+    for email in emails:
+        addresses = [sanitize_address(address, encoding) for address in email.email_message().recipients()]
+        email_refused = {address: refused[address] for address in addresses if address in refused}
+        if email_refused:
+            failed_emails.append((email, smtplib.SMTPRecipientsRefused(email_refused)))
+    return failed_emails
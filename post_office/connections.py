@@ -1,8 +1,161 @@
-from threading import local
+import time
+from collections import deque
+from contextlib import contextmanager
+from threading import Condition, Lock, local
 
 from django.core.mail import get_connection
 
-from .settings import get_backend
+from .settings import get_backend, get_connection_pool_options
+
+
+def get_backend_connection(alias):
+    """
+    Returns a new connection of the backend ``alias``, which isn't opened yet.
+    Backends open such connections on their own when sending messages.
+    """
+    try:
+        backend = get_backend(alias)
+    except KeyError:
+        raise KeyError('%s is not a valid backend alias' % alias)
+    return get_connection(backend)
+
+
+class ConnectionPool:
+    """
+    Keeps open connections of a backend alias around, so that they can be
+    reused across batches instead of being reconnected every time.
+
+    ``max_size`` bounds the number of connections open at the same time,
+    ``max_messages`` recycles a connection after that many messages and
+    ``idle_timeout`` closes connections unused for that many seconds. Before
+    being reused, SMTP connections idle for more than ``check_after`` seconds
+    are checked to be alive with a NOOP command.
+
+    Pools which aren't ``persistent`` only share connections between the
+    threads of a batch, their idle connections are closed at its end.
+    """
+
+    check_after = 1
+
+    def __init__(self, alias, min_size=0, max_size=None, max_messages=None, idle_timeout=None,
+                 persistent=True):
+        self.alias = alias
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_messages = max_messages
+        self.idle_timeout = idle_timeout
+        self.persistent = persistent
+        self._condition = Condition()
+        # Idle connections as (connection, last used time, number of messages sent)
+        self._idle = deque()
+        self._messages = {}
+        self._size = 0
+
+    def create_connection(self):
+        connection = get_backend_connection(self.alias)
+        connection.open()
+        return connection
+
+    def fill(self):
+        """
+        Opens connections until there are at least ``min_size`` of them.
+        """
+        while True:
+            with self._condition:
+                if self._size >= self.min_size:
+                    return
+                self._size += 1
+            try:
+                connection = self.create_connection()
+            except Exception:
+                self._discard()
+                raise
+            self.release(connection)
+
+    def acquire(self):
+        while True:
+            with self._condition:
+                self._close_idle()
+                if self._idle:
+                    connection, last_used, messages = self._idle.pop()
+                elif self.max_size is None or self._size < self.max_size:
+                    self._size += 1
+                    break
+                else:
+                    self._condition.wait()
+                    continue
+
+            if time.monotonic() - last_used < self.check_after or self.is_alive(connection):
+                self._messages[id(connection)] = messages
+                return connection
+            self._close(connection)
+
+        try:
+            connection = self.create_connection()
+        except Exception:
+            self._discard()
+            raise
+        self._messages[id(connection)] = 0
+        return connection
+
+    def release(self, connection, messages_sent=0):
+        messages = self._messages.pop(id(connection), 0) + messages_sent
+        if self.max_messages and messages >= self.max_messages:
+            self._close(connection)
+            return
+        with self._condition:
+            self._idle.append((connection, time.monotonic(), messages))
+            self._condition.notify()
+
+    def discard(self, connection):
+        """
+        Closes an acquired connection which may be in an undefined state,
+        instead of giving it back.
+        """
+        self._messages.pop(id(connection), None)
+        self._close(connection)
+
+    def close(self):
+        with self._condition:
+            idle, self._idle = self._idle, deque()
+        for connection, last_used, messages in idle:
+            self._close(connection)
+
+    def is_alive(self, connection):
+        smtp = getattr(connection, 'connection', None)
+        if smtp is None or not hasattr(smtp, 'noop'):
+            # Not an SMTP connection, nothing to check
+            return True
+        try:
+            return smtp.noop()[0] == 250
+        except Exception:
+            return False
+
+    def _close_idle(self):
+        if not self.idle_timeout:
+            return
+        expired = time.monotonic() - self.idle_timeout
+        # Idle connections are sorted by the time they have been released
+        while self._idle and self._idle[0][1] < expired:
+            connection, last_used, messages = self._idle.popleft()
+            self._size -= 1
+            self._condition.notify()
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+    def _close(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+        self._discard()
+
+    def _discard(self):
+        with self._condition:
+            self._size -= 1
+            self._condition.notify()
 
 
 # Copied from Django 1.8's django.core.cache.CacheHandler
@@ -11,9 +164,14 @@ class ConnectionHandler:
     A Cache Handler to manage access to Cache instances.
 
     Ensures only one instance of each alias exists per thread.
+    Connections are taken from, and given back to a pool per alias shared by
+    all threads. Aliases configured in ``CONNECTION_POOL`` keep their pool
+    across batches.
     """
     def __init__(self):
         self._connections = local()
+        self._pools = {}
+        self._pools_lock = Lock()
 
     def __getitem__(self, alias):
         try:
@@ -23,22 +181,76 @@ class ConnectionHandler:
         except KeyError:
             pass
 
-        try:
-            backend = get_backend(alias)
-        except KeyError:
-            raise KeyError('%s is not a valid backend alias' % alias)
-
-        connection = get_connection(backend)
-        connection.open()
+        connection = self.get_pool(alias).acquire()
         self._connections.connections[alias] = connection
         return connection
 
+    @contextmanager
+    def sending(self, alias):
+        """
+        Checks out a connection of ``alias`` to send a single message with, so
+        that threads sending at the same time each use a connection of their
+        own. The connection is given back afterwards, or closed if sending fails.
+        """
+        pool = self.get_pool(alias)
+        connection = pool.acquire()
+        try:
+            yield connection
+        except BaseException:
+            pool.discard(connection)
+            raise
+        pool.release(connection, messages_sent=1)
+
+    def get_pool(self, alias):
+        with self._pools_lock:
+            if alias not in self._pools:
+                options = get_connection_pool_options(alias)
+                if options is None:
+                    self._pools[alias] = ConnectionPool(alias, persistent=False)
+                else:
+                    self._pools[alias] = ConnectionPool(
+                        alias,
+                        min_size=options.get('MIN_SIZE', 0),
+                        max_size=options.get('MAX_SIZE'),
+                        max_messages=options.get('MAX_MESSAGES'),
+                        idle_timeout=options.get('IDLE_TIMEOUT'),
+                    )
+            pool = self._pools[alias]
+        pool.fill()
+        return pool
+
     def all(self):
         return getattr(self._connections, 'connections', {}).values()
 
     def close(self):
-        for connection in self.all():
-            connection.close()
+        """
+        Gives the connections of the current thread back to their pool, and
+        closes the idle connections of aliases which aren't pooled.
+        """
+        connections = getattr(self._connections, 'connections', {})
+        self._connections.connections = {}
+        for alias, connection in connections.items():
+            self.get_pool(alias).release(connection)
+        with self._pools_lock:
+            pools = list(self._pools.values())
+        for pool in pools:
+            if not pool.persistent:
+                pool.close()
+
+    def close_pools(self):
+        with self._pools_lock:
+            pools, self._pools = self._pools, {}
+        for pool in pools.values():
+            pool.close()
+
+    def reset(self):
+        """
+        Forgets all connections without closing them. To be called in forked
+        processes, which must not use connections inherited from their parent.
+        """
+        self._connections = local()
+        with self._pools_lock:
+            self._pools = {}
 
 
 connections = ConnectionHandler()
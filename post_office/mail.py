@@ -1,23 +1,38 @@
+import logging
+import os
+import threading
+import time
+
 from django.conf import settings
 from django.core.exceptions import ValidationError
-from django.db import connection as db_connection
-from django.db.models import Q
+from django.db import connection as db_connection, transaction
+from django.db.models import Max, Q
 from django.template import Context, Template
 from django.utils import timezone
 from email.utils import make_msgid
+from itertools import islice
 from multiprocessing import Pool
 from multiprocessing.dummy import Pool as ThreadPool
+from multiprocessing.util import Finalize
 
+from .coalesce import coalesce_emails, send_coalesced
 from .connections import connections
 from .logutils import setup_loghandlers
-from .models import Email, EmailTemplate, Log, PRIORITY, STATUS
+from .models import Attachment, Email, EmailTemplate, Log, PRIORITY, Recipient, STATUS
+from .pgcopy import copy_emails, supports_copy
+from .render import render_email_messages
+from .retry import get_retry_policy
 from .settings import (
-    get_available_backends, get_batch_size, get_log_level, get_max_retries, get_message_id_enabled,
-    get_message_id_fqdn, get_retry_timedelta, get_sending_order, get_threads_per_process,
+    get_available_backends, get_batch_size, get_claim_emails, get_coalesce_messages, get_group_by_domain,
+    get_lease_duration, get_log_level, get_max_retries, get_message_id_enabled, get_message_id_fqdn,
+    get_process_chunk_size, get_render_processes, get_send_many_batch_size, get_send_many_copy,
+    get_sending_engine, get_sending_order, get_store_recipients, get_threads_per_process,
 )
 from .signals import email_queued
+from .throttle import get_throttle
 from .utils import (
-    create_attachments, get_email_template, parse_emails, parse_priority, split_emails,
+    create_attachments, get_email_template, get_lease_owner, parse_emails, parse_priority,
+    sort_by_domain,
 )
 
 logger = setup_loghandlers("INFO")
@@ -31,7 +46,27 @@ def create(sender, recipients=None, cc=None, bcc=None, subject='', message='',
     Creates an email from supplied keyword arguments. If template is
     specified, email subject and content will be rendered during delivery.
     """
-    priority = parse_priority(priority)
+    email = _build_email(
+        Template, sender, recipients, cc, bcc, subject, message, html_message, context,
+        scheduled_time, expires_at, headers, template, parse_priority(priority),
+        render_on_delivery, backend,
+    )
+
+    if commit:
+        email.save()
+        if get_store_recipients():
+            Recipient.objects.create_for_emails([email])
+
+    return email
+
+
+def _build_email(compile_template, sender, recipients, cc, bcc, subject, message, html_message,
+                 context, scheduled_time, expires_at, headers, template, priority,
+                 render_on_delivery, backend):
+    """
+    Returns an unsaved email, see ``create()``. ``compile_template`` compiles
+    the template strings of emails which aren't rendered on delivery.
+    """
     status = None if priority == PRIORITY.now else STATUS.queued
 
     if recipients is None:
@@ -67,9 +102,9 @@ def create(sender, recipients=None, cc=None, bcc=None, subject='', message='',
             html_message = template.html_content
 
         _context = Context(context or {})
-        subject = Template(subject).render(_context)
-        message = Template(message).render(_context)
-        html_message = Template(html_message).render(_context)
+        subject = compile_template(subject).render(_context)
+        message = compile_template(message).render(_context)
+        html_message = compile_template(html_message).render(_context)
 
         email = Email(
             from_email=sender,
@@ -86,9 +121,6 @@ def create(sender, recipients=None, cc=None, bcc=None, subject='', message='',
             backend_alias=backend
         )
 
-    if commit:
-        email.save()
-
     return email
 
 
@@ -161,16 +193,178 @@ def send(recipients=None, sender=None, template=None, context=None, subject='',
     return email
 
 
-def send_many(kwargs_list):
+class BulkEmailBuilder:
     """
-    Similar to mail.send(), but this function accepts a list of kwargs.
+    Builds unsaved emails from the keyword arguments of ``send()``, like
+    ``send(commit=False, **kwargs)`` does. Templates, backend aliases and email
+    addresses are resolved once per distinct value, and the template strings
+    of emails which aren't rendered on delivery are compiled once per source.
+    """
+
+    def __init__(self):
+        self.backends = get_available_backends()
+        self.valid_addresses = set()
+        self.templates = {}
+        self.compiled_templates = {}
+
+    def clear(self):
+        """
+        Forgets validated addresses and compiled templates, whose number grows
+        with the number of emails built.
+        """
+        self.valid_addresses.clear()
+        self.compiled_templates.clear()
+
+    def parse_emails(self, emails, field):
+        if isinstance(emails, str):
+            emails = [emails]
+        elif emails is None:
+            emails = []
+        unknown = [email for email in emails if email not in self.valid_addresses]
+        try:
+            parse_emails(unknown)
+        except ValidationError as e:
+            raise ValidationError('%s: %s' % (field, e.message))
+        self.valid_addresses.update(unknown)
+        return emails
+
+    def get_template(self, template, language):
+        key = (template.pk if isinstance(template, EmailTemplate) else template, language)
+        if key not in self.templates:
+            if isinstance(template, EmailTemplate):
+                # If language is specified, ensure template uses the right language
+                if language and template.language != language:
+                    template = template.translated_templates.get(language=language)
+            else:
+                template = get_email_template(template, language)
+            self.templates[key] = template
+        return self.templates[key]
+
+    def compile_template(self, source):
+        if source not in self.compiled_templates:
+            self.compiled_templates[source] = Template(source)
+        return self.compiled_templates[source]
+
+    def build(self, recipients=None, sender=None, template=None, context=None, subject='',
+              message='', html_message='', scheduled_time=None, expires_at=None, headers=None,
+              priority=None, attachments=None, render_on_delivery=False,
+              log_level=None, commit=True, cc=None, bcc=None, language='',
+              backend=''):
+        recipients = self.parse_emails(recipients, 'recipients')
+        cc = self.parse_emails(cc, 'cc')
+        bcc = self.parse_emails(bcc, 'bcc')
+
+        if sender is None:
+            sender = settings.DEFAULT_FROM_EMAIL
+
+        priority = parse_priority(priority)
+        if priority == PRIORITY.now:
+            raise ValueError("send_many() can't be used with priority = 'now'")
+        if attachments:
+            raise ValueError("send_many() only supports attachments shared by all emails, "
+                             "pass them as its attachments argument")
+
+        if template:
+            if subject:
+                raise ValueError('You can\'t specify both "template" and "subject" arguments')
+            if message:
+                raise ValueError('You can\'t specify both "template" and "message" arguments')
+            if html_message:
+                raise ValueError('You can\'t specify both "template" and "html_message" arguments')
+            template = self.get_template(template, language)
+
+        if backend and backend not in self.backends:
+            raise ValueError('%s is not a valid backend alias' % backend)
+
+        return _build_email(
+            self.compile_template, sender, recipients, cc, bcc, subject, message, html_message,
+            context, scheduled_time, expires_at, headers, template, priority,
+            render_on_delivery, backend,
+        )
+
+
+def send_many(kwargs_list, attachments=None):
+    """
+    Similar to mail.send(), but this function accepts an iterable of kwargs.
     Internally, it uses Django's bulk_create command for efficiency reasons.
+    ``kwargs_list`` is consumed in chunks of ``SEND_MANY_BATCH_SIZE``, each of
+    which is inserted in its own transaction, so that memory usage doesn't
+    grow with the number of emails.
+    ``attachments`` are attached to all emails: they are created once and
+    linked to the emails with bulk inserts. Without attachments, with
+    ``STORE_RECIPIENTS`` disabled and ``SEND_MANY_COPY`` enabled, emails are
+    inserted with PostgreSQL's COPY.
     Currently send_many() can't be used to send emails with priority = 'now'.
     """
-    emails = [send(commit=False, **kwargs) for kwargs in kwargs_list]
-    if emails:
-        Email.objects.bulk_create(emails)
+    builder = BulkEmailBuilder()
+    batch_size = get_send_many_batch_size()
+    kwargs_iterator = iter(kwargs_list)
+    created_attachments = None
+    while True:
+        emails = [builder.build(**kwargs) for kwargs in islice(kwargs_iterator, batch_size)]
+        if not emails:
+            break
+        if attachments and created_attachments is None:
+            created_attachments = create_attachments(attachments)
+        with transaction.atomic():
+            _insert_emails(emails, created_attachments)
         email_queued.send(sender=Email, emails=emails)
+        builder.clear()
+
+
+def _insert_emails(emails, attachments):
+    store_recipients = get_store_recipients()
+    if attachments or store_recipients:
+        # The primary keys of the emails are needed to link attachments and recipients
+        _bulk_create_with_pks(emails)
+        if attachments:
+            Through = Attachment.emails.through
+            Through.objects.bulk_create([
+                Through(attachment_id=attachment.pk, email_id=email.pk)
+                for email in emails for attachment in attachments
+            ])
+        if store_recipients:
+            Recipient.objects.create_for_emails(emails)
+    elif get_send_many_copy() and supports_copy():
+        copy_emails(emails)
+    else:
+        Email.objects.bulk_create(emails)
+
+
+def _bulk_create_with_pks(emails):
+    """
+    Bulk inserts ``emails`` and sets their primary keys. Databases which don't
+    return them from bulk inserts have the emails looked up by Message-ID among
+    the rows inserted after the last existing email. Emails without a Message-ID
+    are given a unique one for the time of the lookup.
+    """
+    features = db_connection.features
+    # Named can_return_ids_from_bulk_insert before Django 3.0
+    if getattr(features, 'can_return_rows_from_bulk_insert',
+               getattr(features, 'can_return_ids_from_bulk_insert', False)):
+        Email.objects.bulk_create(emails)
+        return
+
+    last_pk = Email.objects.aggregate(last_pk=Max('pk'))['last_pk'] or 0
+    marked_emails = [email for email in emails if not email.message_id]
+    for email in marked_emails:
+        email.message_id = make_msgid(domain='post-office.invalid')
+    Email.objects.bulk_create(emails)
+
+    # Looked up in chunks, to stay below the databases' limits of query parameters
+    batch_size = get_batch_size()
+    pks = {}
+    for i in range(0, len(emails), batch_size):
+        message_ids = [email.message_id for email in emails[i:i + batch_size]]
+        pks.update(Email.objects.filter(pk__gt=last_pk, message_id__in=message_ids)
+                   .values_list('message_id', 'pk'))
+    for email in emails:
+        email.pk = pks[email.message_id]
+    for i in range(0, len(marked_emails), batch_size):
+        Email.objects.filter(pk__in=[email.pk for email in marked_emails[i:i + batch_size]]) \
+            .update(message_id=None)
+    for email in marked_emails:
+        email.message_id = None
 
 
 def get_queued():
@@ -179,22 +373,121 @@ def get_queued():
      - Status is queued or requeued
      - Has scheduled_time before the current time or is None
      - Has expires_at after the current time or is None
+
+    If ``CLAIM_EMAILS`` is enabled, the returned emails are also leased to the
+    calling process and marked as ``sending``, so that other processes won't
+    pick them up.
     """
     now = timezone.now()
-    query = (
-        (Q(status=STATUS.queued) | Q(status=STATUS.requeued)) &
+    if get_claim_emails():
+        return claim_emails(get_queued_queryset(now), now)
+
+    return get_queued_queryset(now) \
+                .select_related('template') \
+                .order_by(*get_sending_order()).prefetch_related('attachments')[:get_batch_size()]
+
+
+def get_queued_queryset(now=None):
+    """
+    Returns a queryset of the emails waiting to be sent at ``now``, which
+    defaults to the current time.
+    """
+    if now is None:
+        now = timezone.now()
+    return Email.objects.filter(
+        Q(status__in=[STATUS.queued, STATUS.requeued]) &
         (Q(scheduled_time__lte=now) | Q(scheduled_time__isnull=True)) &
         (Q(expires_at__gt=now) | Q(expires_at__isnull=True))
     )
-    return Email.objects.filter(query) \
-                .select_related('template') \
-                .order_by(*get_sending_order()).prefetch_related('attachments')[:get_batch_size()]
+
+
+def claim_emails(queryset, now=None):
+    """
+    Atomically leases a batch of emails from ``queryset`` to the current
+    process. On databases supporting ``SELECT ... FOR UPDATE SKIP LOCKED``,
+    rows locked by concurrent senders are skipped instead of waited for,
+    so multiple senders can drain the same queue without sending an email twice.
+    """
+    if now is None:
+        now = timezone.now()
+
+    lock_kwargs = {}
+    if db_connection.features.has_select_for_update_skip_locked:
+        lock_kwargs['skip_locked'] = True
+
+    with transaction.atomic():
+        email_ids = list(
+            queryset.select_for_update(**lock_kwargs)
+                    .order_by(*get_sending_order())
+                    .values_list('id', flat=True)[:get_batch_size()]
+        )
+        # Without SKIP LOCKED (e.g. SQLite), rows aren't locked and a concurrent
+        # sender may have claimed some of them since they were selected: only
+        # emails still matching ``queryset`` are leased, and only emails leased
+        # by this process are returned
+        lease_emails(email_ids, now, queryset=queryset)
+
+    return list(Email.objects.filter(id__in=email_ids, status=STATUS.sending, lease_owner=get_lease_owner())
+                .select_related('template')
+                .order_by(*get_sending_order()).prefetch_related('attachments'))
+
+
+def lease_emails(email_ids, now=None, queryset=None):
+    """
+    Marks emails as being sent by the current process until their lease
+    expires. Emails still in ``sending`` state after that are considered
+    stuck and requeued by ``utils.requeue_stuck_emails()``.
+
+    If ``queryset`` is given, only emails still matching it are leased.
+    """
+    if now is None:
+        now = timezone.now()
+    if queryset is None:
+        queryset = Email.objects.all()
+    return queryset.filter(id__in=email_ids).update(
+        status=STATUS.sending,
+        lease_owner=get_lease_owner(),
+        lease_expires_at=now + get_lease_duration(),
+    )
+
+
+def renew_leases(email_ids, now=None):
+    """
+    Extends the lease of emails still being sent, so that emails of a batch
+    which are only sent after a while aren't requeued in the meantime.
+    """
+    if now is None:
+        now = timezone.now()
+    return Email.objects.filter(id__in=email_ids, status=STATUS.sending) \
+        .update(lease_expires_at=now + get_lease_duration())
+
+
+def mark_sending(emails):
+    """
+    Marks emails as being in flight, unless they have already been claimed
+    by ``get_queued()``.
+    """
+    unleased_emails = [email for email in emails if email.status != STATUS.sending]
+    if unleased_emails:
+        lease_emails([email.id for email in unleased_emails])
+        for email in unleased_emails:
+            email.status = STATUS.sending
 
 
 def send_queued(processes=1, log_level=None):
     """
     Sends out all queued mails that has scheduled_time less than now or None
     """
+    sending_engine = get_sending_engine()
+    if sending_engine == 'pipeline':
+        # Drains the whole queue in a single process, run several senders
+        # with CLAIM_EMAILS enabled to use more processes
+        from .pipeline import SendingPipeline
+        return SendingPipeline(log_level=log_level).run()
+    elif sending_engine == 'asyncio':
+        from .aio import AsyncSender
+        return AsyncSender(log_level=log_level).run()
+
     queued_emails = get_queued()
     total_sent, total_failed, total_requeued = 0, 0, 0
     total_email = len(queued_emails)
@@ -217,15 +510,29 @@ def send_queued(processes=1, log_level=None):
                 log_level=log_level,
             )
         else:
-            email_lists = split_emails(queued_emails, processes)
-
-            pool = Pool(processes)
-            results = pool.map(_send_bulk, email_lists)
-            pool.terminate()
-
-            total_sent = sum(result[0] for result in results)
-            total_failed = sum(result[1] for result in results)
-            total_requeued = [result[2] for result in results]
+            # Processes take small chunks of emails from a shared queue as
+            # they become idle, so that a slow mail server only holds up the
+            # process sending to it
+            queued_emails = list(queued_emails)
+            if get_group_by_domain():
+                queued_emails = sort_by_domain(queued_emails)
+            chunk_size = get_process_chunk_size() or \
+                max(1, min(get_threads_per_process() * 2, total_email // processes))
+            chunks = [(queued_emails[i:i + chunk_size], log_level)
+                      for i in range(0, total_email, chunk_size)]
+
+            pool = Pool(processes, initializer=_init_process)
+            started = time.monotonic()
+            busy_times = {}
+            for pid, busy_time, result in pool.imap_unordered(_send_chunk, chunks):
+                busy_times[pid] = busy_times.get(pid, 0) + busy_time
+                total_sent += result[0]
+                total_failed += result[1]
+                total_requeued += result[2]
+            # Let processes exit on their own, closing their connections
+            pool.close()
+            pool.join()
+            _log_utilization('Process', busy_times, time.monotonic() - started)
 
     logger.info(
         '%s emails attempted, %s sent, %s failed, %s requeued',
@@ -235,13 +542,54 @@ def send_queued(processes=1, log_level=None):
     return total_sent, total_failed, total_requeued
 
 
-def _send_bulk(emails, uses_multiprocessing=True, log_level=None):
+def _init_process():
     # Multiprocessing does not play well with database connection
     # Fix: Close connections on forking process
     # https://groups.google.com/forum/#!topic/django-users/eCAIY9DAfG0
-    if uses_multiprocessing:
-        db_connection.close()
+    db_connection.close()
+    connections.reset()
+    # Backend connections are kept open across the chunks sent by the process,
+    # and closed when the pool shuts it down
+    Finalize(connections, _close_connections, exitpriority=10)
+
+
+def _close_connections():
+    connections.close()
+    connections.close_pools()
 
+
+def _send_chunk(args):
+    """
+    Sends a chunk of emails in a process of the multiprocessing pool. Returns
+    the process id, the time spent sending and the result of ``_send_bulk()``.
+    """
+    emails, log_level = args
+    started = time.monotonic()
+    # Chunks of a batch are sent one after the other, the lease taken when
+    # the batch was fetched may be about to expire
+    renew_leases([email.id for email in emails])
+    result = _send_bulk(emails, uses_multiprocessing=True, log_level=log_level,
+                        close_connections=False)
+    return os.getpid(), time.monotonic() - started, result
+
+
+def _log_utilization(kind, busy_times, elapsed, level=logging.INFO):
+    """
+    Logs the share of ``elapsed`` seconds each worker spent working, given
+    their ``busy_times`` in seconds.
+    """
+    if not busy_times or not elapsed:
+        return
+    utilizations = [min(busy_time / elapsed, 1) for busy_time in busy_times.values()]
+    logger.log(
+        level, '%s utilization over %.2fs: %s (average %.0f%%)', kind, elapsed,
+        ', '.join('%s %.0f%%' % (worker, utilization * 100)
+                  for worker, utilization in zip(busy_times, utilizations)),
+        sum(utilizations) / len(utilizations) * 100,
+    )
+
+
+def _send_bulk(emails, uses_multiprocessing=True, log_level=None, close_connections=True):
     if log_level is None:
         log_level = get_log_level()
 
@@ -251,8 +599,13 @@ def _send_bulk(emails, uses_multiprocessing=True, log_level=None):
 
     logger.info('Process started, sending %s emails' % email_count)
 
+    mark_sending(emails)
+    throttle = get_throttle()
+
     def send(email):
         try:
+            if throttle is not None:
+                throttle.wait(email)
             email.dispatch(log_level=log_level, commit=False,
                            disconnect_after_delivery=False)
             sent_emails.append(email)
@@ -261,39 +614,119 @@ def _send_bulk(emails, uses_multiprocessing=True, log_level=None):
             logger.debug('Failed to send email #%d' % email.id)
             failed_emails.append((email, e))
 
-    # Prepare emails before we send these to threads for sending
-    # So we don't need to access the DB from within threads
-    for email in emails:
-        # Sometimes this can fail, for example when trying to render
-        # email from a faulty Django template
+    def send_group(emails):
+        # Emails with identical content, sent as a single message
+        if len(emails) == 1:
+            return send(emails[0])
         try:
-            email.prepare_email_message()
+            if throttle is not None:
+                # Rate limits apply to each email, whether coalesced or not
+                for email in emails:
+                    throttle.wait(email)
+            refused = send_coalesced(emails)
         except Exception as e:
-            failed_emails.append((email, e))
+            logger.debug('Failed to send emails %s' % ', '.join('#%d' % email.id for email in emails))
+            failed_emails.extend((email, e) for email in emails)
+            return
+        refused_ids = {email.id for email, exception in refused}
+        delivered = [email for email in emails if email.id not in refused_ids]
+        sent_emails.extend(delivered)
+        failed_emails.extend(refused)
+        if delivered:
+            logger.debug('Successfully sent emails %s' % ', '.join('#%d' % email.id for email in delivered))
+        if refused:
+            logger.debug('Failed to send emails %s' % ', '.join('#%d' % email.id for email, _ in refused))
+
+    # Prepare emails before we send these to threads for sending
+    # So we don't need to access the DB from within threads
+    # Unless running in a process of the multiprocessing pool, which can't
+    # start processes on its own, rendering may be spread over processes
+    render_processes = get_render_processes()
+    if render_processes and not uses_multiprocessing:
+        prepared = render_email_messages(emails, render_processes)
+    else:
+        prepared = Email.objects.prepare_messages(emails)
+
+    prepared_emails = []
+    for email, exception in prepared:
+        if exception is None:
+            prepared_emails.append(email)
+        else:
+            failed_emails.append((email, exception))
 
     number_of_threads = min(get_threads_per_process(), email_count)
     pool = ThreadPool(number_of_threads)
 
-    pool.map(send, emails)
+    if get_group_by_domain():
+        # Emails to the same domain are sent close together, emails being
+        # prepared by template, put them back in sending order first
+        prepared_by_id = {email.id: email for email in prepared_emails}
+        prepared_emails = sort_by_domain(prepared_by_id[email.id] for email in emails
+                                         if email.id in prepared_by_id)
+    coalesce_messages = get_coalesce_messages()
+    if coalesce_messages:
+        send_item, items = send_group, coalesce_emails(prepared_emails, coalesce_messages)
+    else:
+        send_item, items = send, prepared_emails
+
+    busy_times = {}
+
+    def run(item):
+        started = time.monotonic()
+        send_item(item)
+        thread_id = threading.get_ident()
+        busy_times[thread_id] = busy_times.get(thread_id, 0) + time.monotonic() - started
+
+    # Threads take emails one at a time as they become idle
+    started = time.monotonic()
+    for _ in pool.imap_unordered(run, items):
+        pass
     pool.close()
     pool.join()
+    _log_utilization('Thread', busy_times, time.monotonic() - started, logging.DEBUG)
 
-    connections.close()
+    if close_connections:
+        connections.close()
+
+    num_failed, num_requeued = _update_statuses(sent_emails, failed_emails, log_level)
 
+    logger.info(
+        'Process finished, %s attempted, %s sent, %s failed, %s requeued',
+        email_count, len(sent_emails), num_failed, num_requeued,
+    )
+
+    return len(sent_emails), num_failed, num_requeued
+
+
+def _update_statuses(sent_emails, failed_emails, log_level):
+    """
+    Persists the outcome of a delivery attempt: ``sent_emails`` is a list of
+    emails, ``failed_emails`` a list of two tuples (email, exception).
+    Failed emails are requeued as long as they haven't reached ``MAX_RETRIES``.
+    Returns the number of failed and requeued emails.
+    """
     # Update statuses of sent emails
     email_ids = [email.id for email in sent_emails]
-    Email.objects.filter(id__in=email_ids).update(status=STATUS.sent)
+    Email.objects.filter(id__in=email_ids).update(status=STATUS.sent, lease_owner='',
+                                                  lease_expires_at=None)
 
-    # Update statuses and conditionally requeue failed emails
+    # Update statuses and conditionally requeue failed emails, when to retry
+    # them is decided by the retry policy
     num_failed, num_requeued = 0, 0
     max_retries = get_max_retries()
-    scheduled_time = timezone.now() + get_retry_timedelta()
+    retry_policy = get_retry_policy()
+    now = timezone.now()
     emails_failed = [email for email, _ in failed_emails]
 
-    for email in emails_failed:
+    for email, exception in failed_emails:
+        email.lease_owner = ''
+        email.lease_expires_at = None
         if email.number_of_retries is None:
             email.number_of_retries = 0
+        scheduled_time = None
         if email.number_of_retries < max_retries:
+            scheduled_time = retry_policy.get_scheduled_time(email, exception, now)
+        if scheduled_time is not None:
             email.number_of_retries += 1
             email.status = STATUS.requeued
             email.scheduled_time = scheduled_time
@@ -302,7 +735,8 @@ def _send_bulk(emails, uses_multiprocessing=True, log_level=None):
             email.status = STATUS.failed
             num_failed += 1
 
-    Email.objects.bulk_update(emails_failed, ['status', 'scheduled_time', 'number_of_retries'])
+    Email.objects.bulk_update(emails_failed, ['status', 'scheduled_time', 'number_of_retries',
+                                              'lease_owner', 'lease_expires_at'])
 
     # If log level is 0, log nothing, 1 logs only sending failures
     # and 2 means log both successes and failures
@@ -328,9 +762,4 @@ def _send_bulk(emails, uses_multiprocessing=True, log_level=None):
         if logs:
             Log.objects.bulk_create(logs)
 
-    logger.info(
-        'Process finished, %s attempted, %s sent, %s failed, %s requeued',
-        email_count, len(sent_emails), num_failed, num_requeued,
-    )
-
-    return len(sent_emails), num_failed, num_requeued
+    return num_failed, num_requeued
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from ...utils import requeue_stuck_emails
+
+
+class Command(BaseCommand):
+    help = 'Place mails whose sending lease has expired back in the queue.'
+
+    def handle(self, verbosity, **options):
+        num_emails = requeue_stuck_emails()
+        self.stdout.write("Requeued {0} stuck mails.".format(num_emails))
@@ -1,15 +1,17 @@
+import signal
 import tempfile
 import sys
+import threading
 
 from django.core.management.base import BaseCommand
-from django.db import connection
-from django.db.models import Q
-from django.utils.timezone import now
+from django.db import close_old_connections, connection
 
+from ...connections import connections
 from ...lockfile import FileLock, FileLocked
-from ...mail import send_queued
-from ...models import Email, STATUS
+from ...mail import get_queued_queryset, send_queued
 from ...logutils import setup_loghandlers
+from ...settings import get_claim_emails
+from ...wakeup import get_wakeup
 
 
 logger = setup_loghandlers()
@@ -17,6 +19,10 @@ default_lockfile = tempfile.gettempdir() + "/post_office"
 
 
 class Command(BaseCommand):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stopping = threading.Event()
+
     def add_arguments(self, parser):
         parser.add_argument(
             '-p', '--processes',
@@ -34,27 +40,114 @@ class Command(BaseCommand):
             type=int,
             help='"0" to log nothing, "1" to only log errors',
         )
+        parser.add_argument(
+            '-d', '--daemon',
+            action='store_true',
+            help='Keep running and poll for queued emails instead of exiting once the queue is empty',
+        )
+        parser.add_argument(
+            '--min-poll-interval',
+            type=float,
+            default=1.0,
+            help='Seconds to wait before polling an empty queue again in daemon mode, defaults to 1',
+        )
+        parser.add_argument(
+            '--max-poll-interval',
+            type=float,
+            default=60.0,
+            help='Upper bound in seconds of the polling interval in daemon mode, defaults to 60',
+        )
 
     def handle(self, *args, **options):
-        logger.info('Acquiring lock for sending queued emails at %s.lock' %
-                    options['lockfile'])
+        if options.get('daemon'):
+            previous_handlers = {
+                signum: signal.signal(signum, self.stop)
+                for signum in (signal.SIGTERM, signal.SIGINT)
+            }
+
         try:
-            with FileLock(options['lockfile']):
-
-                while 1:
-                    try:
-                        send_queued(options['processes'],
-                                    options.get('log_level'))
-                    except Exception as e:
-                        logger.error(e, exc_info=sys.exc_info(),
-                                     extra={'status_code': 500})
-                        raise
-
-                    # Close DB connection to avoid multiprocessing errors
-                    connection.close()
-
-                    if not Email.objects.filter(status=STATUS.queued) \
-                            .filter(Q(scheduled_time__lte=now()) | Q(scheduled_time=None)).exists():
-                        break
-        except FileLocked:
-            logger.info('Failed to acquire lock, terminating now.')
\ No newline at end of file
+            if get_claim_emails():
+                # Emails are leased row by row, so several senders may run concurrently
+                logger.info('Sending queued emails using claimed leases, no lock required.')
+                self.send_all(options)
+                return
+
+            logger.info('Acquiring lock for sending queued emails at %s.lock' %
+                        options['lockfile'])
+            try:
+                with FileLock(options['lockfile']):
+                    self.send_all(options)
+            except FileLocked:
+                logger.info('Failed to acquire lock, terminating now.')
+        finally:
+            if options.get('daemon'):
+                for signum, handler in previous_handlers.items():
+                    signal.signal(signum, handler)
+                wakeup = get_wakeup()
+                if wakeup is not None:
+                    wakeup.close()
+            connections.close_pools()
+
+    def stop(self, signum, frame):
+        """
+        Signal handler, lets the current batch finish before shutting down.
+        """
+        logger.info('Received signal %s, shutting down after the current batch.' % signum)
+        self.stopping.set()
+        wakeup = get_wakeup()
+        if wakeup is not None:
+            wakeup.interrupt()
+
+    def wait(self, timeout):
+        """
+        Sleeps until ``timeout`` elapses, the command is stopped or, if a wakeup
+        channel is configured, emails are queued. Returns True in the latter case.
+        """
+        wakeup = get_wakeup()
+        if wakeup is None:
+            self.stopping.wait(timeout)
+            return False
+        return wakeup.wait(timeout)
+
+    def send_all(self, options):
+        daemon = options.get('daemon', False)
+        min_poll_interval = options.get('min_poll_interval', 1.0)
+        max_poll_interval = options.get('max_poll_interval', 60.0)
+        poll_interval = min_poll_interval
+
+        while not self.stopping.is_set():
+            try:
+                send_queued(options['processes'],
+                            options.get('log_level'))
+            except Exception as e:
+                logger.error(e, exc_info=sys.exc_info(),
+                             extra={'status_code': 500})
+                if not daemon:
+                    raise
+                # The error may be transient, e.g. a lost database or SMTP
+                # connection: start afresh after backing off
+                connection.close()
+                self.wait(poll_interval)
+                poll_interval = min(poll_interval * 2, max_poll_interval)
+                continue
+
+            if daemon and options['processes'] == 1:
+                # Keep the DB connection open between batches, unless it's broken or too old
+                close_old_connections()
+            else:
+                # Close DB connection to avoid multiprocessing errors
+                connection.close()
+
+            if get_queued_queryset().exists():
+                # Drain the queue as fast as possible while there is work to do
+                poll_interval = min_poll_interval
+                continue
+
+            if not daemon:
+                break
+
+            # Back off exponentially while the queue stays empty
+            if self.wait(poll_interval):
+                poll_interval = min_poll_interval
+            else:
+                poll_interval = min(poll_interval * 2, max_poll_interval)
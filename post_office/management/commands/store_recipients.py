@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from ...utils import store_recipients
+
+
+class Command(BaseCommand):
+    help = 'Store the recipients of existing mails, to look them up by recipient.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-b', '--batch-size',
+                            type=int, default=1000,
+                            help="Number of mails processed at a time, defaults to 1000.")
+
+    def handle(self, verbosity, batch_size, **options):
+        num_emails = store_recipients(batch_size)
+        self.stdout.write("Stored recipients of {0} mails.".format(num_emails))
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('post_office', '0012_email_lease'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='email',
+            name='status',
+            field=models.PositiveSmallIntegerField(blank=True, choices=[(0, 'sent'), (1, 'failed'), (2, 'queued'), (3, 'requeued'), (4, 'sending')], db_index=True, null=True, verbose_name='Status'),
+        ),
+    ]
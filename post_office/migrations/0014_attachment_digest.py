@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('post_office', '0013_email_sending_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attachment',
+            name='digest',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, help_text='SHA-256 digest of the file, when deduplicated', max_length=64, verbose_name='Digest'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('post_office', '0014_attachment_digest'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Recipient',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('address', models.CharField(db_index=True, max_length=254, verbose_name='Address')),
+                ('type', models.PositiveSmallIntegerField(choices=[(0, 'To'), (1, 'Cc'), (2, 'Bcc')], verbose_name='Type')),
+                ('email', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recipients', to='post_office.Email', verbose_name='Email address')),
+            ],
+            options={
+                'verbose_name': 'Recipient',
+                'verbose_name_plural': 'Recipients',
+            },
+        ),
+    ]
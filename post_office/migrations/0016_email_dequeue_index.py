@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('post_office', '0015_recipient'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='email',
+            index=models.Index(condition=models.Q(status__in=[2, 3]), fields=['-priority', 'scheduled_time'], name='post_office_email_dequeue'),
+        ),
+    ]
@@ -1,27 +1,65 @@
 import os
 
-from collections import namedtuple
+from collections import OrderedDict, namedtuple
 from uuid import uuid4
 from email.mime.nonmultipart import MIMENonMultipart
+from email.utils import parseaddr
 
 from django.core.exceptions import ValidationError
 from django.core.mail import EmailMessage, EmailMultiAlternatives
 from django.db import models
+from django.db.models import Q, prefetch_related_objects
 from django.utils.encoding import smart_str
 from django.utils.translation import pgettext_lazy, gettext_lazy as _
 from django.utils import timezone
 from jsonfield import JSONField
 
 from post_office import cache
+from post_office.cache import LRUCache
 from post_office.fields import CommaSeparatedEmailField
 
-from .connections import connections
-from .settings import context_field_class, get_log_level, get_template_engine, get_override_recipients
+from .connections import connections, get_backend_connection
+from .settings import (
+    context_field_class, get_attachment_cache_size, get_log_level, get_override_recipients,
+    get_store_recipients, get_streaming_attachment_threshold,
+)
+from .streaming import StreamingAttachment
+from .template import get_compiled_templates
 from .validators import validate_email_with_name, validate_template_syntax
 
 
 PRIORITY = namedtuple('PRIORITY', 'low medium high now')._make(range(4))
-STATUS = namedtuple('STATUS', 'sent failed queued requeued')._make(range(4))
+STATUS = namedtuple('STATUS', 'sent failed queued requeued sending')._make(range(5))
+RECIPIENT_TYPE = namedtuple('RECIPIENT_TYPE', 'to cc bcc')._make(range(3))
+
+
+class EmailManager(models.Manager):
+
+    def prepare_messages(self, emails):
+        """
+        Prepares the messages of ``emails``, a queryset or list of emails, using
+        a fixed number of queries regardless of their number: templates and
+        attachments are fetched in bulk, unless they already are. Querysets
+        which have already been evaluated aren't fetched again.
+
+        Returns a list of two tuples ``(email, exception)``, see
+        ``prepare_email_messages()``.
+        """
+        emails = list(emails)
+        prefetch_related_objects(emails, 'template', 'attachments')
+        return list(prepare_email_messages(emails))
+
+    def with_recipient(self, address):
+        """
+        Returns the emails having ``address`` as a to, cc or bcc recipient. With
+        ``STORE_RECIPIENTS`` enabled this is an indexed lookup, otherwise the
+        recipient fields of all emails are searched.
+        """
+        if get_store_recipients():
+            return self.filter(id__in=Recipient.objects.filter(
+                address=normalize_address(address)).values('email_id'))
+        return self.filter(Q(to__icontains=address) | Q(cc__icontains=address) |
+                           Q(bcc__icontains=address))
 
 
 class Email(models.Model):
@@ -32,7 +70,8 @@ class Email(models.Model):
     PRIORITY_CHOICES = [(PRIORITY.low, _("low")), (PRIORITY.medium, _("medium")),
                         (PRIORITY.high, _("high")), (PRIORITY.now, _("now"))]
     STATUS_CHOICES = [(STATUS.sent, _("sent")), (STATUS.failed, _("failed")),
-                      (STATUS.queued, _("queued")), (STATUS.requeued, _("requeued"))]
+                      (STATUS.queued, _("queued")), (STATUS.requeued, _("requeued")),
+                      (STATUS.sending, _("sending"))]
 
     from_email = models.CharField(_("Email From"), max_length=254,
                                   validators=[validate_email_with_name])
@@ -44,6 +83,8 @@ class Email(models.Model):
     html_message = models.TextField(_("HTML Message"), blank=True)
     """
     Emails with 'queued' status will get processed by ``send_queued`` command.
+    While being delivered, their status is ``sending`` and ``lease_expires_at``
+    tells until when the sending process is expected to finish.
     Status field will then be set to ``failed`` or ``sent`` depending on
     whether it's successfully delivered.
     """
@@ -71,11 +112,23 @@ class Email(models.Model):
     context = context_field_class(_('Context'), blank=True, null=True)
     backend_alias = models.CharField(_("Backend alias"), blank=True, default='',
                                      max_length=64)
+    lease_owner = models.CharField(_("Lease owner"), max_length=255, blank=True,
+                                   default='', editable=False)
+    lease_expires_at = models.DateTimeField(_("Lease expires"), blank=True, null=True,
+                                            editable=False, db_index=True)
+
+    objects = EmailManager()
 
     class Meta:
         app_label = 'post_office'
         verbose_name = pgettext_lazy("Email address", "Email")
         verbose_name_plural = pgettext_lazy("Email addresses", "Emails")
+        indexes = [
+            # Emails waiting to be sent, in the default sending order, see
+            # ``mail.get_queued()``
+            models.Index(fields=['-priority', 'scheduled_time'], name='post_office_email_dequeue',
+                         condition=Q(status__in=[STATUS.queued, STATUS.requeued])),
+        ]
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -93,19 +146,34 @@ class Email(models.Model):
 
         return self.prepare_email_message()
 
-    def prepare_email_message(self):
+    def prepare_email_message(self, compiled_templates=None):
         """
         Returns a django ``EmailMessage`` or ``EmailMultiAlternatives`` object,
         depending on whether html_message is empty.
+
+        ``compiled_templates`` may be passed by callers which already hold the
+        compiled templates of ``self.template``, see ``prepare_email_messages``.
+        """
+        msg = self.render_email_message(compiled_templates=compiled_templates)
+        # Sending threads use a pooled connection instead, see dispatch()
+        msg.connection = get_backend_connection(self.backend_alias or 'default')
+        self._cached_email_message = msg
+        return msg
+
+    def render_email_message(self, compiled_templates=None):
+        """
+        Like ``prepare_email_message()``, but neither binds a connection to the
+        returned message nor caches it.
         """
         if get_override_recipients():
             self.to = get_override_recipients()
 
         if self.template is not None:
-            engine = get_template_engine()
-            subject = engine.from_string(self.template.subject).render(self.context)
-            plaintext_message = engine.from_string(self.template.content).render(self.context)
-            multipart_template = engine.from_string(self.template.html_content)
+            if compiled_templates is None:
+                compiled_templates = get_compiled_templates(self.template)
+            subject_template, plaintext_template, multipart_template = compiled_templates
+            subject = subject_template.render(self.context)
+            plaintext_message = plaintext_template.render(self.context)
             html_message = multipart_template.render(self.context)
 
         else:
@@ -114,7 +182,6 @@ class Email(models.Model):
             multipart_template = None
             html_message = self.html_message
 
-        connection = connections[self.backend_alias or 'default']
         if isinstance(self.headers, dict) or self.expires_at or self.message_id:
             headers = dict(self.headers or {})
             if self.expires_at:
@@ -129,13 +196,13 @@ class Email(models.Model):
                 msg = EmailMultiAlternatives(
                     subject=subject, body=plaintext_message, from_email=self.from_email,
                     to=self.to, bcc=self.bcc, cc=self.cc,
-                    headers=headers, connection=connection)
+                    headers=headers)
                 msg.attach_alternative(html_message, "text/html")
             else:
                 msg = EmailMultiAlternatives(
                     subject=subject, body=html_message, from_email=self.from_email,
                     to=self.to, bcc=self.bcc, cc=self.cc,
-                    headers=headers, connection=connection)
+                    headers=headers)
                 msg.content_subtype = 'html'
             if hasattr(multipart_template, 'attach_related'):
                 multipart_template.attach_related(msg)
@@ -144,12 +211,15 @@ class Email(models.Model):
             msg = EmailMessage(
                 subject=subject, body=plaintext_message, from_email=self.from_email,
                 to=self.to, bcc=self.bcc, cc=self.cc,
-                headers=headers, connection=connection)
+                headers=headers)
 
+        streaming_threshold = get_streaming_attachment_threshold()
         for attachment in self.attachments.all():
-            if attachment.headers:
+            if streaming_threshold is not None and attachment.file.size > streaming_threshold:
+                msg.attach(StreamingAttachment(attachment))
+            elif attachment.headers:
                 mime_part = MIMENonMultipart(*attachment.mimetype.split('/'))
-                mime_part.set_payload(attachment.file.read())
+                mime_part.set_payload(attachment.get_payload())
                 for key, val in attachment.headers.items():
                     try:
                         mime_part.replace_header(key, val)
@@ -157,10 +227,8 @@ class Email(models.Model):
                         mime_part.add_header(key, val)
                 msg.attach(mime_part)
             else:
-                msg.attach(attachment.name, attachment.file.read(), mimetype=attachment.mimetype or None)
-            attachment.file.close()
+                msg.attach(attachment.name, attachment.get_payload(), mimetype=attachment.mimetype or None)
 
-        self._cached_email_message = msg
         return msg
 
     def dispatch(self, log_level=None,
@@ -169,7 +237,16 @@ class Email(models.Model):
         Sends email and log the result.
         """
         try:
-            self.email_message().send()
+            message = self.email_message()
+            # Sent over a pooled connection of the sending thread, the message
+            # keeps its own connection otherwise
+            own_connection = message.connection
+            try:
+                with connections.sending(self.backend_alias or 'default') as connection:
+                    message.connection = connection
+                    message.send()
+            finally:
+                message.connection = own_connection
             status = STATUS.sent
             message = ''
             exception_type = ''
@@ -211,6 +288,40 @@ class Email(models.Model):
         return super().save(*args, **kwargs)
 
 
+def prepare_email_messages(emails):
+    """
+    Prepares the messages of many emails at once. Emails are grouped by
+    template, so each template is compiled (or looked up) once per group and
+    all contexts are then rendered against it.
+
+    Yields two tuples ``(email, exception)`` in template order, where
+    ``exception`` is None when the message was successfully prepared.
+    """
+    groups = OrderedDict()
+    for email in emails:
+        groups.setdefault(email.template_id, []).append(email)
+
+    for template_id, group in groups.items():
+        compiled_templates = None
+        if template_id is not None:
+            try:
+                compiled_templates = get_compiled_templates(group[0].template)
+            except Exception as e:
+                for email in group:
+                    yield email, e
+                continue
+
+        for email in group:
+            # Sometimes this can fail, for example when rendering a context
+            # the template doesn't expect
+            try:
+                email.prepare_email_message(compiled_templates=compiled_templates)
+            except Exception as e:
+                yield email, e
+            else:
+                yield email, None
+
+
 class Log(models.Model):
     """
     A model to record sending email sending activities.
@@ -234,6 +345,56 @@ class Log(models.Model):
         return str(self.date)
 
 
+def normalize_address(address):
+    """
+    Returns the bare, lower cased email address of ``address``, which may
+    include a display name.
+    """
+    return parseaddr(address)[1].lower()
+
+
+class RecipientManager(models.Manager):
+
+    def create_for_emails(self, emails):
+        """
+        Stores the to, cc and bcc recipients of saved ``emails``.
+        """
+        recipients = []
+        for email in emails:
+            for recipient_type in RECIPIENT_TYPE._fields:
+                field = Email._meta.get_field(recipient_type)
+                for address in field.to_python(getattr(email, recipient_type)) or []:
+                    recipients.append(self.model(
+                        email_id=email.pk, address=normalize_address(address),
+                        type=getattr(RECIPIENT_TYPE, recipient_type)))
+        return self.bulk_create(recipients)
+
+
+class Recipient(models.Model):
+    """
+    A recipient of an email, stored when ``STORE_RECIPIENTS`` is enabled to
+    look up emails by recipient without searching the recipient fields.
+    """
+
+    TYPE_CHOICES = [(RECIPIENT_TYPE.to, _("To")), (RECIPIENT_TYPE.cc, _("Cc")),
+                    (RECIPIENT_TYPE.bcc, _("Bcc"))]
+
+    email = models.ForeignKey(Email, related_name='recipients', on_delete=models.CASCADE,
+                              verbose_name=_('Email address'))
+    address = models.CharField(_('Address'), max_length=254, db_index=True)
+    type = models.PositiveSmallIntegerField(_('Type'), choices=TYPE_CHOICES)
+
+    objects = RecipientManager()
+
+    class Meta:
+        app_label = 'post_office'
+        verbose_name = _("Recipient")
+        verbose_name_plural = _("Recipients")
+
+    def __str__(self):
+        return self.address
+
+
 class EmailTemplateManager(models.Manager):
     def get_by_natural_key(self, name, language, default_template):
         return self.get(name=name, language=language, default_template=default_template)
@@ -299,6 +460,10 @@ def get_upload_path(instance, filename):
                         str(date.month), str(date.day), filename)
 
 
+# Contents of attachment files, keyed by attachment id and file name
+attachment_payloads = LRUCache(max_size=0, get_size=len)
+
+
 class Attachment(models.Model):
     """
     A model describing an email attachment.
@@ -309,6 +474,9 @@ class Attachment(models.Model):
                                     verbose_name=_('Emails'))
     mimetype = models.CharField(max_length=255, default='', blank=True)
     headers = JSONField(_('Headers'), blank=True, null=True)
+    digest = models.CharField(_('Digest'), max_length=64, blank=True, default='',
+                              db_index=True, editable=False,
+                              help_text=_("SHA-256 digest of the file, when deduplicated"))
 
     class Meta:
         app_label = 'post_office'
@@ -317,3 +485,21 @@ class Attachment(models.Model):
 
     def __str__(self):
         return self.name
+
+    def get_payload(self):
+        """
+        Returns the content of ``file``. Contents are cached per process, up to
+        ``ATTACHMENT_CACHE_SIZE`` bytes, so that a file attached to many emails
+        is read from storage once.
+        """
+        attachment_payloads.max_size = get_attachment_cache_size()
+        key = (self.pk, self.file.name)
+        payload = attachment_payloads.get(key)
+        if payload is None:
+            try:
+                payload = self.file.read()
+            finally:
+                self.file.close()
+            if self.pk is not None:
+                attachment_payloads.set(key, payload)
+        return payload
@@ -0,0 +1,88 @@
+import datetime
+
+from django.db import connections, router
+
+from .models import Email
+
+# Number of rows serialized at once while streaming them to the database
+CHUNK_ROWS = 1000
+
+
+def format_copy_value(value):
+    """
+    Formats a value prepared for the database as a column of COPY's text format.
+    """
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        value = value.isoformat()
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        value = '\\x' + bytes(value).hex()
+    elif hasattr(value, 'adapted') and hasattr(value, 'dumps'):
+        # psycopg2's Json adapter, used by JSON fields on PostgreSQL
+        value = value.dumps(value.adapted)
+    else:
+        value = str(value)
+    return value.replace('\\', '\\\\').replace('\t', '\\t') \
+        .replace('\n', '\\n').replace('\r', '\\r')
+
+
+def get_copy_fields():
+    return [field for field in Email._meta.concrete_fields if field is not Email._meta.pk]
+
+
+class RowsFile:
+    """
+    A read only file object serializing emails as rows of COPY's text format,
+    a chunk at a time.
+    """
+
+    def __init__(self, emails, fields, connection):
+        self.rows = self.iter_rows(emails, fields, connection)
+        self.buffer = b''
+
+    def iter_rows(self, emails, fields, connection):
+        lines = []
+        for email in emails:
+            values = [field.get_db_prep_save(field.pre_save(email, add=True), connection)
+                      for field in fields]
+            lines.append('\t'.join(format_copy_value(value) for value in values))
+            if len(lines) == CHUNK_ROWS:
+                yield ('\n'.join(lines) + '\n').encode()
+                lines = []
+        if lines:
+            yield ('\n'.join(lines) + '\n').encode()
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            try:
+                self.buffer += next(self.rows)
+            except StopIteration:
+                break
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+
+def copy_emails(emails, using=None):
+    """
+    Inserts unsaved ``emails`` with PostgreSQL's ``COPY FROM STDIN``, streaming
+    them to the database. Unlike ``bulk_create()``, their primary keys aren't set.
+    """
+    using = using or router.db_for_write(Email)
+    connection = connections[using]
+    fields = get_copy_fields()
+    sql = 'COPY %s (%s) FROM STDIN' % (
+        connection.ops.quote_name(Email._meta.db_table),
+        ', '.join(connection.ops.quote_name(field.column) for field in fields),
+    )
+    with connection.cursor() as cursor:
+        cursor.copy_expert(sql, RowsFile(emails, fields, connection))
+
+
+def supports_copy(using=None):
+    connection = connections[using or router.db_for_write(Email)]
+    return connection.vendor == 'postgresql'
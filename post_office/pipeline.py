@@ -0,0 +1,151 @@
+import queue
+from threading import Thread
+
+from .connections import connections
+from .logutils import setup_loghandlers
+from .mail import _update_statuses, get_queued, mark_sending
+from .models import prepare_email_messages
+from .settings import get_log_level, get_threads_per_process
+from .throttle import get_throttle
+
+logger = setup_loghandlers("INFO")
+
+
+class SendingPipeline:
+    """
+    Sends out queued emails without waiting for a batch to be fully sent before
+    fetching the next one.
+
+    The calling thread fetches and renders emails, hands them over to
+    ``THREADS_PER_PROCESS`` sending threads through a queue and persists the
+    results as they come in. Unlike ``mail._send_bulk()``, a batch is no barrier:
+    the next batch is fetched and rendered while the sending threads are still busy
+    with the previous one. Fetching, rendering and persisting results don't overlap
+    each other, they all access the database from the calling thread.
+    """
+
+    def __init__(self, log_level=None, threads=None):
+        if log_level is None:
+            log_level = get_log_level()
+        self.log_level = log_level
+        self.threads = threads or get_threads_per_process()
+        # Enough rendered emails to keep all threads busy, bounded to limit memory usage
+        self.send_queue = queue.Queue(maxsize=self.threads * 2)
+        self.result_queue = queue.Queue()
+        self.in_flight = 0
+        # Results are persisted in chunks, to keep the number of queries low
+        self.sent_emails, self.failed_emails = [], []
+        self.total_sent, self.total_failed, self.total_requeued = 0, 0, 0
+        self.throttle = get_throttle()
+
+    def run(self):
+        """
+        Sends queued emails until the queue is empty.
+        Returns the number of sent, failed and requeued emails.
+        """
+        workers = [Thread(target=self.send_worker, daemon=True) for i in range(self.threads)]
+        for worker in workers:
+            worker.start()
+
+        try:
+            while True:
+                emails = list(get_queued())
+                if not emails:
+                    break
+                logger.info('Pipeline fetched %s emails' % len(emails))
+                mark_sending(emails)
+
+                for email, exception in prepare_email_messages(emails):
+                    if exception is not None:
+                        self.failed_emails.append((email, exception))
+                        continue
+                    self.put(email)
+                self.collect()
+                self.flush()
+
+            while self.in_flight:
+                self.collect(block=True)
+                self.flush()
+            self.flush(force=True)
+        finally:
+            for worker in workers:
+                self.send_queue.put(None)
+            for worker in workers:
+                worker.join()
+            connections.close()
+            # Persist the results of emails handed over before an error, so
+            # that delivered emails aren't left in sending state and sent again
+            self.collect()
+            self.flush(force=True)
+
+        logger.info(
+            'Pipeline finished, %s sent, %s failed, %s requeued',
+            self.total_sent, self.total_failed, self.total_requeued,
+        )
+        return self.total_sent, self.total_failed, self.total_requeued
+
+    def put(self, email):
+        """
+        Hands a rendered email over to the sending threads, persisting results
+        while waiting for a free slot.
+        """
+        self.in_flight += 1
+        while True:
+            try:
+                self.send_queue.put_nowait(email)
+                return
+            except queue.Full:
+                self.collect(block=True)
+                self.flush()
+
+    def collect(self, block=False):
+        """
+        Gathers the results of the sending threads. If ``block`` is True, waits
+        for at least one result.
+        """
+        results = []
+        if block:
+            results.append(self.result_queue.get())
+        while True:
+            try:
+                results.append(self.result_queue.get_nowait())
+            except queue.Empty:
+                break
+        self.in_flight -= len(results)
+
+        for email, exception in results:
+            if exception is None:
+                self.sent_emails.append(email)
+            else:
+                self.failed_emails.append((email, exception))
+
+    def flush(self, force=False):
+        """
+        Persists the gathered results, once there are enough of them or if
+        ``force`` is True.
+        """
+        pending = len(self.sent_emails) + len(self.failed_emails)
+        if not pending or (pending < self.send_queue.maxsize and not force):
+            return
+        num_failed, num_requeued = _update_statuses(self.sent_emails, self.failed_emails,
+                                                    self.log_level)
+        self.total_sent += len(self.sent_emails)
+        self.total_failed += num_failed
+        self.total_requeued += num_requeued
+        self.sent_emails, self.failed_emails = [], []
+
+    def send_worker(self):
+        while True:
+            email = self.send_queue.get()
+            if email is None:
+                break
+            try:
+                if self.throttle is not None:
+                    self.throttle.wait(email)
+                email.dispatch(log_level=self.log_level, commit=False,
+                               disconnect_after_delivery=False)
+                logger.debug('Successfully sent email #%d' % email.id)
+                self.result_queue.put((email, None))
+            except Exception as e:
+                logger.debug('Failed to send email #%d' % email.id)
+                self.result_queue.put((email, e))
@@ -0,0 +1,153 @@
+import atexit
+import email
+import pickle
+from collections import OrderedDict
+from multiprocessing import Pool
+
+import django
+from django.apps import apps
+from django.core.mail import EmailMessage
+from django.db.models import prefetch_related_objects
+
+from .connections import get_backend_connection
+
+
+class RenderedMessage:
+    """
+    A MIME message serialized by a render process. Backends only need its
+    bytes, other attributes are looked up on the message parsed back from them.
+    """
+
+    def __init__(self, data):
+        # Serialized with CRLF line endings, as expected by SMTP
+        self.data = data
+        self._message = None
+
+    def as_bytes(self, unixfrom=False, linesep='\n'):
+        if linesep == '\r\n':
+            return self.data
+        return self.data.replace(b'\r\n', linesep.encode())
+
+    def as_string(self, unixfrom=False, linesep='\n'):
+        return self.as_bytes(unixfrom, linesep).decode('ascii', 'replace')
+
+    def parse(self):
+        if self._message is None:
+            self._message = email.message_from_bytes(self.data)
+        return self._message
+
+    def __getitem__(self, name):
+        return self.parse()[name]
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.parse(), name)
+
+
+class PrerenderedEmailMessage(EmailMessage):
+    """
+    An ``EmailMessage`` whose MIME message has already been serialized.
+    """
+
+    def __init__(self, data, **kwargs):
+        super().__init__(**kwargs)
+        self.data = data
+
+    def message(self):
+        return RenderedMessage(self.data)
+
+
+_pool = (None, None)
+
+
+def _init_worker():
+    # Processes which aren't forked start without a configured Django
+    if not apps.ready:
+        django.setup()
+
+
+def get_render_pool(processes):
+    """
+    Returns a pool of ``processes`` render processes. The pool is kept for the
+    lifetime of the calling process, so that render processes are only started
+    once and keep their caches of compiled templates and attachments across
+    batches. They never access the database connections inherited from the
+    calling process.
+    """
+    global _pool
+    if _pool[0] != processes:
+        close_render_pool()
+        _pool = (processes, Pool(processes, initializer=_init_worker))
+    return _pool[1]
+
+
+def close_render_pool():
+    """
+    Stops the render processes started by ``get_render_pool()``, if any.
+    """
+    global _pool
+    pool = _pool[1]
+    _pool = (None, None)
+    if pool is not None:
+        pool.terminate()
+        pool.join()
+
+
+atexit.register(close_render_pool)
+
+
+def _render_email(email_instance):
+    """
+    Renders an email in a render process. Returns a two tuple of the arguments of
+    its ``PrerenderedEmailMessage`` and None, or None and the raised exception.
+    """
+    try:
+        msg = email_instance.render_email_message()
+        kwargs = {
+            'subject': msg.subject, 'from_email': msg.from_email, 'to': msg.to,
+            'cc': msg.cc, 'bcc': msg.bcc, 'reply_to': msg.reply_to,
+            'data': msg.message().as_bytes(linesep='\r\n'),
+        }
+        return kwargs, None
+    except Exception as e:
+        try:
+            pickle.dumps(e)
+        except Exception:
+            e = Exception('%s: %s' % (type(e).__name__, e))
+        return None, e
+
+
+def render_email_messages(emails, processes):
+    """
+    Like ``models.prepare_email_messages()``, but renders the templates and builds
+    the MIME messages of ``emails`` in a pool of ``processes`` processes, to use
+    more than one CPU core. Templates and attachments are loaded up front, so that
+    only the calling process accesses the database.
+
+    Yields two tuples ``(email, exception)``, where ``exception`` is None when the
+    message was successfully prepared.
+    """
+    groups = OrderedDict()
+    for email_instance in emails:
+        groups.setdefault(email_instance.template_id, []).append(email_instance)
+    emails = [email_instance for group in groups.values() for email_instance in group]
+    if not emails:
+        return
+
+    prefetch_related_objects(emails, 'template', 'attachments')
+
+    # Chunks of consecutive emails mostly share their template, which then
+    # only has to be compiled once per chunk
+    chunksize = max(1, len(emails) // (processes * 4))
+    results = get_render_pool(processes).map(_render_email, emails, chunksize)
+
+    for email_instance, (kwargs, exception) in zip(emails, results):
+        if exception is None:
+            try:
+                kwargs['connection'] = get_backend_connection(email_instance.backend_alias or 'default')
+            except Exception as e:
+                exception = e
+            else:
+                email_instance._cached_email_message = PrerenderedEmailMessage(**kwargs)
+        yield email_instance, exception
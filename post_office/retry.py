@@ -0,0 +1,132 @@
+import random
+import smtplib
+
+from django.utils.module_loading import import_string
+
+try:
+    import aiosmtplib
+except ImportError:
+    aiosmtplib = None
+
+from .settings import get_retry_policy_config, get_retry_timedelta
+
+
+class RetryPolicy:
+    """
+    Decides when a failed email is retried. ``get_delay()`` returns how long
+    to wait before retrying, or None to give up on the email.
+
+    ``jitter`` spreads retries of emails which failed together: with a jitter
+    of 0.2, delays are randomly shortened or lengthened by up to 20%.
+    """
+
+    def __init__(self, jitter=0):
+        self.jitter = jitter
+
+    def get_delay(self, email, exception):
+        raise NotImplementedError
+
+    def get_scheduled_time(self, email, exception, now):
+        delay = self.get_delay(email, exception)
+        if delay is None:
+            return None
+        if self.jitter:
+            delay *= random.uniform(1 - self.jitter, 1 + self.jitter)
+        return now + delay
+
+
+class FixedRetryPolicy(RetryPolicy):
+    """
+    Retries after ``interval``, which defaults to ``RETRY_INTERVAL``.
+    """
+
+    def __init__(self, interval=None, **kwargs):
+        super().__init__(**kwargs)
+        self.interval = interval
+
+    def get_delay(self, email, exception):
+        return self.interval or get_retry_timedelta()
+
+
+class ExponentialRetryPolicy(RetryPolicy):
+    """
+    Retries after ``interval`` (defaults to ``RETRY_INTERVAL``), multiplied by
+    ``factor`` for each previous retry of the email, up to ``max_interval``.
+    """
+
+    def __init__(self, interval=None, factor=2, max_interval=None, **kwargs):
+        super().__init__(**kwargs)
+        self.interval = interval
+        self.factor = factor
+        self.max_interval = max_interval
+
+    def get_delay(self, email, exception):
+        delay = (self.interval or get_retry_timedelta()) * self.factor ** (email.number_of_retries or 0)
+        if self.max_interval is not None:
+            delay = min(delay, self.max_interval)
+        return delay
+
+
+class SMTPRetryPolicy(RetryPolicy):
+    """
+    Gives up on emails rejected permanently by the SMTP server, i.e. with a
+    5xx reply code, and retries emails which failed otherwise according to
+    ``policy``: a retry policy, or a dict configuring one like ``RETRY_POLICY``.
+    It defaults to a ``FixedRetryPolicy``. Other keyword arguments, such as
+    ``interval`` or ``jitter``, are options of the configured or default policy.
+    """
+
+    def __init__(self, policy=None, **kwargs):
+        super().__init__()
+        if isinstance(policy, dict):
+            options = dict(kwargs, **policy.get('OPTIONS', {}))
+            policy = load_retry_policy(dict(policy, OPTIONS=options))
+        elif policy is None:
+            policy = FixedRetryPolicy(**kwargs)
+        elif kwargs:
+            raise TypeError('Options of the retry policy must be passed to its constructor')
+        self.policy = policy
+
+    def is_permanent(self, exception):
+        if isinstance(exception, smtplib.SMTPRecipientsRefused):
+            codes = [code for code, message in exception.recipients.values()]
+            return bool(codes) and all(code >= 500 for code in codes)
+        if isinstance(exception, smtplib.SMTPResponseException):
+            return exception.smtp_code >= 500
+        if aiosmtplib is not None:
+            if isinstance(exception, aiosmtplib.SMTPRecipientsRefused):
+                codes = [error.code for error in exception.recipients]
+                return bool(codes) and all(code >= 500 for code in codes)
+            if isinstance(exception, aiosmtplib.SMTPResponseException):
+                return exception.code >= 500
+        return False
+
+    def get_delay(self, email, exception):
+        if self.is_permanent(exception):
+            return None
+        return self.policy.get_delay(email, exception)
+
+    def get_scheduled_time(self, email, exception, now):
+        if self.is_permanent(exception):
+            return None
+        return self.policy.get_scheduled_time(email, exception, now)
+
+
+def load_retry_policy(config):
+    """
+    Returns a retry policy from a dict with a ``BACKEND`` dotted path and
+    ``OPTIONS`` passed to its constructor.
+    """
+    backend = import_string(config.get('BACKEND', 'post_office.retry.FixedRetryPolicy'))
+    return backend(**config.get('OPTIONS', {}))
+
+
+def get_retry_policy():
+    """
+    Returns the retry policy configured by ``RETRY_POLICY``, which defaults to
+    retrying after ``RETRY_INTERVAL``.
+    """
+    config = get_retry_policy_config()
+    if not config:
+        return FixedRetryPolicy()
+    return load_retry_policy(config)
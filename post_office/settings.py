@@ -52,6 +52,20 @@ def get_available_backends():
     return backends
 
 
+def get_connection_pool_options(alias):
+    """
+    Returns the pool options of a backend alias, or None if its connections
+    aren't pooled. For example:
+    {
+        'MIN_SIZE': 1,
+        'MAX_SIZE': 4,
+        'MAX_MESSAGES': 1000,
+        'IDLE_TIMEOUT': 60,
+    }
+    """
+    return get_config().get('CONNECTION_POOL', {}).get(alias)
+
+
 def get_cache_backend():
     if hasattr(settings, 'CACHES'):
         if "post_office" in settings.CACHES:
@@ -87,6 +101,14 @@ def get_threads_per_process():
     return get_config().get('THREADS_PER_PROCESS', 5)
 
 
+def get_sending_engine():
+    return get_config().get('SENDING_ENGINE', 'batch')
+
+
+def get_async_concurrency():
+    return get_config().get('ASYNC_CONCURRENCY', 100)
+
+
 def get_default_priority():
     return get_config().get('DEFAULT_PRIORITY', 'medium')
 
@@ -104,6 +126,54 @@ def get_template_engine():
     return template_engines[using]
 
 
+def get_compiled_template_cache_size():
+    return get_config().get('COMPILED_TEMPLATE_CACHE_SIZE', 100)
+
+
+def get_render_processes():
+    return get_config().get('RENDER_PROCESSES', 0)
+
+
+def get_attachment_cache_size():
+    return get_config().get('ATTACHMENT_CACHE_SIZE', 32 * 1024 * 1024)
+
+
+def get_deduplicate_attachments():
+    return get_config().get('DEDUPLICATE_ATTACHMENTS', False)
+
+
+def get_streaming_attachment_threshold():
+    return get_config().get('STREAMING_ATTACHMENT_THRESHOLD', None)
+
+
+def get_send_many_batch_size():
+    return get_config().get('SEND_MANY_BATCH_SIZE', 1000)
+
+
+def get_send_many_copy():
+    return get_config().get('SEND_MANY_COPY', False)
+
+
+def get_store_recipients():
+    return get_config().get('STORE_RECIPIENTS', False)
+
+
+def get_rate_limits():
+    return get_config().get('RATE_LIMITS', {})
+
+
+def get_group_by_domain():
+    return get_config().get('GROUP_BY_DOMAIN', False)
+
+
+def get_coalesce_messages():
+    return get_config().get('COALESCE_MESSAGES', 0)
+
+
+def get_process_chunk_size():
+    return get_config().get('PROCESS_CHUNK_SIZE', None)
+
+
 def get_override_recipients():
     return get_config().get('OVERRIDE_RECIPIENTS', None)
 
@@ -116,6 +186,22 @@ def get_retry_timedelta():
     return get_config().get('RETRY_INTERVAL', datetime.timedelta(minutes=15))
 
 
+def get_retry_policy_config():
+    return get_config().get('RETRY_POLICY', None)
+
+
+def get_claim_emails():
+    return get_config().get('CLAIM_EMAILS', False)
+
+
+def get_lease_duration():
+    return get_config().get('LEASE_DURATION', datetime.timedelta(minutes=10))
+
+
+def get_wakeup_config():
+    return get_config().get('WAKEUP', None)
+
+
 def get_message_id_enabled():
     return get_config().get('MESSAGE_ID_ENABLED', False)
 
@@ -0,0 +1,193 @@
+import binascii
+import mimetypes
+import re
+import smtplib
+from email.mime.base import MIMEBase
+from uuid import uuid4
+
+from django.core.mail.backends.smtp import EmailBackend as SMTPEmailBackend
+from django.core.mail.message import sanitize_address
+from django.conf import settings
+
+# Number of bytes encoded on each line, 57 bytes make a 76 characters line
+LINE_SIZE = 57
+# Number of bytes read from an attachment file at once
+CHUNK_SIZE = LINE_SIZE * 1024
+
+
+class StreamingAttachment(MIMEBase):
+    """
+    A base64 encoded MIME part whose payload is read from the file of an
+    ``Attachment`` when the message is serialized, instead of being kept in
+    memory with the message.
+
+    Serializing the message with ``as_bytes()`` reads and encodes the whole
+    file, ``write_message()`` streams it in chunks instead.
+    """
+
+    def __init__(self, attachment):
+        mimetype = attachment.mimetype or mimetypes.guess_type(attachment.name)[0] \
+            or 'application/octet-stream'
+        super().__init__(*mimetype.split('/', 1))
+        self.attachment = attachment
+        # Placeholder written in place of the payload when streaming
+        self.placeholder = uuid4().hex
+        self.streaming = False
+        self.set_payload(self.placeholder)
+        self['Content-Transfer-Encoding'] = 'base64'
+        if attachment.headers:
+            for key, val in attachment.headers.items():
+                try:
+                    self.replace_header(key, val)
+                except KeyError:
+                    self.add_header(key, val)
+        else:
+            filename = attachment.name
+            try:
+                filename.encode('ascii')
+            except UnicodeEncodeError:
+                filename = ('utf-8', '', filename)
+            self.add_header('Content-Disposition', 'attachment', filename=filename)
+
+    def get_payload(self, i=None, decode=False):
+        if self.streaming:
+            return self.placeholder
+        attachment_file = self.attachment.file
+        attachment_file.open('rb')
+        try:
+            if decode:
+                return attachment_file.read()
+            return b''.join(encode_lines(attachment_file, b'\n')).decode('ascii')
+        finally:
+            attachment_file.close()
+
+
+def encode_lines(fileobj, linesep):
+    """
+    Yields the base64 encoded content of ``fileobj`` in chunks of lines
+    separated by ``linesep``, without a trailing line separator.
+    """
+    separator = b''
+    while True:
+        chunk = fileobj.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        # b2a_base64() only accepts newline=False on Python 3.6+
+        lines = [binascii.b2a_base64(chunk[i:i + LINE_SIZE])[:-1]
+                 for i in range(0, len(chunk), LINE_SIZE)]
+        yield separator + linesep.join(lines)
+        separator = linesep
+
+
+def get_streaming_attachments(message):
+    return [part for part in message.walk() if isinstance(part, StreamingAttachment)]
+
+
+def iter_message(message, linesep='\r\n'):
+    """
+    Yields the serialized ``message`` in chunks, reading the payloads of its
+    ``StreamingAttachment`` parts from their files while doing so.
+    """
+    parts = get_streaming_attachments(message)
+    for part in parts:
+        part.streaming = True
+    try:
+        data = message.as_bytes(linesep=linesep)
+    finally:
+        for part in parts:
+            part.streaming = False
+
+    linesep = linesep.encode()
+    position = 0
+    for part in parts:
+        placeholder = part.placeholder.encode()
+        index = data.index(placeholder, position)
+        yield data[position:index]
+        attachment_file = part.attachment.file
+        attachment_file.open('rb')
+        try:
+            yield from encode_lines(attachment_file, linesep)
+        finally:
+            attachment_file.close()
+        position = index + len(placeholder)
+    yield data[position:]
+
+
+def write_message(message, fp, linesep='\n'):
+    """
+    Writes the serialized ``message`` to the file object ``fp``, streaming the
+    payloads of its ``StreamingAttachment`` parts.
+    """
+    for chunk in iter_message(message, linesep):
+        fp.write(chunk)
+
+
+class EmailBackend(SMTPEmailBackend):
+    """
+    Django's SMTP backend, streaming the attachments of messages with
+    ``StreamingAttachment`` parts into the DATA command, so that they are
+    never fully loaded into memory.
+    """
+
+    def _send(self, email_message):
+        message = email_message.message()
+        if not email_message.recipients() or not get_streaming_attachments(message):
+            return super()._send(email_message)
+
+        encoding = email_message.encoding or settings.DEFAULT_CHARSET
+        from_email = sanitize_address(email_message.from_email, encoding)
+        recipients = [sanitize_address(addr, encoding) for addr in email_message.recipients()]
+        try:
+            self.sendmail(from_email, recipients, message)
+        except smtplib.SMTPException:
+            if not self.fail_silently:
+                raise
+            return False
+        return True
+
+    def sendmail(self, from_addr, to_addrs, message):
+        """
+        Like ``smtplib.SMTP.sendmail()``, but sends ``message`` in chunks.
+        """
+        connection = self.connection
+        connection.ehlo_or_helo_if_needed()
+        code, resp = connection.mail(from_addr)
+        if code != 250:
+            self._reset_or_close(code)
+            raise smtplib.SMTPSenderRefused(code, resp, from_addr)
+
+        refused = {}
+        for recipient in to_addrs:
+            code, resp = connection.rcpt(recipient)
+            if code not in (250, 251):
+                refused[recipient] = (code, resp)
+            if code == 421:
+                connection.close()
+                raise smtplib.SMTPRecipientsRefused(refused)
+        if len(refused) == len(to_addrs):
+            connection._rset()
+            raise smtplib.SMTPRecipientsRefused(refused)
+
+        connection.putcmd('data')
+        code, resp = connection.getreply()
+        if code != 354:
+            raise smtplib.SMTPDataError(code, resp)
+        last_chunk = b''
+        for chunk in iter_message(message, '\r\n'):
+            if chunk:
+                # Quote lines beginning with a period, chunks are split at line
+                # boundaries or in base64 data, which never contains periods
+                connection.send(re.sub(br'(?m)^\.', b'..', chunk))
+                last_chunk = chunk
+        connection.send(b'.\r\n' if last_chunk.endswith(b'\r\n') else b'\r\n.\r\n')
+        code, resp = connection.getreply()
+        if code != 250:
+            self._reset_or_close(code)
+            raise smtplib.SMTPDataError(code, resp)
+        return refused
+
+    def _reset_or_close(self, code):
+        if code == 421:
+            self.connection.close()
+        else:
+            self.connection._rset()
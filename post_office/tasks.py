@@ -3,7 +3,7 @@ import datetime
 from django.utils.timezone import now
 
 from post_office.mail import send_queued
-from post_office.utils import cleanup_expired_mails
+from post_office.utils import cleanup_expired_mails, requeue_stuck_emails
 
 from .settings import get_celery_enabled
 
@@ -36,3 +36,7 @@ else:
         cutoff_date = now() - datetime.timedelta(days)
         delete_attachments = kwargs.get('delete_attachments', True)
         cleanup_expired_mails(cutoff_date, delete_attachments)
+
+    @shared_task(ignore_result=True)
+    def requeue_stuck_mail(*args, **kwargs):
+        requeue_stuck_emails()
@@ -1,5 +1,11 @@
 from django.template.loader import get_template, select_template
 
+from ..cache import LRUCache
+from ..settings import get_compiled_template_cache_size, get_template_engine
+
+
+compiled_templates = LRUCache(max_size=0)
+
 
 def render_to_string(template_name, context=None, request=None, using=None):
     """
@@ -12,4 +18,26 @@ def render_to_string(template_name, context=None, request=None, using=None):
         template = select_template(template_name, using=using)
     else:
         template = get_template(template_name, using=using)
-    return template.render(context, request), template.template._attached_images
+    return template.render(context, request), template.attached_images
+
+
+def get_compiled_templates(email_template):
+    """
+    Returns a tuple containing the compiled subject, content and html_content of
+    an ``EmailTemplate``. Compiled templates are cached per process and keyed by
+    the template's last update, so that each template is parsed only once.
+    """
+    engine = get_template_engine()
+    key = (id(engine), email_template.pk, email_template.last_updated)
+    compiled_templates.max_size = get_compiled_template_cache_size()
+
+    templates = compiled_templates.get(key) if email_template.pk else None
+    if templates is None:
+        templates = (
+            engine.from_string(email_template.subject),
+            engine.from_string(email_template.content),
+            engine.from_string(email_template.html_content),
+        )
+        if email_template.pk:
+            compiled_templates.set(key, templates)
+    return templates
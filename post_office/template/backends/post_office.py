@@ -1,20 +1,40 @@
+from threading import local
+
 from django.conf import settings
 from django.core.mail import EmailMultiAlternatives
 from django.template import TemplateDoesNotExist
 from django.template.backends.base import BaseEngine
 from django.template.backends.django import Template as DjangoTemplate, reraise, get_installed_libraries
+from django.template.context import make_context
 from django.template.engine import Engine
 
 
 class Template(DjangoTemplate):
     def __init__(self, template, backend):
-        template._attached_images = []
         super().__init__(template, backend)
+        self._local = local()
+
+    def render(self, context=None, request=None):
+        # Compiled templates are shared by threads and may be rendered many times, images are
+        # collected on the context of each rendering and only those of the thread's last one are kept
+        context = make_context(context, request, autoescape=self.backend.engine.autoescape)
+        context.attached_images = self._local.attached_images = []
+        try:
+            return self.template.render(context)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self.backend)
+
+    @property
+    def attached_images(self):
+        """
+        Images referenced by the last rendering of this template in the current thread.
+        """
+        return getattr(self._local, 'attached_images', [])
 
     def attach_related(self, email_message):
         assert isinstance(email_message, EmailMultiAlternatives), "Parameter must be of type EmailMultiAlternatives"
         email_message.mixed_subtype = 'related'
-        for attachment in self.template._attached_images:
+        for attachment in self.attached_images:
             email_message.attach(attachment)
 
 
@@ -13,7 +13,7 @@ register = template.Library()
 
 @register.simple_tag(takes_context=True)
 def inline_image(context, file):
-    assert hasattr(context.template, '_attached_images'), \
+    assert hasattr(context, 'attached_images'), \
         "You must use template engine 'post_office' when rendering images using templatetag 'inline_image'."
     if isinstance(file, ImageFile):
         fileobj = file
@@ -34,5 +34,5 @@ def inline_image(context, file):
     md5sum = hashlib.md5(raw_data).hexdigest()
     image.add_header('Content-Disposition', 'inline', filename=md5sum)
     image.add_header('Content-ID', '<{}>'.format(md5sum))
-    context.template._attached_images.append(image)
+    context.attached_images.append(image)
     return 'cid:{}'.format(md5sum)
@@ -0,0 +1,76 @@
+import socket
+from unittest import skipUnless
+
+from django.core import mail
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from ..mail import send_queued
+from ..models import STATUS
+from .utils import create_email
+
+try:
+    import aiosmtplib  # noqa
+    from aiosmtpd.controller import Controller
+except ImportError:
+    Controller = None
+
+
+class RecordingHandler:
+    def __init__(self):
+        self.envelopes = []
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.startswith('reject'):
+            return '550 Mailbox unavailable'
+        envelope.rcpt_tos.append(address)
+        return '250 OK'
+
+    async def handle_DATA(self, server, session, envelope):
+        self.envelopes.append(envelope)
+        return '250 Message accepted for delivery'
+
+
+ASYNC_SETTINGS = {
+    'BACKENDS': {
+        'default': 'django.core.mail.backends.dummy.EmailBackend',
+        'smtp': 'django.core.mail.backends.smtp.EmailBackend',
+        'locmem': 'django.core.mail.backends.locmem.EmailBackend',
+    },
+    'SENDING_ENGINE': 'asyncio',
+    'ASYNC_CONCURRENCY': 3,
+    'MAX_RETRIES': 1,
+}
+
+
+@skipUnless(Controller, 'aiosmtplib and aiosmtpd are required')
+class AsyncSenderTest(TestCase):
+
+    def setUp(self):
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            self.port = sock.getsockname()[1]
+        self.handler = RecordingHandler()
+        self.controller = Controller(self.handler, hostname='127.0.0.1', port=self.port)
+        self.controller.start()
+
+    def tearDown(self):
+        self.controller.stop()
+
+    def test_send_queued(self):
+        with override_settings(POST_OFFICE=ASYNC_SETTINGS, EMAIL_HOST='127.0.0.1', EMAIL_PORT=self.port):
+            emails = [create_email(backend_alias='smtp', to=['to%d@example.com' % i]) for i in range(10)]
+            rejected = create_email(backend_alias='smtp', to=['reject@example.com'])
+            locmem = create_email(backend_alias='locmem')
+            self.assertEqual(send_queued(), (11, 0, 1))
+
+        recipients = sorted(envelope.rcpt_tos[0] for envelope in self.handler.envelopes)
+        self.assertEqual(recipients, sorted('to%d@example.com' % i for i in range(10)))
+        self.assertEqual(len(mail.outbox), 1)
+        for email in emails + [locmem]:
+            email.refresh_from_db()
+            self.assertEqual(email.status, STATUS.sent)
+            self.assertEqual(email.logs.get().status, STATUS.sent)
+        rejected.refresh_from_db()
+        self.assertEqual(rejected.status, STATUS.requeued)
+        self.assertEqual(rejected.logs.get().exception_type, 'SMTPRecipientsRefused')
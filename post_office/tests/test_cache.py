@@ -39,3 +39,37 @@ class CacheTest(TestCase):
         self.assertTrue('awesome content', cache.get('test-cache'))
         cache.delete('test-cache')
         self.assertEqual(None, cache.get('test-cache'))
+
+    def test_lru_cache(self):
+        lru_cache = cache.LRUCache(max_size=2)
+        lru_cache.set('a', 1)
+        lru_cache.set('b', 2)
+        self.assertEqual(lru_cache.get('a'), 1)
+        # 'b' is the least recently used item
+        lru_cache.set('c', 3)
+        self.assertIsNone(lru_cache.get('b'))
+        self.assertEqual(lru_cache.get('a'), 1)
+        self.assertEqual(lru_cache.get('c'), 3)
+        self.assertEqual(len(lru_cache), 2)
+
+        # A max_size of 0 disables caching
+        lru_cache = cache.LRUCache(max_size=0)
+        lru_cache.set('a', 1)
+        self.assertIsNone(lru_cache.get('a'))
+
+    def test_lru_cache_sizes(self):
+        lru_cache = cache.LRUCache(max_size=10, get_size=len)
+        lru_cache.set('a', b'12345')
+        lru_cache.set('b', b'1234')
+        self.assertEqual(lru_cache.size, 9)
+        # Evicts 'a' to make room
+        lru_cache.set('c', b'12')
+        self.assertIsNone(lru_cache.get('a'))
+        self.assertEqual(lru_cache.size, 6)
+        # Replacing an item accounts for its new size
+        lru_cache.set('c', b'123')
+        self.assertEqual(lru_cache.size, 7)
+        # Items larger than the cache aren't cached
+        lru_cache.set('d', b'12345678901')
+        self.assertIsNone(lru_cache.get('d'))
+        self.assertEqual(len(lru_cache), 2)
@@ -0,0 +1,123 @@
+from unittest.mock import patch
+
+from django.conf import settings
+from django.core import mail
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from ..coalesce import UNDISCLOSED_RECIPIENTS, coalesce_emails, get_coalescing_key
+from ..mail import _send_bulk, create
+from ..models import EmailTemplate, STATUS
+from ..render import close_render_pool
+
+
+class CoalesceTest(TestCase):
+
+    def create_email(self, recipients, backend='locmem', **kwargs):
+        kwargs.setdefault('subject', 'Announcement')
+        kwargs.setdefault('message', 'Hello everyone')
+        return create('from@example.com', recipients=recipients, backend=backend, **kwargs)
+
+    def test_get_coalescing_key(self):
+        email = self.create_email(['a@example.com'])
+        other_email = self.create_email(['b@example.com', 'c@example.com'], bcc=['d@example.com'])
+        self.assertNotEqual(email.message_id, other_email.message_id)
+        self.assertEqual(get_coalescing_key(email), get_coalescing_key(other_email))
+
+        self.assertNotEqual(get_coalescing_key(email),
+                            get_coalescing_key(self.create_email(['a@example.com'], subject='Other')))
+        self.assertNotEqual(get_coalescing_key(email),
+                            get_coalescing_key(self.create_email(['a@example.com'], backend='connection_tester')))
+        # Carbon copies are visible to recipients, such emails are sent on their own
+        self.assertIsNone(get_coalescing_key(self.create_email(['a@example.com'], cc=['b@example.com'])))
+
+    def test_coalesce_emails(self):
+        emails = [
+            self.create_email(['a@example.com']),
+            self.create_email(['b@example.com'], subject='Other'),
+            self.create_email(['c@example.com', 'd@example.com']),
+            self.create_email(['e@example.com']),
+            self.create_email(['f@example.com'], subject='Other'),
+            self.create_email(['g@example.com', 'h@example.com', 'i@example.com']),
+        ]
+        groups = coalesce_emails(emails, max_recipients=3)
+        self.assertEqual(groups, [
+            [emails[0], emails[2]], [emails[1], emails[4]], [emails[3]], [emails[5]],
+        ])
+
+    @override_settings(POST_OFFICE=dict(settings.POST_OFFICE, COALESCE_MESSAGES=100, LOG_LEVEL=2))
+    def test_send_bulk(self):
+        emails = [self.create_email(['to%d@example.com' % i]) for i in range(3)]
+        other_email = self.create_email(['other@example.com'], subject='Other')
+        _send_bulk(emails + [other_email], uses_multiprocessing=False)
+
+        self.assertEqual(len(mail.outbox), 2)
+        message, other_message = sorted(mail.outbox, key=lambda message: len(message.bcc), reverse=True)
+        self.assertEqual(message.to, [])
+        self.assertEqual(message.bcc, ['to0@example.com', 'to1@example.com', 'to2@example.com'])
+        self.assertEqual(message.message()['To'], UNDISCLOSED_RECIPIENTS)
+        self.assertEqual(other_message.to, ['other@example.com'])
+
+        # Each email still has its own status and log
+        for email in emails + [other_email]:
+            email.refresh_from_db()
+            self.assertEqual(email.status, STATUS.sent)
+            self.assertEqual(email.logs.get().status, STATUS.sent)
+
+    @override_settings(POST_OFFICE=dict(settings.POST_OFFICE, COALESCE_MESSAGES=100, RENDER_PROCESSES=2))
+    def test_send_bulk_prerendered(self):
+        """
+        Messages serialized by render processes are never coalesced.
+        """
+        self.addCleanup(close_render_pool)
+        template = EmailTemplate.objects.create(subject='Invoice', content='Hello {{ name }}')
+        emails = [self.create_email(['%s@example.com' % name.lower()], template=template,
+                                    context={'name': name}, subject='', message='')
+                  for name in ['Alice', 'Bob', 'Carol']]
+        self.assertEqual(_send_bulk(emails, uses_multiprocessing=False), (3, 0, 0))
+        self.assertEqual(sorted((message.to, message.message().get_payload()) for message in mail.outbox), [
+            (['alice@example.com'], 'Hello Alice'), (['bob@example.com'], 'Hello Bob'),
+            (['carol@example.com'], 'Hello Carol'),
+        ])
+
+    @override_settings(POST_OFFICE=dict(settings.POST_OFFICE, COALESCE_MESSAGES=100))
+    def test_send_bulk_failure(self):
+        emails = [self.create_email(['to%d@example.com' % i], backend='error') for i in range(3)]
+        self.assertEqual(_send_bulk(emails, uses_multiprocessing=False), (0, 0, 3))
+        for email in emails:
+            email.refresh_from_db()
+            self.assertEqual(email.status, STATUS.requeued)
+            self.assertEqual(email.logs.get().message, 'Fake Error')
+
+    @override_settings(POST_OFFICE=dict(settings.POST_OFFICE, COALESCE_MESSAGES=100))
+    def test_send_bulk_refused_recipients(self):
+        """
+        Emails whose recipients were refused fail, while the other emails of
+        the message are sent.
+        """
+        with patch('smtplib.SMTP') as smtp:
+            smtp.return_value.sendmail.return_value = {'to1@example.com': (550, b'No such user')}
+            emails = [self.create_email(['to%d@example.com' % i], backend='smtp') for i in range(3)]
+            self.assertEqual(_send_bulk(emails, uses_multiprocessing=False), (2, 0, 1))
+
+        self.assertEqual(smtp.return_value.sendmail.call_count, 1)
+        from_email, recipients, message = smtp.return_value.sendmail.call_args[0]
+        self.assertEqual(recipients, ['to0@example.com', 'to1@example.com', 'to2@example.com'])
+        statuses = []
+        for email in emails:
+            email.refresh_from_db()
+            statuses.append(email.status)
+        self.assertEqual(statuses, [STATUS.sent, STATUS.requeued, STATUS.sent])
+        self.assertIn('No such user', emails[1].logs.get().message)
+
+    @override_settings(POST_OFFICE=dict(settings.POST_OFFICE, COALESCE_MESSAGES=100))
+    def test_send_bulk_throttle(self):
+        """
+        Rate limits apply to each coalesced email.
+        """
+        emails = [self.create_email(['to@example.com']), self.create_email(['to@example.org'])]
+        with patch('post_office.mail.get_throttle') as get_throttle:
+            _send_bulk(emails, uses_multiprocessing=False)
+        wait = get_throttle.return_value.wait
+        self.assertEqual([call[0][0] for call in wait.call_args_list], emails)
+        self.assertEqual(len(mail.outbox), 1)
@@ -1,5 +1,9 @@
 import datetime
 import os
+import signal
+import threading
+from io import StringIO
+from unittest.mock import patch
 
 from django.core.files.base import ContentFile
 from django.core.management import call_command
@@ -7,7 +11,8 @@ from django.test import TestCase
 from django.test.utils import override_settings
 from django.utils.timezone import now
 
-from ..models import Attachment, Email, STATUS
+from ..management.commands import send_queued_mail
+from ..models import Attachment, Email, RECIPIENT_TYPE, Recipient, STATUS
 
 
 class CommandTest(TestCase):
@@ -84,6 +89,40 @@ class CommandTest(TestCase):
         call_command('cleanup_mail', days=30)
         self.assertEqual(Email.objects.count(), 0)
 
+    def test_store_recipients(self):
+        """
+        The ``store_recipients`` command stores the recipients of existing mails
+        """
+        emails = [Email.objects.create(from_email='from@example.com', to=['%d@example.com' % i],
+                                       cc=['cc@example.com'])
+                  for i in range(3)]
+        Recipient.objects.create(email=emails[0], address='stale@example.com',
+                                 type=RECIPIENT_TYPE.to)
+        out = StringIO()
+        call_command('store_recipients', batch_size=2, stdout=out)
+        self.assertIn('Stored recipients of 3 mails.', out.getvalue())
+        self.assertEqual(list(emails[0].recipients.order_by('type').values_list('address', flat=True)),
+                         ['0@example.com', 'cc@example.com'])
+        self.assertEqual(Recipient.objects.count(), 6)
+
+    def test_requeue_stuck_mail(self):
+        """
+        The ``requeue_stuck_mail`` command requeues mails whose sending lease
+        has expired
+        """
+        stuck = Email.objects.create(from_email='from@example.com', to=['to@example.com'],
+                                     status=STATUS.sending,
+                                     lease_expires_at=now() - datetime.timedelta(minutes=1))
+        in_flight = Email.objects.create(from_email='from@example.com', to=['to@example.com'],
+                                         status=STATUS.sending,
+                                         lease_expires_at=now() + datetime.timedelta(minutes=1))
+        call_command('requeue_stuck_mail')
+        stuck.refresh_from_db()
+        in_flight.refresh_from_db()
+        self.assertEqual(stuck.status, STATUS.requeued)
+        self.assertIsNone(stuck.lease_expires_at)
+        self.assertEqual(in_flight.status, STATUS.sending)
+
     TEST_SETTINGS = {
         'BACKENDS': {
             'default': 'django.core.mail.backends.dummy.EmailBackend',
@@ -108,6 +147,65 @@ class CommandTest(TestCase):
         self.assertEqual(Email.objects.filter(status=STATUS.sent).count(), 2)
         self.assertEqual(Email.objects.filter(status=STATUS.queued).count(), 0)
 
+    @override_settings(POST_OFFICE=TEST_SETTINGS)
+    def test_send_queued_mail_daemon(self):
+        """
+        In daemon mode, ``send_queued_mail`` keeps polling with an exponentially
+        growing interval and shuts down gracefully on SIGTERM.
+        """
+        intervals = []
+
+        class Stopping(threading.Event):
+            def wait(self, timeout=None):
+                intervals.append(timeout)
+                if len(intervals) == 4:
+                    os.kill(os.getpid(), signal.SIGTERM)
+                return self.is_set()
+
+        Email.objects.create(from_email='from@example.com',
+                             to=['to@example.com'], status=STATUS.queued)
+        Email.objects.create(from_email='from@example.com',
+                             to=['to@example.com'], status=STATUS.queued)
+        # Expired emails are never sent, so they don't keep the daemon busy
+        Email.objects.create(from_email='from@example.com', to=['to@example.com'],
+                             status=STATUS.queued, expires_at=now() - datetime.timedelta(days=1))
+        command = send_queued_mail.Command()
+        command.stopping = Stopping()
+        call_command(command, daemon=True, min_poll_interval=1, max_poll_interval=5)
+        self.assertEqual(Email.objects.filter(status=STATUS.sent).count(), 2)
+        self.assertEqual(intervals, [1, 2, 4, 5])
+        self.assertEqual(signal.getsignal(signal.SIGTERM), signal.SIG_DFL)
+
+    @override_settings(POST_OFFICE=TEST_SETTINGS)
+    def test_send_queued_mail_daemon_error(self):
+        """
+        In daemon mode, errors are logged and sending is retried after backing
+        off, instead of stopping the daemon.
+        """
+        intervals = []
+
+        class Stopping(threading.Event):
+            def wait(self, timeout=None):
+                intervals.append(timeout)
+                if len(intervals) == 2:
+                    self.set()
+                return self.is_set()
+
+        command = send_queued_mail.Command()
+        command.stopping = Stopping()
+        with patch('post_office.management.commands.send_queued_mail.send_queued',
+                   side_effect=[Exception('Connection lost'), (0, 0, 0), (0, 0, 0)]) as send_queued, \
+                self.assertLogs('post_office', 'ERROR'):
+            call_command(command, daemon=True, min_poll_interval=1, max_poll_interval=5)
+        self.assertEqual(send_queued.call_count, 2)
+        self.assertEqual(intervals, [1, 2])
+
+        # Without the daemon mode, errors are raised
+        with patch('post_office.management.commands.send_queued_mail.send_queued',
+                   side_effect=Exception('Connection lost')), self.assertLogs('post_office', 'ERROR'):
+            with self.assertRaises(Exception):
+                call_command('send_queued_mail', processes=1)
+
     def test_successful_deliveries_logging(self):
         """
         Successful deliveries are only logged when log_level is 2.
@@ -1,8 +1,49 @@
+import threading
+import time
+from unittest.mock import patch
+
+from django.core import mail
 from django.core.mail import backends
+from django.core.mail.backends.base import BaseEmailBackend
 from django.test import TestCase
+from django.test.utils import override_settings
 
 from .test_backends import ErrorRaisingBackend
-from ..connections import connections
+from ..connections import ConnectionHandler, connections
+from ..models import Email
+
+
+class FakeSMTP:
+    alive = True
+
+    def noop(self):
+        if not self.alive:
+            raise ConnectionError('Connection unexpectedly closed')
+        return (250, b'OK')
+
+
+class SMTPLikeBackend(BaseEmailBackend):
+    '''
+    An EmailBackend exposing an SMTP-like ``connection`` attribute once opened
+    '''
+    connection = None
+
+    def open(self):
+        self.connection = FakeSMTP()
+
+    def close(self):
+        self.connection = None
+
+
+POOL_SETTINGS = {
+    'BACKENDS': {
+        'default': 'django.core.mail.backends.dummy.EmailBackend',
+        'pooled': 'post_office.tests.test_connections.SMTPLikeBackend',
+    },
+    'CONNECTION_POOL': {
+        'pooled': {'MIN_SIZE': 1, 'MAX_SIZE': 2, 'MAX_MESSAGES': 3, 'IDLE_TIMEOUT': 60},
+    },
+}
 
 
 class ConnectionTest(TestCase):
@@ -11,3 +52,125 @@ class ConnectionTest(TestCase):
         # Ensure ConnectionHandler returns the right connection
         self.assertTrue(isinstance(connections['error'], ErrorRaisingBackend))
         self.assertTrue(isinstance(connections['locmem'], backends.locmem.EmailBackend))
+
+    def test_close(self):
+        # Closed connections are dropped, the next access opens a new one
+        handler = ConnectionHandler()
+        connection = handler['locmem']
+        handler.close()
+        self.assertIsNot(handler['locmem'], connection)
+
+    @override_settings(POST_OFFICE=POOL_SETTINGS)
+    def test_pool_reuses_connections(self):
+        handler = ConnectionHandler()
+        connection = handler['pooled']
+        self.assertIsNotNone(connection.connection)
+        self.assertIs(handler['pooled'], connection)
+        handler.close()
+        # The connection is given back to the pool instead of being closed
+        self.assertIsNotNone(connection.connection)
+        self.assertIs(handler['pooled'], connection)
+        handler.close()
+        handler.close_pools()
+        self.assertIsNone(connection.connection)
+
+    @override_settings(POST_OFFICE=POOL_SETTINGS)
+    def test_pool_recycles_connections(self):
+        handler = ConnectionHandler()
+        for i in range(3):
+            with handler.sending('pooled') as connection:
+                pass
+        # Three messages have been sent through this connection
+        self.assertIsNone(connection.connection)
+        with handler.sending('pooled') as other_connection:
+            self.assertIsNot(other_connection, connection)
+        # Looking connections up doesn't count as sending messages
+        for i in range(3):
+            self.assertIs(handler['pooled'], other_connection)
+        handler.close()
+        self.assertIsNotNone(other_connection.connection)
+        handler.close_pools()
+
+    @override_settings(POST_OFFICE=POOL_SETTINGS)
+    def test_pool_checks_liveness(self):
+        handler = ConnectionHandler()
+        connection = handler['pooled']
+        handler.close()
+        connection.connection.alive = False
+        # Recently used connections are assumed to be alive
+        self.assertIs(handler['pooled'], connection)
+        handler.close()
+        with patch('time.monotonic', return_value=time.monotonic() + 2):
+            self.assertIsNot(handler['pooled'], connection)
+        handler.close_pools()
+
+    @override_settings(POST_OFFICE=POOL_SETTINGS)
+    def test_pool_max_size(self):
+        handler = ConnectionHandler()
+        pool = handler.get_pool('pooled')
+        connection = pool.acquire()
+        other_connection = pool.acquire()
+        acquired = []
+        thread = threading.Thread(target=lambda: acquired.append(pool.acquire()))
+        thread.start()
+        thread.join(0.1)
+        # The pool is exhausted until a connection is given back
+        self.assertEqual(acquired, [])
+        pool.release(other_connection)
+        thread.join()
+        self.assertEqual(acquired, [other_connection])
+        pool.release(connection)
+        pool.release(other_connection)
+        handler.close_pools()
+
+    def test_sending_threads_use_own_connections(self):
+        handler = ConnectionHandler()
+        barrier = threading.Barrier(2)
+        used = []
+
+        def send():
+            with handler.sending('locmem') as connection:
+                used.append(connection)
+                barrier.wait()
+
+        threads = [threading.Thread(target=send) for i in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertIsNot(used[0], used[1])
+        # Connections are reused by the next messages of the batch
+        with handler.sending('locmem') as connection:
+            self.assertIn(connection, used)
+        handler.close()
+        with handler.sending('locmem') as connection:
+            self.assertNotIn(connection, used)
+
+    def test_email_message_connection(self):
+        email = Email.objects.create(to=['to@example.com'], from_email='from@example.com',
+                                     backend_alias='locmem')
+        message = email.email_message()
+        connection = message.connection
+        self.assertIsInstance(connection, backends.locmem.EmailBackend)
+        # Dispatching sends over a pooled connection, the message keeps its own
+        email.dispatch(commit=False)
+        self.assertIs(message.connection, connection)
+        message.send()
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_sending_failure_closes_connection(self):
+        handler = ConnectionHandler()
+        with self.assertRaises(ValueError):
+            with handler.sending('locmem') as connection:
+                raise ValueError
+        with handler.sending('locmem') as other_connection:
+            self.assertIsNot(other_connection, connection)
+
+    @override_settings(POST_OFFICE=POOL_SETTINGS)
+    def test_pool_idle_timeout(self):
+        handler = ConnectionHandler()
+        connection = handler['pooled']
+        handler.close()
+        with patch('time.monotonic', return_value=10 ** 9):
+            self.assertIsNot(handler['pooled'], connection)
+        self.assertIsNone(connection.connection)
@@ -1,5 +1,6 @@
 import os
 from email.mime.image import MIMEImage
+from threading import Thread
 
 from django.contrib.auth import get_user_model
 from django.core.mail import EmailMultiAlternatives
@@ -123,11 +124,53 @@ class HTMLMailTest(TestCase):
         filename = os.path.join(os.path.dirname(__file__), 'static/dummy.png')
         context = {'imgsrc': filename}
         queued_mail = send(recipients=['to@example.com'], sender='from@example.com',
-                     template=template, context=context, render_on_delivery=True)
+                     template=template, context=context, render_on_delivery=True, backend='locmem')
         queued_mail = Email.objects.get(id=queued_mail.id)
         send_queued()
         self.assertEqual(Email.objects.get(id=queued_mail.id).status, STATUS.sent)
 
+    @override_settings(POST_OFFICE={'TEMPLATE_ENGINE': 'post_office'})
+    def test_inlined_images_of_cached_template(self):
+        """
+        Compiled templates are shared between emails, each message must only contain
+        the images referenced by its own rendering.
+        """
+        template = EmailTemplate.objects.create(
+            name="Test Inlined Images",
+            html_content="""
+{% load post_office %}
+<img src="{% inline_image imgsrc %}" width="200" />"""
+        )
+        filename = os.path.join(os.path.dirname(__file__), 'static/dummy.png')
+        for i in range(2):
+            email = Email.objects.create(to=['to@example.com'], from_email='from@example.com',
+                                         template=template, context={'imgsrc': filename})
+            message = email.prepare_email_message()
+            self.assertEqual(len(message.attachments), 1)
+
+    def test_inlined_images_of_concurrent_renderings(self):
+        """
+        A template rendered by another thread in the meantime must not change
+        the images attached by the current thread.
+        """
+        template = get_template('image.html', using='post_office')
+        template.render({'imgsrc': 'dummy.png'})
+
+        def render():
+            # Fails before attaching any image
+            try:
+                template.render({'imgsrc': ''})
+            except OSError:
+                pass
+
+        thread = Thread(target=render)
+        thread.start()
+        thread.join()
+        self.assertEqual(len(template.attached_images), 1)
+        msg = EmailMultiAlternatives('subject', 'body', to=['john@example.com'])
+        template.attach_related(msg)
+        self.assertEqual(len(msg.attachments), 1)
+
 
 class EmailAdminTest(TestCase):
     def setUp(self) -> None:
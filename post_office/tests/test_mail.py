@@ -1,3 +1,5 @@
+import smtplib
+from unittest import skipUnless
 from unittest.mock import patch, MagicMock
 
 import pytz
@@ -8,14 +10,19 @@ from django.core.exceptions import ValidationError
 from django.core.files.base import ContentFile
 from django.conf import settings
 
+from django.template import Template
+from django.db import connection
 from django.test import TestCase
-from django.test.utils import override_settings
+from django.test.utils import CaptureQueriesContext, override_settings
 from django.utils import timezone
 
 from ..settings import get_batch_size, get_log_level, get_threads_per_process, get_max_retries, get_retry_timedelta
-from ..models import Email, EmailTemplate, Attachment, PRIORITY, STATUS
-from ..mail import (create, get_queued,
-                    send, send_many, send_queued, _send_bulk)
+from ..models import Email, EmailTemplate, Attachment, PRIORITY, RECIPIENT_TYPE, Recipient, STATUS
+from ..mail import (create, get_queued, lease_emails, renew_leases,
+                    send, send_many, send_queued, _close_connections, _init_process,
+                    _bulk_create_with_pks, _log_utilization, _send_bulk, _send_chunk)
+from ..utils import requeue_stuck_emails
+from ..signals import email_queued
 
 
 connection_counter = 0
@@ -77,6 +84,50 @@ class MailTest(TestCase):
         total_sent, total_failed, total_requeued = send_queued(processes=2)
         self.assertEqual(total_sent, 3)
 
+    @override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+                       POST_OFFICE=dict(settings.POST_OFFICE, PROCESS_CHUNK_SIZE=1))
+    def test_send_queued_mail_chunks(self):
+        """
+        Check that processes take emails in chunks and report their utilization
+        """
+        for i in range(4):
+            Email.objects.create(to=['to@example.com'], from_email='bob@example.com',
+                                 subject='Test', message='Message', status=STATUS.queued)
+        with patch('post_office.mail._send_chunk', wraps=_send_chunk) as send_chunk, \
+                patch('post_office.mail.Pool') as pool, \
+                self.assertLogs('post_office', 'INFO') as logs:
+            pool.return_value.imap_unordered.side_effect = lambda function, chunks: map(function, chunks)
+            self.assertEqual(send_queued(processes=2), (4, 0, 0))
+        self.assertEqual(send_chunk.call_count, 4)
+        self.assertEqual([len(call[0][0][0]) for call in send_chunk.call_args_list], [1, 1, 1, 1])
+        self.assertTrue(any('Process utilization' in message for message in logs.output))
+
+    def test_send_chunk_keeps_connections_open(self):
+        """
+        Check that processes keep their connections open across chunks
+        """
+        self.addCleanup(_close_connections)
+        email = Email.objects.create(to=['to@example.com'], from_email='bob@example.com',
+                                     status=STATUS.queued, backend_alias='locmem')
+        with patch('post_office.mail.connections.close') as close:
+            _send_chunk(([email], None))
+        self.assertFalse(close.called)
+        self.assertEqual(Email.objects.get(id=email.id).status, STATUS.sent)
+
+        with patch('post_office.mail.Finalize') as finalize, \
+                patch('post_office.mail.db_connection.close'), \
+                patch('post_office.mail.connections.reset'):
+            _init_process()
+        self.assertIs(finalize.call_args[0][1], _close_connections)
+
+    def test_log_utilization(self):
+        with self.assertLogs('post_office', 'INFO') as logs:
+            _log_utilization('Process', {1: 1.0, 2: 0.5, 3: 3.0}, 2.0)
+            _log_utilization('Process', {}, 2.0)
+        self.assertEqual(logs.output, [
+            'INFO:post_office:Process utilization over 2.00s: 1 50%, 2 25%, 3 100% (average 58%)',
+        ])
+
     def test_send_bulk(self):
         """
         Ensure _send_bulk() properly sends out emails.
@@ -90,6 +141,28 @@ class MailTest(TestCase):
         self.assertEqual(len(mail.outbox), 1)
         self.assertEqual(mail.outbox[0].subject, 'send bulk')
 
+    def test_send_bulk_marks_emails_as_sending(self):
+        """
+        Ensure emails are in ``sending`` state with a lease while being delivered.
+        """
+        email = Email.objects.create(
+            to=['to@example.com'], from_email='bob@example.com',
+            subject='send bulk', message='Message', status=STATUS.queued,
+            backend_alias='locmem')
+        statuses = []
+
+        def dispatch(email, *args, **kwargs):
+            statuses.append(email.status)
+
+        with patch('post_office.mail.lease_emails', wraps=lease_emails) as mock, \
+                patch.object(Email, 'dispatch', dispatch):
+            _send_bulk([email], uses_multiprocessing=False)
+        mock.assert_called_once_with([email.id])
+        self.assertEqual(statuses, [STATUS.sending])
+        email.refresh_from_db()
+        self.assertEqual(email.status, STATUS.sent)
+        self.assertIsNone(email.lease_expires_at)
+
     @override_settings(EMAIL_BACKEND='post_office.tests.test_mail.ConnectionTestingBackend')
     def test_send_bulk_reuses_open_connection(self):
         """
@@ -107,6 +180,43 @@ class MailTest(TestCase):
         _send_bulk([email, email_2])
         self.assertEqual(connection_counter, 1)
 
+    @override_settings(POST_OFFICE=dict(settings.POST_OFFICE, GROUP_BY_DOMAIN=True, THREADS_PER_PROCESS=1))
+    def test_send_bulk_groups_by_domain(self):
+        """
+        Ensure _send_bulk() sends emails to the same domain one after another,
+        within each priority.
+        """
+        template = EmailTemplate.objects.create(subject='Subject', content='Content')
+        emails = [
+            Email.objects.create(to=['to@%s' % domain], from_email='bob@example.com',
+                                 status=STATUS.queued, backend_alias='locmem', priority=priority,
+                                 template=template if domain == 'example.org' else None)
+            for domain, priority in [('example.org', PRIORITY.high), ('example.com', PRIORITY.high),
+                                     ('example.com', PRIORITY.medium), ('example.org', PRIORITY.medium),
+                                     ('example.com', PRIORITY.medium)]
+        ]
+        _send_bulk(emails, uses_multiprocessing=False)
+        self.assertEqual([message.to[0] for message in mail.outbox],
+                         ['to@example.com', 'to@example.org', 'to@example.com', 'to@example.com',
+                          'to@example.org'])
+
+    def test_dequeue_index(self):
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, Email._meta.db_table)
+        self.assertIn('post_office_email_dequeue', constraints)
+
+    @skipUnless(connection.vendor == 'postgresql', 'partial index plans are tested on PostgreSQL')
+    def test_get_queued_uses_dequeue_index(self):
+        with connection.cursor() as cursor:
+            # Tables are too small for an index to be cheaper than a sequential scan
+            cursor.execute('SET enable_seqscan = off')
+        try:
+            plan = get_queued().explain()
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute('RESET enable_seqscan')
+        self.assertIn('post_office_email_dequeue', plan)
+
     def test_get_queued(self):
         """
         Ensure get_queued returns only emails that should be sent
@@ -140,6 +250,98 @@ class MailTest(TestCase):
                                           scheduled_time=timezone.datetime(2010, 12, 13), **kwargs)
         self.assertEqual(list(get_queued()), [queued_email, past_email])
 
+    @override_settings(POST_OFFICE={'CLAIM_EMAILS': True, 'BATCH_SIZE': 2, 'MAX_RETRIES': 1,
+                                    'BACKENDS': {'default': 'django.core.mail.backends.dummy.EmailBackend'}})
+    def test_get_queued_claims_emails(self):
+        """
+        Ensure get_queued leases the returned emails so that they aren't
+        picked up again until the lease expires.
+        """
+        kwargs = {
+            'to': 'to@example.com',
+            'from_email': 'bob@example.com',
+            'subject': 'Test',
+            'message': 'Message',
+            'status': STATUS.queued,
+        }
+        emails = [Email.objects.create(**kwargs) for i in range(3)]
+
+        now = timezone.now()
+        with patch('django.utils.timezone.now', return_value=now):
+            claimed = get_queued()
+        self.assertEqual(len(claimed), 2)
+        for email in claimed:
+            self.assertEqual(email.status, STATUS.sending)
+            self.assertTrue(email.lease_owner)
+            self.assertEqual(email.lease_expires_at, now + timezone.timedelta(minutes=10))
+
+        # Leased emails are skipped by subsequent calls
+        with patch('django.utils.timezone.now', return_value=now):
+            self.assertEqual(get_queued(), [emails[2]])
+            self.assertEqual(get_queued(), [])
+
+        # Emails with expired leases can be claimed again once requeued
+        with patch('django.utils.timezone.now', return_value=now + timezone.timedelta(minutes=11)):
+            self.assertEqual(requeue_stuck_emails(), 3)
+            self.assertEqual(len(get_queued()), 2)
+
+    @override_settings(POST_OFFICE={'CLAIM_EMAILS': True})
+    def test_claim_emails_concurrently(self):
+        """
+        Emails claimed by another sender between the selection and the lease
+        are neither leased again nor returned.
+        """
+        emails = [Email.objects.create(to=['to@example.com'], from_email='bob@example.com',
+                                       status=STATUS.queued) for i in range(2)]
+
+        def concurrent_lease(email_ids, now=None, queryset=None):
+            Email.objects.filter(id=emails[0].id).update(status=STATUS.sending, lease_owner='other:1')
+            return lease_emails(email_ids, now, queryset=queryset)
+
+        with patch('post_office.mail.lease_emails', side_effect=concurrent_lease):
+            self.assertEqual(get_queued(), [emails[1]])
+        emails[0].refresh_from_db()
+        self.assertEqual(emails[0].lease_owner, 'other:1')
+
+    @override_settings(POST_OFFICE={'MAX_RETRIES': 1})
+    def test_requeue_stuck_emails_retries(self):
+        now = timezone.now()
+        kwargs = {'to': ['to@example.com'], 'from_email': 'bob@example.com', 'status': STATUS.sending,
+                  'lease_expires_at': now - timezone.timedelta(minutes=1)}
+        email = Email.objects.create(**kwargs)
+        retried_email = Email.objects.create(number_of_retries=1, **kwargs)
+        leased_email = Email.objects.create(**dict(kwargs, lease_expires_at=now + timezone.timedelta(minutes=1)))
+
+        self.assertEqual(requeue_stuck_emails(now), 1)
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.number_of_retries), (STATUS.requeued, 1))
+        # Emails crashing their sender aren't retried forever
+        retried_email.refresh_from_db()
+        self.assertEqual((retried_email.status, retried_email.number_of_retries), (STATUS.failed, 1))
+        self.assertIsNone(retried_email.lease_expires_at)
+        leased_email.refresh_from_db()
+        self.assertEqual(leased_email.status, STATUS.sending)
+
+    def test_renew_leases(self):
+        now = timezone.now()
+        kwargs = {'to': ['to@example.com'], 'from_email': 'bob@example.com', 'lease_expires_at': now}
+        email = Email.objects.create(status=STATUS.sending, **kwargs)
+        sent_email = Email.objects.create(status=STATUS.sent, **kwargs)
+        self.assertEqual(renew_leases([email.id, sent_email.id], now), 1)
+        email.refresh_from_db()
+        self.assertEqual(email.lease_expires_at, now + timezone.timedelta(minutes=10))
+
+    @override_settings(POST_OFFICE={'CLAIM_EMAILS': True,
+                                    'BACKENDS': {'default': 'django.core.mail.backends.dummy.EmailBackend'}})
+    def test_send_queued_releases_lease(self):
+        email = Email.objects.create(to=['to@example.com'], from_email='bob@example.com',
+                                     subject='Test', message='Message', status=STATUS.queued)
+        self.assertEqual(send_queued(), (1, 0, 0))
+        email.refresh_from_db()
+        self.assertEqual(email.status, STATUS.sent)
+        self.assertEqual(email.lease_owner, '')
+        self.assertIsNone(email.lease_expires_at)
+
     def test_get_batch_size(self):
         """
         Ensure BATCH_SIZE setting is read correctly.
@@ -232,6 +434,129 @@ class MailTest(TestCase):
         send_many(kwargs_list)
         self.assertEqual(Email.objects.filter(to=['a@example.com']).count(), 1)
 
+    @override_settings(POST_OFFICE_CACHE=False, POST_OFFICE={'SEND_MANY_BATCH_SIZE': 2})
+    def test_send_many_resolves_values_once(self):
+        """
+        Ensure send_many() looks up templates and compiles them once and
+        inserts emails in chunks.
+        """
+        EmailTemplate.objects.create(name='welcome', subject='Hi {{ name }}',
+                                     content='Hello {{ name }}', html_content='<p>{{ name }}</p>')
+        kwargs_list = [
+            {'sender': 'from@example.com', 'recipients': ['%d@example.com' % i],
+             'cc': 'cc@example.com', 'template': 'welcome', 'context': {'name': i}}
+            for i in range(5)
+        ]
+        with patch('post_office.mail.Template', wraps=Template) as compile_template:
+            with CaptureQueriesContext(connection) as queries:
+                send_many(kwargs_list)
+        # Templates are compiled once per chunk
+        self.assertEqual(compile_template.call_count, 9)
+        # One query to fetch the template, three to insert the emails
+        statements = [query['sql'].split()[0] for query in queries.captured_queries]
+        self.assertEqual(statements.count('SELECT'), 1)
+        self.assertEqual(statements.count('INSERT'), 3)
+        self.assertEqual(sorted(Email.objects.values_list('subject', flat=True)),
+                         ['Hi %d' % i for i in range(5)])
+
+        with self.assertRaisesMessage(ValidationError, 'bcc: invalid is not a valid email address'):
+            send_many([{'sender': 'from@example.com', 'recipients': ['a@example.com'],
+                        'bcc': ['invalid']}])
+        with self.assertRaises(ValueError):
+            send_many([{'sender': 'from@example.com', 'recipients': ['a@example.com'],
+                        'backend': 'unknown'}])
+
+    @override_settings(POST_OFFICE={'SEND_MANY_BATCH_SIZE': 2})
+    def test_send_many_iterable(self):
+        """
+        Ensure send_many() consumes iterables in chunks, each of which is
+        inserted and signalled on its own.
+        """
+        consumed = []
+
+        def generate_kwargs():
+            for i in range(5):
+                consumed.append(i)
+                yield {'sender': 'from@example.com', 'recipients': ['%d@example.com' % i]}
+            consumed.append('end')
+            yield {'sender': 'from@example.com', 'recipients': ['invalid']}
+
+        chunks = []
+
+        def receiver(sender, emails, **kwargs):
+            chunks.append(([email.to[0] for email in emails], list(consumed)))
+
+        email_queued.connect(receiver)
+        try:
+            with self.assertRaises(ValidationError):
+                send_many(generate_kwargs())
+        finally:
+            email_queued.disconnect(receiver)
+
+        self.assertEqual(chunks, [
+            (['0@example.com', '1@example.com'], [0, 1]),
+            (['2@example.com', '3@example.com'], [0, 1, 2, 3]),
+        ])
+        # Chunks inserted before the invalid email are kept
+        self.assertEqual(Email.objects.count(), 4)
+
+    def test_send_many_with_attachments(self):
+        kwargs_list = [
+            {'sender': 'from@example.com', 'recipients': ['%d@example.com' % i],
+             'subject': 'Subject', 'message': 'Message'}
+            for i in range(3)
+        ]
+        send_many(kwargs_list, attachments={
+            'attachment_file1.txt': ContentFile('content'),
+            'attachment_file2.txt': ContentFile('content'),
+        })
+        self.assertEqual(Attachment.objects.count(), 2)
+        for email in Email.objects.all():
+            self.assertEqual(sorted(attachment.name for attachment in email.attachments.all()),
+                             ['attachment_file1.txt', 'attachment_file2.txt'])
+
+        # Attachments can't be given per email
+        with self.assertRaises(ValueError):
+            send_many([dict(kwargs_list[0], attachments={'file.txt': ContentFile('content')})])
+
+    def test_bulk_create_with_pks(self):
+        Email.objects.create(to=['existing@example.com'], from_email='from@example.com')
+        emails = [
+            Email(to=['a@example.com'], from_email='from@example.com', message_id='<a@example.com>'),
+            Email(to=['b@example.com'], from_email='from@example.com'),
+            Email(to=['c@example.com'], from_email='from@example.com', message_id='<c@example.com>'),
+        ]
+        with patch.object(connection.features, 'can_return_rows_from_bulk_insert', False, create=True), \
+                override_settings(POST_OFFICE={'BATCH_SIZE': 2}), self.assertNumQueries(5):
+            _bulk_create_with_pks(emails)
+        for email in emails:
+            self.assertEqual(Email.objects.get(pk=email.pk).to, email.to)
+        # Message-IDs given for the lookup are removed again
+        self.assertEqual([email.message_id for email in emails], ['<a@example.com>', None, '<c@example.com>'])
+        self.assertIsNone(Email.objects.get(pk=emails[1].pk).message_id)
+
+    @override_settings(POST_OFFICE={'STORE_RECIPIENTS': True})
+    def test_store_recipients(self):
+        email = send(recipients=['Alice <Alice@example.com>'], cc='bob@example.com',
+                     bcc=['carol@example.com'], sender='from@example.com')
+        self.assertEqual(
+            sorted(email.recipients.values_list('address', 'type')),
+            [('alice@example.com', RECIPIENT_TYPE.to), ('bob@example.com', RECIPIENT_TYPE.cc),
+             ('carol@example.com', RECIPIENT_TYPE.bcc)])
+
+        send_many([{'sender': 'from@example.com', 'recipients': ['alice@example.com']}],
+                  attachments={'file.txt': ContentFile('content')})
+        send_many([{'sender': 'from@example.com', 'recipients': ['dave@example.com']}])
+        self.assertEqual(Email.objects.with_recipient('ALICE@example.com').count(), 2)
+        self.assertEqual(Email.objects.with_recipient('dave@example.com').count(), 1)
+        self.assertEqual(Email.objects.with_recipient('eve@example.com').count(), 0)
+
+    def test_with_recipient_without_stored_recipients(self):
+        send(recipients=['alice@example.com'], sender='from@example.com')
+        send(recipients=['bob@example.com'], bcc=['alice@example.com'], sender='from@example.com')
+        self.assertFalse(Recipient.objects.exists())
+        self.assertEqual(Email.objects.with_recipient('alice@example.com').count(), 2)
+
     def test_send_with_attachments(self):
         attachments = {
             'attachment_file1.txt': ContentFile('content'),
@@ -402,6 +727,8 @@ class MailTest(TestCase):
         _send_bulk([email], uses_multiprocessing=False)
         email = Email.objects.get(id=email.id)
         self.assertEqual(email.status, STATUS.requeued)
+        self.assertEqual(email.number_of_retries, 1)
+        self.assertEqual(email.logs.count(), 1)
 
     def test_retry_failed(self):
         self.assertEqual(get_retry_timedelta(), timezone.timedelta(minutes=15))
@@ -449,6 +776,41 @@ class MailTest(TestCase):
             self.assertEqual(email.number_of_retries, 2)
             self.assertEqual(email.scheduled_time, timezone.datetime(2020, 5, 18, 8, 30, 1))
 
+    def test_retry_policy(self):
+        config = dict(settings.POST_OFFICE, RETRY_POLICY={
+            'BACKEND': 'post_office.retry.ExponentialRetryPolicy',
+            'OPTIONS': {'interval': timezone.timedelta(minutes=1)},
+        })
+        with override_settings(POST_OFFICE=config):
+            with patch('django.utils.timezone.now', side_effect=lambda: timezone.datetime(2020, 5, 18, 8, 0, 0)):
+                email = create('from@example.com', recipients=['to@example.com'], subject='subject',
+                               message='message', backend='error')
+                self.assertTupleEqual(send_queued(), (0, 0, 1))
+                email.refresh_from_db()
+                self.assertEqual(email.number_of_retries, 1)
+                self.assertEqual(email.scheduled_time, timezone.datetime(2020, 5, 18, 8, 1, 0))
+
+            # the delay doubles with each retry
+            with patch('django.utils.timezone.now', side_effect=lambda: timezone.datetime(2020, 5, 18, 8, 1, 0)):
+                self.assertTupleEqual(send_queued(), (0, 0, 1))
+                email.refresh_from_db()
+                self.assertEqual(email.status, STATUS.requeued)
+                self.assertEqual(email.number_of_retries, 2)
+                self.assertEqual(email.scheduled_time, timezone.datetime(2020, 5, 18, 8, 3, 0))
+
+    @override_settings(POST_OFFICE=dict(settings.POST_OFFICE, RETRY_POLICY={
+        'BACKEND': 'post_office.retry.SMTPRetryPolicy',
+    }))
+    def test_retry_policy_gives_up(self):
+        email = create('from@example.com', recipients=['to@example.com'], subject='subject',
+                       message='message', backend='locmem')
+        exception = smtplib.SMTPRecipientsRefused({'to@example.com': (550, b'No such user')})
+        with patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=exception):
+            self.assertTupleEqual(send_queued(), (0, 1, 0))
+        email.refresh_from_db()
+        self.assertEqual(email.status, STATUS.failed)
+        self.assertEqual(email.number_of_retries, 0)
+
     @override_settings(USE_TZ=True)
     def test_expired(self):
         tzinfo = pytz.timezone('Asia/Jakarta')
@@ -3,6 +3,7 @@ import json
 import os
 
 from datetime import datetime, timedelta
+from unittest.mock import patch
 
 from django.conf import settings as django_settings, settings
 from django.core import mail
@@ -13,7 +14,9 @@ from django.forms.models import modelform_factory
 from django.test import TestCase
 from django.utils import timezone
 
-from ..models import Email, Log, PRIORITY, STATUS, EmailTemplate, Attachment
+from ..models import Email, Log, PRIORITY, STATUS, EmailTemplate, Attachment, prepare_email_messages
+from ..settings import get_template_engine
+from ..template import get_compiled_templates
 from ..mail import send
 
 
@@ -65,6 +68,91 @@ class ModelTest(TestCase):
         self.assertEqual(message.body, 'Content test')
         self.assertEqual(message.alternatives[0][0], 'HTML test')
 
+    def test_email_message_render_compiles_template_once(self):
+        """
+        Ensure templates are compiled once and recompiled after being changed.
+        """
+        template = EmailTemplate.objects.create(
+            subject='Subject {{ name }}',
+            content='Content {{ name }}',
+            html_content='HTML {{ name }}'
+        )
+        engine = get_template_engine()
+        with patch.object(engine, 'from_string', wraps=engine.from_string) as from_string:
+            for name in ['Alice', 'Bob']:
+                email = Email.objects.create(to=['to@example.com'], template=template,
+                                             from_email='from@e.com', context={'name': name})
+                message = Email.objects.get(id=email.id).email_message()
+                self.assertEqual(message.subject, 'Subject %s' % name)
+            self.assertEqual(from_string.call_count, 3)
+
+            template.subject = 'New subject {{ name }}'
+            template.save()
+            message = Email.objects.get(id=email.id).email_message()
+            self.assertEqual(message.subject, 'New subject Bob')
+            self.assertEqual(from_string.call_count, 6)
+
+    def test_prepare_email_messages(self):
+        """
+        Ensure emails are prepared grouped by template, looking up each
+        template once and reporting emails which can't be rendered.
+        """
+        template = EmailTemplate.objects.create(
+            subject='Subject {{ name }}',
+            content='Content {{ name }}',
+        )
+        faulty_template = EmailTemplate.objects.create(subject='{% if foo %}Subject')
+        emails = [
+            Email.objects.create(to=['to@example.com'], template=template,
+                                 from_email='from@e.com', context={'name': 'Alice'}),
+            Email.objects.create(to=['to@example.com'], from_email='from@e.com',
+                                 subject='Plain subject'),
+            Email.objects.create(to=['to@example.com'], template=faulty_template,
+                                 from_email='from@e.com'),
+            Email.objects.create(to=['to@example.com'], template=template,
+                                 from_email='from@e.com', context={'name': 'Bob'}),
+        ]
+        with patch('post_office.models.get_compiled_templates',
+                   wraps=get_compiled_templates) as compiled_templates:
+            results = list(prepare_email_messages(emails))
+        self.assertEqual(compiled_templates.call_count, 2)
+
+        self.assertEqual([email for email, exception in results],
+                         [emails[0], emails[3], emails[1], emails[2]])
+        self.assertEqual([email.email_message().subject for email, exception in results[:3]],
+                         ['Subject Alice', 'Subject Bob', 'Plain subject'])
+        self.assertIsNone(results[0][1])
+        self.assertIsNotNone(results[3][1])
+
+    def test_prepare_messages(self):
+        """
+        Ensure messages are prepared with a fixed number of queries.
+        """
+        template = EmailTemplate.objects.create(subject='Subject {{ name }}')
+        translated_template = template.translated_templates.create(
+            language='nl', subject='Onderwerp {{ name }}')
+        attachment = Attachment()
+        attachment.file.save('test.txt', content=ContentFile('test file content'), save=True)
+        for i in range(4):
+            email = Email.objects.create(to=['to@example.com'], from_email='from@e.com',
+                                         template=[template, translated_template][i % 2],
+                                         context={'name': i})
+            email.attachments.add(attachment)
+
+        with self.assertNumQueries(3):
+            results = Email.objects.prepare_messages(Email.objects.order_by('id'))
+        self.assertEqual(len(results), 4)
+        self.assertEqual([email.email_message().subject for email, exception in results],
+                         ['Subject 0', 'Subject 2', 'Onderwerp 1', 'Onderwerp 3'])
+        self.assertEqual(results[0][0].email_message().attachments,
+                         [('test.txt', 'test file content', 'text/plain')])
+
+        emails = list(Email.objects.all())
+        with self.assertNumQueries(2):
+            Email.objects.prepare_messages(emails)
+        with self.assertNumQueries(0):
+            Email.objects.prepare_messages(emails)
+
     def test_dispatch(self):
         """
         Ensure that email.dispatch() actually sends out the email
@@ -75,13 +163,11 @@ class ModelTest(TestCase):
         self.assertEqual(mail.outbox[0].subject, 'Test dispatch')
 
     def test_dispatch_with_override_recipients(self):
-        previous_settings = settings.POST_OFFICE
-        setattr(settings, 'POST_OFFICE', {'OVERRIDE_RECIPIENTS': ['override@gmail.com']})
-        email = Email.objects.create(to=['to@example.com'], from_email='from@example.com',
-                                     subject='Test dispatch', message='Message', backend_alias='locmem')
-        email.dispatch()
+        with self.settings(POST_OFFICE=dict(settings.POST_OFFICE, OVERRIDE_RECIPIENTS=['override@gmail.com'])):
+            email = Email.objects.create(to=['to@example.com'], from_email='from@example.com',
+                                         subject='Test dispatch', message='Message', backend_alias='locmem')
+            email.dispatch()
         self.assertEqual(mail.outbox[0].to, ['override@gmail.com'])
-        settings.POST_OFFICE = previous_settings
 
     def test_status_and_log(self):
         """
@@ -310,6 +396,33 @@ class ModelTest(TestCase):
         self.assertEqual(message.attachments,
                          [('test.txt', 'test file content', 'text/plain')])
 
+    def test_attachment_payload_is_read_once(self):
+        attachment = Attachment()
+        attachment.file.save(
+            'test.txt', content=ContentFile('test file content'), save=True
+        )
+        emails = []
+        for i in range(3):
+            email = Email.objects.create(to=['to@example.com'],
+                                         from_email='from@example.com',
+                                         subject='Subject')
+            email.attachments.add(attachment)
+            emails.append(email)
+
+        with patch.object(attachment.file.storage, 'open',
+                          wraps=attachment.file.storage.open) as storage_open:
+            for email in Email.objects.filter(id__in=[e.id for e in emails]).prefetch_related('attachments'):
+                self.assertEqual(email.email_message().attachments,
+                                 [('test.txt', 'test file content', 'text/plain')])
+            self.assertEqual(storage_open.call_count, 1)
+
+        with self.settings(POST_OFFICE={'ATTACHMENT_CACHE_SIZE': 0}):
+            with patch.object(attachment.file.storage, 'open',
+                              wraps=attachment.file.storage.open) as storage_open:
+                for email in Email.objects.filter(id__in=[e.id for e in emails]):
+                    email.email_message()
+                self.assertEqual(storage_open.call_count, 3)
+
     def test_translated_template_uses_default_templates_name(self):
         template = EmailTemplate.objects.create(name='name')
         id_template = template.translated_templates.create(language='id')
@@ -0,0 +1,73 @@
+from datetime import datetime
+from unittest.mock import MagicMock, patch
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from ..mail import send_many
+from ..models import Email, STATUS
+from ..pgcopy import copy_emails, format_copy_value, get_copy_fields
+
+
+class CopyTest(TestCase):
+
+    def test_format_copy_value(self):
+        self.assertEqual(format_copy_value(None), '\\N')
+        self.assertEqual(format_copy_value(True), 't')
+        self.assertEqual(format_copy_value(3), '3')
+        self.assertEqual(format_copy_value(b'\x00\xff'), '\\\\x00ff')
+        self.assertEqual(format_copy_value(datetime(2020, 1, 2, 3, 4, 5)), '2020-01-02T03:04:05')
+        self.assertEqual(format_copy_value('a\\b\tc\nd\re'), 'a\\\\b\\tc\\nd\\re')
+
+    def test_copy_emails(self):
+        copied = []
+
+        def copy_expert(sql, file):
+            copied.append(sql)
+            while True:
+                data = file.read(100)
+                if not data:
+                    break
+                copied.append(data)
+
+        cursor = MagicMock()
+        cursor.__enter__.return_value.copy_expert.side_effect = copy_expert
+        emails = [
+            Email(from_email='from@example.com', to=['a@example.com', 'b@example.com'],
+                  subject='Line\\nbreak\t%d' % i, context={'name': i}, status=STATUS.queued)
+            for i in range(3)
+        ]
+        with patch.object(connection, 'cursor', return_value=cursor):
+            copy_emails(emails)
+
+        columns = [field.column for field in get_copy_fields()]
+        context_field = Email._meta.get_field('context')
+        self.assertEqual(copied[0], 'COPY "post_office_email" (%s) FROM STDIN'
+                         % ', '.join('"%s"' % column for column in columns))
+        rows = b''.join(copied[1:]).decode().split('\n')
+        self.assertEqual(rows[-1], '')
+        self.assertEqual(len(rows), 4)
+        for i, row in enumerate(rows[:3]):
+            values = dict(zip(columns, row.split('\t')))
+            self.assertEqual(values['to'], 'a@example.com, b@example.com')
+            self.assertEqual(values['subject'], 'Line\\\\nbreak\\t%d' % i)
+            self.assertEqual(values['context'], format_copy_value(
+                context_field.get_db_prep_save({'name': i}, connection)))
+            self.assertEqual(values['status'], str(STATUS.queued))
+            self.assertEqual(values['scheduled_time'], '\\N')
+            self.assertTrue(values['created'])
+
+    @override_settings(POST_OFFICE={'SEND_MANY_COPY': True})
+    def test_send_many(self):
+        kwargs_list = [{'sender': 'from@example.com', 'recipients': ['a@example.com']}]
+        with patch('post_office.mail.copy_emails') as copy:
+            # Other databases fall back to bulk_create()
+            send_many(kwargs_list)
+            self.assertFalse(copy.called)
+            self.assertEqual(Email.objects.count(), 1)
+
+            with patch('post_office.mail.supports_copy', return_value=True):
+                send_many(kwargs_list)
+            self.assertEqual(len(copy.call_args[0][0]), 1)
+            self.assertEqual(Email.objects.count(), 1)
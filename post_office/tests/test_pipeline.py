@@ -0,0 +1,81 @@
+from unittest.mock import patch
+
+from django.core import mail
+from django.db import DatabaseError
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from ..mail import get_queued, send_queued
+from ..models import Email, EmailTemplate, STATUS
+from ..pipeline import SendingPipeline
+from .utils import create_email
+
+
+PIPELINE_SETTINGS = {
+    'BACKENDS': {
+        'default': 'django.core.mail.backends.dummy.EmailBackend',
+        'locmem': 'django.core.mail.backends.locmem.EmailBackend',
+        'error': 'post_office.tests.test_backends.ErrorRaisingBackend',
+    },
+    'SENDING_ENGINE': 'pipeline',
+    'BATCH_SIZE': 2,
+    'THREADS_PER_PROCESS': 2,
+    'MAX_RETRIES': 1,
+}
+
+
+@override_settings(POST_OFFICE=PIPELINE_SETTINGS)
+class PipelineTest(TestCase):
+
+    def test_send_queued(self):
+        """
+        The pipeline keeps fetching batches until the queue is empty.
+        """
+        for i in range(7):
+            create_email(subject='Test %d' % i)
+        self.assertEqual(send_queued(), (7, 0, 0))
+        self.assertEqual(Email.objects.filter(status=STATUS.sent).count(), 7)
+        self.assertEqual(len(mail.outbox), 7)
+        self.assertEqual(sorted(message.subject for message in mail.outbox),
+                         ['Test %d' % i for i in range(7)])
+        # Every email is logged exactly once
+        for email in Email.objects.all():
+            self.assertEqual(email.logs.count(), 1)
+
+    def test_failures(self):
+        """
+        Failed deliveries and rendering errors are requeued, but not resent
+        within the same run.
+        """
+        template = EmailTemplate.objects.create(subject='{% if foo %}Subject')
+        sent = create_email()
+        failed = create_email(backend_alias='error')
+        faulty = create_email(template=template)
+
+        pipeline = SendingPipeline()
+        self.assertEqual(pipeline.run(), (1, 0, 2))
+        self.assertEqual(pipeline.in_flight, 0)
+        sent.refresh_from_db()
+        failed.refresh_from_db()
+        faulty.refresh_from_db()
+        self.assertEqual(sent.status, STATUS.sent)
+        self.assertEqual(failed.status, STATUS.requeued)
+        self.assertEqual(failed.number_of_retries, 1)
+        self.assertIsNone(failed.lease_expires_at)
+        self.assertEqual(faulty.status, STATUS.requeued)
+
+    def test_error_persists_results(self):
+        """
+        Results of emails sent before an error are persisted, so that they
+        aren't left in sending state and sent again.
+        """
+        emails = [create_email(), create_email()]
+        queued = [list(get_queued()), DatabaseError('Connection lost')]
+        with patch('post_office.pipeline.get_queued', side_effect=queued):
+            with self.assertRaises(DatabaseError):
+                SendingPipeline().run()
+        self.assertEqual(len(mail.outbox), 2)
+        for email in emails:
+            email.refresh_from_db()
+            self.assertEqual(email.status, STATUS.sent)
+            self.assertEqual(email.logs.count(), 1)
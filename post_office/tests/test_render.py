@@ -0,0 +1,83 @@
+from django.core import mail
+from django.core.files.base import ContentFile
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from ..mail import _send_bulk
+from ..models import Attachment, Email, EmailTemplate, STATUS
+from ..render import (PrerenderedEmailMessage, RenderedMessage, close_render_pool, get_render_pool,
+                      render_email_messages)
+from .utils import create_email
+
+
+RENDER_SETTINGS = {
+    'BACKENDS': {
+        'default': 'django.core.mail.backends.dummy.EmailBackend',
+        'locmem': 'django.core.mail.backends.locmem.EmailBackend',
+    },
+    'RENDER_PROCESSES': 2,
+    'MAX_RETRIES': 1,
+}
+
+
+@override_settings(POST_OFFICE=RENDER_SETTINGS)
+class RenderTest(TestCase):
+
+    def test_rendered_message(self):
+        message = RenderedMessage(b'Subject: Hi\r\n\r\nLine 1\r\nLine 2\r\n')
+        self.assertEqual(message.as_bytes(linesep='\r\n'), b'Subject: Hi\r\n\r\nLine 1\r\nLine 2\r\n')
+        self.assertEqual(message.as_bytes(), b'Subject: Hi\n\nLine 1\nLine 2\n')
+        self.assertEqual(message['Subject'], 'Hi')
+
+    def test_render_email_messages(self):
+        template = EmailTemplate.objects.create(subject='Hi {{ name }}', content='Hello {{ name }}')
+        faulty_template = EmailTemplate.objects.create(subject='{% if foo %}Subject')
+        emails = [
+            create_email(template=template, context={'name': 'Alice'}),
+            create_email(subject='Plain', message='Plain message'),
+            create_email(template=faulty_template),
+        ]
+        attachment = Attachment(name='test.txt')
+        attachment.file.save('test.txt', content=ContentFile('attachment'), save=True)
+        attachment.emails.add(emails[0])
+
+        results = dict(render_email_messages(Email.objects.filter(id__in=[e.id for e in emails]), 2))
+        self.assertEqual(len(results), 3)
+        alice, plain, faulty = sorted(results, key=lambda email: email.id)
+        self.assertIsNotNone(results[faulty])
+        self.assertIsNone(results[alice])
+        self.assertIsNone(results[plain])
+
+        message = alice.email_message()
+        self.assertIsInstance(message, PrerenderedEmailMessage)
+        self.assertEqual(message.subject, 'Hi Alice')
+        self.assertEqual(message.recipients(), ['to@example.com'])
+        parsed = message.message()
+        self.assertEqual(parsed['Subject'], 'Hi Alice')
+        payloads = [part.get_payload(decode=True) for part in parsed.walk()
+                    if not part.is_multipart()]
+        self.assertEqual(payloads, [b'Hello Alice', b'attachment'])
+        self.assertEqual(plain.email_message().message()['Subject'], 'Plain')
+
+    def test_render_pool(self):
+        self.addCleanup(close_render_pool)
+        pool = get_render_pool(2)
+        # Render processes are reused across batches
+        self.assertIs(get_render_pool(2), pool)
+        self.assertIsNot(get_render_pool(3), pool)
+        close_render_pool()
+        self.assertIsNot(get_render_pool(2), pool)
+
+    def test_send_bulk(self):
+        template = EmailTemplate.objects.create(subject='Hi {{ name }}', content='Hello {{ name }}')
+        faulty_template = EmailTemplate.objects.create(subject='{% if foo %}Subject')
+        for name in ['Alice', 'Bob']:
+            create_email(template=template, context={'name': name})
+        faulty = create_email(template=faulty_template)
+
+        result = _send_bulk(list(Email.objects.all()), uses_multiprocessing=False)
+        self.assertEqual(result, (2, 0, 1))
+        self.assertEqual(sorted(message.subject for message in mail.outbox), ['Hi Alice', 'Hi Bob'])
+        self.assertEqual(Email.objects.filter(status=STATUS.sent).count(), 2)
+        faulty.refresh_from_db()
+        self.assertEqual(faulty.status, STATUS.requeued)
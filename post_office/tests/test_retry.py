@@ -0,0 +1,112 @@
+import smtplib
+from datetime import datetime, timedelta
+from unittest import skipUnless
+from unittest.mock import patch
+
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from ..models import Email
+from ..retry import (ExponentialRetryPolicy, FixedRetryPolicy, SMTPRetryPolicy,
+                     get_retry_policy, load_retry_policy)
+
+try:
+    import aiosmtplib
+except ImportError:
+    aiosmtplib = None
+
+
+class RetryPolicyTest(TestCase):
+
+    def setUp(self):
+        self.now = datetime(2020, 5, 18, 8, 0, 0)
+
+    def test_fixed(self):
+        email = Email(number_of_retries=1)
+        policy = FixedRetryPolicy()
+        self.assertEqual(policy.get_scheduled_time(email, None, self.now),
+                         self.now + timedelta(minutes=15))
+        policy = FixedRetryPolicy(interval=timedelta(minutes=1))
+        self.assertEqual(policy.get_scheduled_time(email, None, self.now),
+                         self.now + timedelta(minutes=1))
+
+    def test_exponential(self):
+        policy = ExponentialRetryPolicy(interval=timedelta(minutes=1), max_interval=timedelta(minutes=5))
+        delays = [policy.get_delay(Email(number_of_retries=retries), None)
+                  for retries in (None, 0, 1, 2, 3)]
+        self.assertEqual(delays, [timedelta(minutes=minutes) for minutes in (1, 1, 2, 4, 5)])
+
+        policy = ExponentialRetryPolicy(interval=timedelta(minutes=1), factor=3)
+        self.assertEqual(policy.get_delay(Email(number_of_retries=2), None), timedelta(minutes=9))
+
+    def test_jitter(self):
+        email = Email(number_of_retries=0)
+        policy = FixedRetryPolicy(interval=timedelta(minutes=10), jitter=0.5)
+        scheduled_times = {policy.get_scheduled_time(email, None, self.now) for _ in range(20)}
+        self.assertGreater(len(scheduled_times), 1)
+        for scheduled_time in scheduled_times:
+            self.assertGreaterEqual(scheduled_time, self.now + timedelta(minutes=5))
+            self.assertLessEqual(scheduled_time, self.now + timedelta(minutes=15))
+
+    def test_smtp(self):
+        email = Email(number_of_retries=0)
+        policy = SMTPRetryPolicy({'OPTIONS': {'interval': timedelta(minutes=1)}})
+        retry_time = self.now + timedelta(minutes=1)
+
+        self.assertEqual(policy.get_scheduled_time(email, ValueError(), self.now), retry_time)
+        self.assertEqual(policy.get_scheduled_time(
+            email, smtplib.SMTPDataError(451, b'Try again later'), self.now), retry_time)
+        self.assertIsNone(policy.get_scheduled_time(
+            email, smtplib.SMTPDataError(554, b'Rejected'), self.now))
+
+        # Emails are only given up when all recipients were refused permanently
+        refused = smtplib.SMTPRecipientsRefused({'a@example.com': (550, b'No such user'),
+                                                 'b@example.com': (450, b'Mailbox busy')})
+        self.assertEqual(policy.get_scheduled_time(email, refused, self.now), retry_time)
+        refused = smtplib.SMTPRecipientsRefused({'a@example.com': (550, b'No such user')})
+        self.assertIsNone(policy.get_scheduled_time(email, refused, self.now))
+
+    def test_smtp_options(self):
+        email = Email(number_of_retries=0)
+        policy = SMTPRetryPolicy(interval=timedelta(minutes=1), jitter=0.5)
+        self.assertIsInstance(policy.policy, FixedRetryPolicy)
+        self.assertEqual(policy.policy.jitter, 0.5)
+        with patch('random.uniform', return_value=1.5):
+            self.assertEqual(policy.get_scheduled_time(email, ValueError(), self.now),
+                             self.now + timedelta(minutes=1, seconds=30))
+
+        # Options of the configured policy take precedence
+        policy = SMTPRetryPolicy({'BACKEND': 'post_office.retry.ExponentialRetryPolicy',
+                                  'OPTIONS': {'factor': 3}}, factor=4, jitter=0.2)
+        self.assertIsInstance(policy.policy, ExponentialRetryPolicy)
+        self.assertEqual((policy.policy.factor, policy.policy.jitter), (3, 0.2))
+
+        with self.assertRaises(TypeError):
+            SMTPRetryPolicy(FixedRetryPolicy(), jitter=0.2)
+
+    @skipUnless(aiosmtplib, 'aiosmtplib is not installed')
+    def test_smtp_aiosmtplib(self):
+        email = Email(number_of_retries=0)
+        policy = SMTPRetryPolicy()
+        self.assertIsNotNone(policy.get_scheduled_time(
+            email, aiosmtplib.SMTPDataError(451, 'Try again later'), self.now))
+        self.assertIsNone(policy.get_scheduled_time(
+            email, aiosmtplib.SMTPDataError(554, 'Rejected'), self.now))
+        refused = aiosmtplib.SMTPRecipientsRefused([
+            aiosmtplib.SMTPRecipientRefused(550, 'No such user', 'a@example.com'),
+        ])
+        self.assertIsNone(policy.get_scheduled_time(email, refused, self.now))
+
+    def test_load_retry_policy(self):
+        policy = load_retry_policy({
+            'BACKEND': 'post_office.retry.ExponentialRetryPolicy',
+            'OPTIONS': {'factor': 4},
+        })
+        self.assertIsInstance(policy, ExponentialRetryPolicy)
+        self.assertEqual(policy.factor, 4)
+        self.assertIsInstance(load_retry_policy({}), FixedRetryPolicy)
+
+    def test_get_retry_policy(self):
+        self.assertIsInstance(get_retry_policy(), FixedRetryPolicy)
+        with override_settings(POST_OFFICE={'RETRY_POLICY': {'BACKEND': 'post_office.retry.SMTPRetryPolicy'}}):
+            self.assertIsInstance(get_retry_policy(), SMTPRetryPolicy)
@@ -0,0 +1,99 @@
+import email
+import os
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from ..models import Attachment, Email
+from ..streaming import EmailBackend, StreamingAttachment, write_message
+
+
+class FakeSMTP:
+    """Records the commands and data sent by ``streaming.EmailBackend``."""
+
+    def __init__(self):
+        self.commands = []
+        self.chunks = []
+
+    def ehlo_or_helo_if_needed(self):
+        pass
+
+    def mail(self, sender, options=()):
+        self.commands.append(('mail', sender))
+        return 250, b'OK'
+
+    def rcpt(self, recipient, options=()):
+        self.commands.append(('rcpt', recipient))
+        if recipient.startswith('reject'):
+            return 550, b'Mailbox unavailable'
+        return 250, b'OK'
+
+    def putcmd(self, cmd):
+        self.commands.append((cmd,))
+
+    def getreply(self):
+        if self.commands[-1] == ('data',):
+            self.commands.append(('354',))
+            return 354, b'Go ahead'
+        return 250, b'OK'
+
+    def send(self, data):
+        self.chunks.append(data)
+
+    def _rset(self):
+        self.commands.append(('rset',))
+
+
+@override_settings(POST_OFFICE={'STREAMING_ATTACHMENT_THRESHOLD': 1024})
+class StreamingTest(TestCase):
+
+    def setUp(self):
+        self.content = os.urandom(200 * 1024)
+        self.email = Email.objects.create(to=['to@example.com'], from_email='from@example.com',
+                                          subject='Subject', message='.Message')
+        large = Attachment(name='large.bin')
+        large.file.save('large.bin', content=ContentFile(self.content), save=True)
+        small = Attachment(name='small.txt')
+        small.file.save('small.txt', content=ContentFile(b'small'), save=True)
+        self.email.attachments.add(large, small)
+
+    def get_attachments(self, message):
+        return {part.get_filename(): part.get_payload(decode=True)
+                for part in message.walk() if part.get_filename()}
+
+    def test_large_attachments_are_streamed(self):
+        message = self.email.email_message()
+        self.assertEqual([type(attachment) for attachment in message.attachments],
+                         [StreamingAttachment, tuple])
+
+        # Serializing a message the usual way reads the whole file
+        parsed = email.message_from_bytes(message.message().as_bytes())
+        self.assertEqual(self.get_attachments(parsed),
+                         {'large.bin': self.content, 'small.txt': b'small'})
+
+        mime_message = message.message()
+        fp = BytesIO()
+        write_message(mime_message, fp)
+        self.assertEqual(fp.getvalue(), mime_message.as_bytes())
+
+    def test_smtp_backend(self):
+        backend = EmailBackend()
+        backend.connection = FakeSMTP()
+        message = self.email.email_message()
+        message.to = ['to@example.com', 'reject@example.com']
+        self.assertTrue(backend._send(message))
+
+        commands = backend.connection.commands
+        self.assertEqual(commands[:4], [('mail', 'from@example.com'), ('rcpt', 'to@example.com'),
+                                        ('rcpt', 'reject@example.com'), ('data',)])
+        chunks = backend.connection.chunks
+        # The file is sent in chunks, not as a whole
+        self.assertLess(max(len(chunk) for chunk in chunks), len(self.content))
+        data = b''.join(chunks)
+        self.assertTrue(data.endswith(b'\r\n.\r\n'))
+        self.assertIn(b'\r\n..Message', data)
+        parsed = email.message_from_bytes(data[:-3].replace(b'\r\n..', b'\r\n.'))
+        self.assertEqual(self.get_attachments(parsed),
+                         {'large.bin': self.content, 'small.txt': b'small'})
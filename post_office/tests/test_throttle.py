@@ -0,0 +1,99 @@
+from unittest.mock import patch
+
+from django.conf import settings
+from django.core.cache import caches
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from ..mail import _send_bulk
+from ..models import Email, STATUS
+from ..throttle import (SharedTokenBucket, Throttle, TokenBucket, get_throttle,
+                        parse_rate)
+
+
+class ThrottleTest(TestCase):
+
+    def test_parse_rate(self):
+        self.assertEqual(parse_rate(10), (10, 10))
+        self.assertEqual(parse_rate('10/s'), (10, 10))
+        self.assertEqual(parse_rate('600/m'), (10, 600))
+        self.assertEqual(parse_rate('3600/hour'), (1, 3600))
+        self.assertEqual(parse_rate({'RATE': '600/m', 'BURST': 5}), (10, 5))
+        self.assertEqual(parse_rate(0.5), (0.5, 1))
+
+    def test_token_bucket(self):
+        with patch('post_office.throttle.time.monotonic', return_value=100):
+            bucket = TokenBucket(rate=2, capacity=2)
+            self.assertEqual(bucket.take(), 0)
+            self.assertEqual(bucket.take(), 0)
+            self.assertEqual(bucket.take(), 0.5)
+        with patch('post_office.throttle.time.monotonic', return_value=100.5):
+            self.assertEqual(bucket.take(), 0)
+            self.assertEqual(bucket.take(), 0.5)
+        # Tokens don't accumulate beyond the capacity
+        with patch('post_office.throttle.time.monotonic', return_value=200):
+            self.assertEqual([bucket.take() for i in range(3)], [0, 0, 0.5])
+
+    def test_shared_token_bucket(self):
+        cache = caches['default']
+        cache.clear()
+        with patch('post_office.throttle.time.time', return_value=100):
+            bucket = SharedTokenBucket(2, 2, cache=cache, key='test')
+            other_bucket = SharedTokenBucket(2, 2, cache=cache, key='test')
+            self.assertEqual(bucket.take(), 0)
+            self.assertEqual(other_bucket.take(), 0)
+            self.assertEqual(bucket.take(), 0.5)
+            self.assertIsNone(cache.get('test:lock'))
+
+            # Waits while another process holds the lock
+            cache.add('test:lock', 'other')
+            self.assertGreater(bucket.take(), 0)
+            self.assertEqual(cache.get('test:lock'), 'other')
+
+    def test_get_buckets(self):
+        throttle = Throttle({
+            'BACKENDS': {'locmem': '10/s'},
+            'DOMAINS': {'Example.com': '5/s', '*': '1/s'},
+        })
+        email = Email.objects.create(to=['a@example.com', 'B@EXAMPLE.COM'], cc=['c@example.org'],
+                                     from_email='from@example.com', backend_alias='locmem')
+        buckets = throttle.get_buckets(email)
+        self.assertEqual([(bucket.rate, bucket.capacity) for bucket in buckets],
+                         [(10, 10), (5, 5), (1, 1)])
+        # Buckets are shared by emails with the same backend alias or domain
+        email = Email.objects.create(to=['d@example.org'], from_email='from@example.com')
+        self.assertEqual(throttle.get_buckets(email), [buckets[2]])
+
+    def test_get_throttle(self):
+        self.assertIsNone(get_throttle())
+        config = dict(settings.POST_OFFICE, RATE_LIMITS={'BACKENDS': {'default': 10}, 'CACHE': 'default'})
+        with override_settings(POST_OFFICE=config):
+            throttle = get_throttle()
+            self.assertIsInstance(throttle, Throttle)
+            self.assertIs(get_throttle(), throttle)
+            email = Email.objects.create(to=['to@example.com'], from_email='from@example.com')
+            bucket = throttle.get_buckets(email)[0]
+            self.assertIsInstance(bucket, SharedTokenBucket)
+            self.assertEqual(bucket.key, 'post_office:throttle:backend:default')
+
+    def test_send_bulk_waits_for_throttle(self):
+        config = dict(settings.POST_OFFICE, RATE_LIMITS={'DOMAINS': {'example.com': '1/s'}})
+        emails = [
+            Email.objects.create(to=['to@example.com'], from_email='from@example.com',
+                                 status=STATUS.queued, backend_alias='locmem')
+            for i in range(3)
+        ]
+        clock = [0]
+        delays = []
+
+        def sleep(delay):
+            delays.append(delay)
+            clock[0] += delay
+
+        with override_settings(POST_OFFICE=config), \
+                patch('post_office.throttle.time') as time:
+            time.monotonic.side_effect = lambda: clock[0]
+            time.sleep.side_effect = sleep
+            _send_bulk(emails, uses_multiprocessing=False)
+        self.assertEqual(delays, [1, 1])
+        self.assertEqual(Email.objects.filter(status=STATUS.sent).count(), 3)
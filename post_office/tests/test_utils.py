@@ -1,12 +1,19 @@
+import os
+from datetime import timedelta
+
+from django.core.files import File
 from django.core.files.base import ContentFile
 from django.core.exceptions import ValidationError
 
 from django.test import TestCase
 from django.test.utils import override_settings
+from django.utils import timezone
 
 from ..models import Email, STATUS, PRIORITY, EmailTemplate, Attachment
-from ..utils import (create_attachments, get_email_template, parse_emails,
-                     parse_priority, send_mail, split_emails)
+from ..utils import (DigestReader, cleanup_expired_mails, create_attachments,
+                     find_duplicate_attachment, get_content_digest, get_email_template,
+                     parse_emails, parse_priority, send_mail, split_emails,
+                     get_recipient_domain, sort_by_domain)
 from ..validators import validate_email_with_name, validate_comma_separated_emails
 
 
@@ -133,6 +140,25 @@ class UtilsTest(TestCase):
         email_list = split_emails(Email.objects.all(), 4)
         self.assertEqual(expected_size, [len(emails) for emails in email_list])
 
+    def test_get_recipient_domain(self):
+        self.assertEqual(get_recipient_domain(Email(to=['Name <to@Example.COM>'])), 'example.com')
+        self.assertEqual(get_recipient_domain(Email(to=[], bcc=['bcc@example.org'])), 'example.org')
+        self.assertEqual(get_recipient_domain(Email(to=[])), '')
+
+    def test_sort_by_domain(self):
+        emails = [
+            Email(to=['a@example.org'], priority=PRIORITY.high),
+            Email(to=['b@example.com'], priority=PRIORITY.high),
+            Email(to=['c@example.org'], priority=PRIORITY.high),
+            Email(to=['d@example.org'], priority=PRIORITY.medium),
+            Email(to=['e@example.com'], priority=PRIORITY.medium),
+            Email(to=['f@example.org'], priority=PRIORITY.medium, backend_alias='locmem'),
+            Email(to=['g@example.com'], priority=PRIORITY.medium),
+        ]
+        # Emails keep their priority order and their order within a domain
+        self.assertEqual([email.to[0][0] for email in sort_by_domain(emails)],
+                         ['b', 'a', 'c', 'e', 'g', 'd', 'f'])
+
     def test_create_attachments(self):
         attachments = create_attachments({
             'attachment_file1.txt': ContentFile('content'),
@@ -177,6 +203,88 @@ class UtilsTest(TestCase):
         self.assertEquals(attachments[0].name, 'attachment_file.py')
         self.assertEquals(attachments[0].mimetype, '')
 
+    @override_settings(POST_OFFICE={'DEDUPLICATE_ATTACHMENTS': True})
+    def test_create_attachments_deduplicated(self):
+        attachment = create_attachments({'invoice.pdf': ContentFile(b'content')})[0]
+        self.assertEqual(len(attachment.digest), 64)
+
+        storage = attachment.file.storage
+        directory = os.path.dirname(attachment.file.name)
+        files = storage.listdir(directory)[1]
+
+        # Same content, filename, mimetype and headers: the attachment is reused
+        self.assertEqual(create_attachments({'invoice.pdf': ContentFile(b'content')}), [attachment])
+        # and the copy written while computing the digest is removed
+        self.assertEqual(storage.listdir(directory)[1], files)
+
+        # Same content attached differently: the file is shared
+        other = create_attachments({
+            'invoice.pdf': {'file': ContentFile(b'content'), 'mimetype': 'application/pdf'},
+        })[0]
+        self.assertNotEqual(other.pk, attachment.pk)
+        self.assertEqual(other.file.name, attachment.file.name)
+        self.assertEqual(other.mimetype, 'application/pdf')
+
+        # Different content: a new file is stored
+        different = create_attachments({'invoice.pdf': ContentFile(b'other content')})[0]
+        self.assertNotEqual(different.file.name, attachment.file.name)
+        self.assertEqual(Attachment.objects.count(), 3)
+
+    def test_find_duplicate_attachment(self):
+        stored = Attachment()
+        stored.file.save('file.txt', ContentFile(b'content'), save=False)
+        for name, mimetype, headers in [('a.txt', '', None), ('b.txt', 'text/plain', None),
+                                        ('b.txt', 'text/plain', {'X-Header': 'value'})]:
+            Attachment.objects.create(name=name, mimetype=mimetype, headers=headers,
+                                      digest='digest', file=stored.file.name)
+        first, plain, with_headers = Attachment.objects.order_by('id')
+
+        attachment = Attachment(name='b.txt', mimetype='text/plain', headers={'X-Header': 'value'},
+                                digest='digest')
+        with self.assertNumQueries(1):
+            self.assertEqual(find_duplicate_attachment(attachment, 7), with_headers)
+        attachment.headers = None
+        self.assertEqual(find_duplicate_attachment(attachment, 7), plain)
+        # Without an exact match, any attachment with the same content is returned
+        attachment.name = 'c.txt'
+        with self.assertNumQueries(2):
+            self.assertEqual(find_duplicate_attachment(attachment, 7), first)
+        # A matching digest isn't trusted if the size differs
+        self.assertIsNone(find_duplicate_attachment(attachment, 8))
+        attachment.digest = 'other'
+        self.assertIsNone(find_duplicate_attachment(attachment, 7))
+
+        # Attachments whose file is missing are skipped
+        Attachment.objects.create(name='d.txt', digest='missing', file='attachments/missing.txt')
+        attachment.digest = 'missing'
+        self.assertIsNone(find_duplicate_attachment(attachment, 7))
+
+    def test_digest_reader(self):
+        content = ContentFile(b'content' * 1000)
+        reader = DigestReader(content)
+        self.assertEqual(b''.join(File(reader).chunks(chunk_size=100)), b'content' * 1000)
+        self.assertTrue(reader.is_complete())
+        self.assertEqual(reader.size, 7000)
+        self.assertEqual(reader.hexdigest(), get_content_digest(ContentFile(b'content' * 1000)))
+
+        # Skipping part of the content isn't hashed as a whole
+        reader.seek(0)
+        reader.read(10)
+        reader.seek(100)
+        reader.read()
+        self.assertFalse(reader.is_complete())
+
+    @override_settings(POST_OFFICE={'DEDUPLICATE_ATTACHMENTS': True})
+    def test_cleanup_keeps_shared_attachment_files(self):
+        email = Email.objects.create(to=['to@example.com'], from_email='from@example.com')
+        orphan = create_attachments({'a.txt': ContentFile(b'content')})[0]
+        attachment = create_attachments({'b.txt': ContentFile(b'content')})[0]
+        attachment.emails.add(email)
+
+        cleanup_expired_mails(timezone.now() - timedelta(days=1), delete_attachments=True)
+        self.assertFalse(Attachment.objects.filter(pk=orphan.pk).exists())
+        self.assertTrue(attachment.file.storage.exists(attachment.file.name))
+
     def test_parse_priority(self):
         self.assertEqual(parse_priority('now'), PRIORITY.now)
         self.assertEqual(parse_priority('high'), PRIORITY.high)
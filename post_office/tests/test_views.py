@@ -1,6 +1,7 @@
 from django.contrib.auth.models import User
 from django.test.client import Client
 from django.test import TestCase
+from django.test.utils import override_settings
 from django.urls import reverse
 
 from post_office import mail
@@ -29,3 +30,38 @@ class AdminViewTest(TestCase):
         email = Email.objects.latest('id')
         response = self.client.get(reverse('admin:post_office_email_change', args=[email.id]))
         self.assertEqual(response.status_code, 200)
+
+    @override_settings(POST_OFFICE={'STORE_RECIPIENTS': True})
+    def test_admin_search_recipient(self):
+        mail.send(recipients=['Alice <alice@example.com>'], sender='from@example.com',
+                  cc=['bob@example.com'], subject='First')
+        mail.send(recipients=['bob@example.com'], sender='from@example.com', subject='Second')
+        mail.send(recipients=['alice.smith@example.com'], sender='from@example.com', subject='Third')
+        response = self.client.get(reverse('admin:post_office_email_changelist'),
+                                   {'q': 'Bob@example.com'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(email.subject for email in response.context['cl'].result_list),
+                         ['First', 'Second'])
+
+        # Matches of the searched fields are still found
+        response = self.client.get(reverse('admin:post_office_email_changelist'),
+                                   {'q': 'alice.smith@example'})
+        self.assertEqual([email.subject for email in response.context['cl'].result_list], ['Third'])
+
+    @override_settings(POST_OFFICE={'STORE_RECIPIENTS': True})
+    def test_admin_change_recipients(self):
+        email = mail.send(recipients=['alice@example.com'], sender='from@example.com',
+                          subject='Subject', priority='medium')
+        url = reverse('admin:post_office_email_change', args=[email.id])
+        data = {
+            'from_email': 'from@example.com', 'to': 'bob@example.com', 'cc': 'carol@example.com',
+            'bcc': '', 'priority': email.priority, 'status': email.status,
+        }
+        for inline in self.client.get(url).context['inline_admin_formsets']:
+            management_form = inline.formset.management_form
+            data.update({management_form.add_prefix(name): value
+                         for name, value in management_form.initial.items()})
+        response = self.client.post(url, data)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(sorted(email.recipients.values_list('address', flat=True)),
+                         ['bob@example.com', 'carol@example.com'])
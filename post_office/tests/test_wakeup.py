@@ -0,0 +1,79 @@
+import os
+import tempfile
+import time
+from unittest.mock import patch
+
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from .. import wakeup
+from ..wakeup import SocketWakeup, get_wakeup
+
+
+class WakeupTest(TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), 'wakeup')
+        wakeup._wakeup = None
+
+    def tearDown(self):
+        if wakeup._wakeup is not None:
+            wakeup._wakeup.close()
+        wakeup._wakeup = None
+
+    def test_socket_wakeup(self):
+        channel = SocketWakeup(PATH=self.path)
+        # Notifying without anybody listening is a no-op
+        channel.notify()
+
+        self.assertFalse(channel.wait(0))
+        channel.notify()
+        channel.notify()
+        self.assertTrue(channel.wait(1))
+        # Pending notifications have been drained
+        self.assertFalse(channel.wait(0))
+        channel.close()
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_socket_wakeup_single_listener(self):
+        channel = SocketWakeup(PATH=self.path)
+        other = SocketWakeup(PATH=self.path)
+        self.assertIsNotNone(channel.listen())
+        # The path is owned by the first listener, the second one polls
+        self.assertIsNone(other.listen())
+        self.assertFalse(other.wait(0))
+        other.close()
+        self.assertTrue(os.path.exists(self.path))
+        channel.notify()
+        self.assertTrue(channel.wait(1))
+
+        # Once the owner is gone, the path can be taken over
+        channel.close()
+        self.assertIsNotNone(other.listen())
+        channel.notify()
+        self.assertTrue(other.wait(1))
+        other.close()
+
+    def test_interrupt(self):
+        channel = SocketWakeup(PATH=self.path)
+        channel.interrupt()
+        start = time.monotonic()
+        self.assertFalse(channel.wait(5))
+        self.assertLess(time.monotonic() - start, 1)
+        channel.close()
+
+    def test_get_wakeup(self):
+        self.assertIsNone(get_wakeup())
+        with override_settings(POST_OFFICE={'WAKEUP': {'OPTIONS': {'PATH': self.path}}}):
+            channel = get_wakeup()
+            self.assertIsInstance(channel, SocketWakeup)
+            self.assertEqual(channel.path, self.path)
+            self.assertIs(get_wakeup(), channel)
+
+    def test_queued_mail_handler(self):
+        with override_settings(POST_OFFICE={'WAKEUP': {'OPTIONS': {'PATH': self.path}}}):
+            get_wakeup().listen()
+            with patch('django.db.transaction.on_commit', side_effect=lambda func: func()) as on_commit:
+                wakeup.queued_mail_handler(sender=None, emails=[])
+                on_commit.assert_called_once_with(wakeup.notify)
+            self.assertTrue(get_wakeup().wait(1))
@@ -0,0 +1,18 @@
+from ..models import Email, STATUS
+
+
+def create_email(**kwargs):
+    """
+    Creates a queued email, sent through the ``locmem`` backend alias unless
+    ``backend_alias`` is given.
+    """
+    defaults = {
+        'to': ['to@example.com'],
+        'from_email': 'bob@example.com',
+        'subject': 'Test',
+        'message': 'Message',
+        'status': STATUS.queued,
+        'backend_alias': 'locmem',
+    }
+    defaults.update(kwargs)
+    return Email.objects.create(**defaults)
@@ -0,0 +1,186 @@
+import asyncio
+import time
+import uuid
+from threading import Lock
+
+from django.core.cache import caches
+
+from .models import normalize_address
+from .settings import get_rate_limits
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    """
+    Parses a rate limit like ``'10/s'``, ``'600/m'`` or ``{'RATE': '600/m', 'BURST': 10}``
+    into a two tuple (tokens per second, bucket capacity). A number is a rate per
+    second. The capacity defaults to the number of emails of the rate.
+    """
+    burst = None
+    if isinstance(rate, dict):
+        burst = rate.get('BURST')
+        rate = rate['RATE']
+    if isinstance(rate, str):
+        count, _, period = rate.partition('/')
+        count = float(count)
+        seconds = PERIODS[period[:1].lower()] if period else 1
+    else:
+        count, seconds = float(rate), 1
+    if burst is None:
+        burst = max(count, 1)
+    return count / seconds, float(burst)
+
+
+class TokenBucket:
+    """
+    Allows ``rate`` emails per second on average, and bursts of up to
+    ``capacity`` emails. The bucket is local to the current process.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = Lock()
+
+    def take(self):
+        """
+        Takes a token if one is available and returns 0, or returns the number
+        of seconds to wait until one is.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+
+class SharedTokenBucket:
+    """
+    A token bucket whose state is kept in a Django cache, shared by all
+    processes using the cache. Updates are serialized by a lock built on the
+    cache's atomic ``add()``.
+    """
+
+    # Seconds after which the lock of a crashed process expires
+    lock_timeout = 5
+
+    def __init__(self, rate, capacity, cache, key):
+        self.rate = rate
+        self.capacity = capacity
+        self.cache = cache
+        self.key = key
+        self.lock_key = key + ':lock'
+
+    def take(self):
+        token = uuid.uuid4().hex
+        if not self.cache.add(self.lock_key, token, self.lock_timeout):
+            # Another process is updating the bucket, try again shortly
+            return 0.01
+        try:
+            now = time.time()
+            tokens, updated = self.cache.get(self.key) or (self.capacity, now)
+            tokens = min(self.capacity, tokens + max(now - updated, 0) * self.rate)
+            delay = 0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                delay = (1 - tokens) / self.rate
+            # Keep the state until the bucket would be full again anyway
+            timeout = int((self.capacity - tokens) / self.rate) + 1
+            self.cache.set(self.key, (tokens, now), timeout)
+            return delay
+        finally:
+            if self.cache.get(self.lock_key) == token:
+                self.cache.delete(self.lock_key)
+
+
+class Throttle:
+    """
+    Limits the rate at which emails are sent, per backend alias and per
+    recipient domain, as configured by ``RATE_LIMITS``. Before each email
+    is sent, a token is taken from the bucket of its backend alias and from
+    the buckets of its recipients' domains, waiting for them if needed.
+    """
+
+    def __init__(self, config):
+        self.backend_limits = {alias: parse_rate(rate)
+                               for alias, rate in config.get('BACKENDS', {}).items()}
+        self.domain_limits = {domain.lower(): parse_rate(rate)
+                              for domain, rate in config.get('DOMAINS', {}).items()}
+        cache_alias = config.get('CACHE')
+        self.cache = caches[cache_alias] if cache_alias else None
+        self.buckets = {}
+        self.lock = Lock()
+
+    def get_bucket(self, kind, name, limits):
+        limit = limits.get(name, limits.get('*'))
+        if limit is None:
+            return None
+        key = (kind, name)
+        with self.lock:
+            if key not in self.buckets:
+                if self.cache is None:
+                    self.buckets[key] = TokenBucket(*limit)
+                else:
+                    cache_key = 'post_office:throttle:%s:%s' % key
+                    self.buckets[key] = SharedTokenBucket(*limit, cache=self.cache, key=cache_key)
+            return self.buckets[key]
+
+    def get_buckets(self, email):
+        buckets = []
+        if self.backend_limits:
+            bucket = self.get_bucket('backend', email.backend_alias or 'default', self.backend_limits)
+            if bucket is not None:
+                buckets.append(bucket)
+        if self.domain_limits:
+            domains = {normalize_address(address).rpartition('@')[2]
+                       for address in email.email_message().recipients()}
+            for domain in sorted(domains):
+                bucket = self.get_bucket('domain', domain, self.domain_limits)
+                if bucket is not None:
+                    buckets.append(bucket)
+        return buckets
+
+    def wait(self, email):
+        """
+        Blocks until ``email`` may be sent.
+        """
+        for bucket in self.get_buckets(email):
+            delay = bucket.take()
+            while delay:
+                time.sleep(delay)
+                delay = bucket.take()
+
+    async def wait_async(self, email):
+        """
+        Like ``wait()``, but sleeps without blocking the event loop.
+        """
+        for bucket in self.get_buckets(email):
+            delay = bucket.take()
+            while delay:
+                await asyncio.sleep(delay)
+                delay = bucket.take()
+
+
+_throttle = (None, None)
+
+
+def get_throttle():
+    """
+    Returns the ``Throttle`` configured by ``RATE_LIMITS``, or None if sending
+    isn't rate limited. Buckets are kept for the lifetime of the process, so
+    that rate limits also hold across batches.
+    """
+    global _throttle
+    config = get_rate_limits()
+    if not config:
+        return None
+    if _throttle[0] != config:
+        _throttle = (config, Throttle(config))
+    return _throttle[1]
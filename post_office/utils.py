@@ -1,11 +1,22 @@
+import hashlib
+import os
+import socket
+from email.utils import parseaddr
+from itertools import chain, groupby
+from operator import attrgetter
+
 from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.core.files import File
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from django.utils.encoding import force_text
 
 from post_office import cache
-from .models import Email, PRIORITY, STATUS, EmailTemplate, Attachment
-from .settings import get_default_priority
+from .models import Email, PRIORITY, STATUS, EmailTemplate, Attachment, Recipient
+from .settings import get_deduplicate_attachments, get_default_priority, get_max_retries
 from .validators import validate_email_with_name
 
 
@@ -51,6 +62,14 @@ def get_email_template(name, language=''):
         return email_template
 
 
+def get_lease_owner():
+    """
+    Returns a string identifying the current sending process, used to mark
+    emails claimed by ``mail.get_queued()``.
+    """
+    return '%s:%d' % (socket.gethostname(), os.getpid())
+
+
 def split_emails(emails, split_count=1):
     # Group emails into X sublists
     # taken from http://www.garyrobinson.net/2008/04/splitting-a-pyt.html
@@ -59,6 +78,31 @@ def split_emails(emails, split_count=1):
         return [emails[i::split_count] for i in range(split_count)]
 
 
+def get_recipient_domain(email):
+    """
+    Returns the lower cased domain of the first recipient of ``email``.
+    """
+    for address in chain(email.to, email.cc, email.bcc):
+        return parseaddr(address)[1].rpartition('@')[2].lower()
+    return ''
+
+
+def get_domain_key(email):
+    return (email.backend_alias or 'default', get_recipient_domain(email))
+
+
+def sort_by_domain(emails):
+    """
+    Returns ``emails`` sorted by backend alias and recipient domain within
+    each run of emails with the same priority, so that emails of a higher
+    priority are still sent first. Emails of the same domain keep their order.
+    """
+    sorted_emails = []
+    for priority, emails_of_priority in groupby(emails, key=attrgetter('priority')):
+        sorted_emails.extend(sorted(emails_of_priority, key=get_domain_key))
+    return sorted_emails
+
+
 def create_attachments(attachment_files):
     """
     Create Attachment instances from files
@@ -68,7 +112,12 @@ def create_attachments(attachment_files):
         * Value - file-like object, or a filename to open OR a dict of {'file': file-like-object, 'mimetype': string}
 
     Returns a list of Attachment objects
+
+    With ``DEDUPLICATE_ATTACHMENTS`` enabled, an existing attachment with the
+    same content, filename, mimetype and headers is returned instead of creating
+    a new one, and files with the same content are stored once.
     """
+    deduplicate = get_deduplicate_attachments()
     attachments = []
     for filename, filedata in attachment_files.items():
 
@@ -93,7 +142,33 @@ def create_attachments(attachment_files):
             attachment.mimetype = mimetype
         attachment.headers = headers
         attachment.name = filename
-        attachment.file.save(filename, content=content, save=True)
+
+        if not deduplicate:
+            attachment.file.save(filename, content=content, save=True)
+        else:
+            # The digest is computed while the file is written, so that the
+            # content is only read once
+            reader = DigestReader(content)
+            attachment.file.save(filename, content=File(reader), save=False)
+            if reader.is_complete():
+                attachment.digest = reader.hexdigest()
+                size = reader.size
+            else:
+                attachment.digest = get_content_digest(attachment.file)
+                size = attachment.file.size
+            duplicate = find_duplicate_attachment(attachment, size)
+
+            if duplicate is None:
+                attachment.save()
+            else:
+                attachment.file.storage.delete(attachment.file.name)
+                if duplicate.name == attachment.name and duplicate.mimetype == attachment.mimetype \
+                        and duplicate.headers == attachment.headers:
+                    attachment = duplicate
+                else:
+                    # Same content, but attached differently: share the stored file
+                    attachment.file.name = duplicate.file.name
+                    attachment.save()
 
         attachments.append(attachment)
 
@@ -138,6 +213,94 @@ def parse_emails(emails):
     return emails
 
 
+class DigestReader:
+    """
+    Wraps a file, computing the SHA-256 digest and size of the content as it
+    is read from the start.
+    """
+
+    def __init__(self, file):
+        self.file = file
+        self.reset()
+
+    def reset(self):
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.position = 0
+
+    def read(self, *args):
+        data = self.file.read(*args)
+        if self.position == self.size:
+            chunk = data.encode() if isinstance(data, str) else data
+            self.digest.update(chunk)
+            self.size += len(chunk)
+        self.position += len(data)
+        return data
+
+    def seek(self, *args):
+        position = self.file.seek(*args)
+        self.position = self.file.tell()
+        if self.position == 0:
+            self.reset()
+        return position
+
+    def is_complete(self):
+        """
+        Returns True if the whole content went through ``read()`` sequentially.
+        """
+        return self.position == self.size
+
+    def hexdigest(self):
+        return self.digest.hexdigest()
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+
+def get_content_digest(content):
+    """
+    Returns the SHA-256 hex digest of a file's content, read in chunks.
+    """
+    if not hasattr(content, 'chunks'):
+        content = File(content)
+    digest = hashlib.sha256()
+    for chunk in content.chunks():
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        digest.update(chunk)
+    content.seek(0)
+    return digest.hexdigest()
+
+
+def find_duplicate_attachment(attachment, size):
+    """
+    Returns an existing attachment with the same digest and file size as
+    ``attachment``, preferring one with the same filename, mimetype and
+    headers, or None.
+    """
+    sizes = {}
+
+    def has_size(candidate):
+        # Many attachments can share a file, whose size is checked once
+        name = candidate.file.name
+        if name not in sizes:
+            try:
+                sizes[name] = candidate.file.size
+            except OSError:
+                sizes[name] = None
+        return sizes[name] == size
+
+    duplicates = Attachment.objects.filter(digest=attachment.digest).order_by('id')
+    # Headers are serialized JSON, which is compared once loaded
+    for candidate in duplicates.filter(name=attachment.name, mimetype=attachment.mimetype):
+        if candidate.headers == attachment.headers and has_size(candidate):
+            return candidate
+    for candidate in duplicates:
+        if has_size(candidate):
+            return candidate
+    return None
+
+
 def cleanup_expired_mails(cutoff_date, delete_attachments=True):
     """
     Delete all emails before the given cutoff date.
@@ -150,10 +313,57 @@ def cleanup_expired_mails(cutoff_date, delete_attachments=True):
     if delete_attachments:
         attachments = Attachment.objects.filter(emails=None)
         for attachment in attachments:
-            # Delete the actual file
+            # Delete the actual file, unless deduplicated attachments still use it
+            if attachment.digest and Attachment.objects.filter(file=attachment.file.name) \
+                    .exclude(emails=None).exists():
+                continue
             attachment.file.delete()
         attachments_count, _ = attachments.delete()
     else:
         attachments_count = 0
 
     return emails_count, attachments_count
+
+
+def requeue_stuck_emails(now=None):
+    """
+    Requeue all emails stuck in ``sending`` state whose lease has expired,
+    typically because the process sending them died. Like failed deliveries,
+    this counts as a retry: emails which have been retried ``MAX_RETRIES``
+    times are marked as failed instead, so that an email crashing its sender
+    isn't retried forever.
+    Return the number of requeued emails.
+    """
+    if now is None:
+        now = timezone.now()
+    max_retries = get_max_retries()
+    retries_exceeded = Q(number_of_retries__gte=max_retries)
+    if max_retries == 0:
+        retries_exceeded |= Q(number_of_retries__isnull=True)
+
+    stuck_emails = Email.objects.filter(status=STATUS.sending, lease_expires_at__lte=now)
+    with transaction.atomic():
+        stuck_emails.filter(retries_exceeded).update(
+            status=STATUS.failed, lease_owner='', lease_expires_at=None)
+        return stuck_emails.update(
+            status=STATUS.requeued, lease_owner='', lease_expires_at=None,
+            number_of_retries=Coalesce('number_of_retries', 0) + 1)
+
+
+def store_recipients(batch_size=1000):
+    """
+    Stores the recipients of all existing emails, replacing previously stored
+    ones, ``batch_size`` emails at a time.
+    Return the number of emails processed.
+    """
+    emails = Email.objects.only('id', 'to', 'cc', 'bcc').order_by('id')
+    count, last_id = 0, 0
+    while True:
+        batch = list(emails.filter(id__gt=last_id)[:batch_size])
+        if not batch:
+            return count
+        with transaction.atomic():
+            Recipient.objects.filter(email__in=batch).delete()
+            Recipient.objects.create_for_emails(batch)
+        count += len(batch)
+        last_id = batch[-1].id
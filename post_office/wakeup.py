@@ -0,0 +1,234 @@
+import errno
+import fcntl
+import os
+import select
+import socket
+import tempfile
+
+from django.db import connections as db_connections, transaction
+from django.utils.module_loading import import_string
+
+from .logutils import setup_loghandlers
+from .settings import get_wakeup_config
+
+logger = setup_loghandlers()
+
+
+class BaseWakeup:
+    """
+    A channel used to wake up a sleeping sender as soon as emails are queued.
+
+    Notifications are sent by the processes queueing emails through ``notify()``,
+    while the sender blocks on ``wait()`` in between polls. ``wait()`` can also be
+    interrupted from a signal handler through ``interrupt()``.
+    """
+
+    def __init__(self, **options):
+        self.options = options
+        self._interrupt_pipe = None
+
+    def notify(self):
+        raise NotImplementedError
+
+    def listen(self):
+        """
+        Start listening for notifications, returns a file descriptor which
+        becomes readable once a notification arrives, or None if notifications
+        can't be received at the moment.
+        """
+        raise NotImplementedError
+
+    def drain(self):
+        """
+        Consume all pending notifications.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        if self._interrupt_pipe is not None:
+            for fd in self._interrupt_pipe:
+                os.close(fd)
+            self._interrupt_pipe = None
+
+    def interrupt(self):
+        os.write(self.get_interrupt_pipe()[1], b'\0')
+
+    def get_interrupt_pipe(self):
+        if self._interrupt_pipe is None:
+            self._interrupt_pipe = os.pipe()
+        return self._interrupt_pipe
+
+    def wait(self, timeout):
+        """
+        Block until a notification arrives, ``interrupt()`` is called or
+        ``timeout`` seconds have elapsed. Returns True if emails have been queued.
+        """
+        fd = self.listen()
+        interrupt_fd = self.get_interrupt_pipe()[0]
+        fds = [interrupt_fd] if fd is None else [fd, interrupt_fd]
+        readable, _, _ = select.select(fds, [], [], timeout)
+        if interrupt_fd in readable:
+            os.read(interrupt_fd, 512)
+        if fd is not None and fd in readable:
+            self.drain()
+            return True
+        return False
+
+
+class PostgresWakeup(BaseWakeup):
+    """
+    Uses PostgreSQL's LISTEN/NOTIFY. Notifications are only delivered once the
+    transaction queueing the emails has been committed.
+    """
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        self.database = options.get('DATABASE', 'default')
+        self.channel = options.get('CHANNEL', 'post_office')
+        self._connection = None
+
+    def notify(self):
+        db_connection = db_connections[self.database]
+        with db_connection.cursor() as cursor:
+            cursor.execute('NOTIFY %s' % db_connection.ops.quote_name(self.channel))
+
+    def listen(self):
+        if self._connection is None:
+            # A dedicated connection is used, so that notifications don't depend
+            # on the transactions run through the ORM
+            db_connection = db_connections[self.database]
+            self._connection = db_connection.get_new_connection(db_connection.get_connection_params())
+            self._connection.autocommit = True
+            with self._connection.cursor() as cursor:
+                cursor.execute('LISTEN %s' % db_connection.ops.quote_name(self.channel))
+        return self._connection.fileno()
+
+    def drain(self):
+        self._connection.poll()
+        del self._connection.notifies[:]
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+        super().close()
+
+
+class SocketWakeup(BaseWakeup):
+    """
+    Uses a Unix datagram socket, hence only wakes up senders running on the
+    same host as the processes queueing emails.
+
+    Only one sender can listen on a given path: ownership of the socket is
+    guarded by a lock file next to it, other senders fall back to polling
+    until the lock is released.
+    """
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        self.path = options.get('PATH', os.path.join(tempfile.gettempdir(), 'post_office.wakeup'))
+        self.lock_path = self.path + '.lock'
+        self._socket = None
+        self._lock_file = None
+        self._lock_warned = False
+
+    def acquire_lock(self):
+        """
+        Returns True if this process owns the socket path. The lock is released
+        by the OS if the process dies, so a stale socket can be safely replaced.
+        """
+        if self._lock_file is None:
+            lock_file = open(self.lock_path, 'a')
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock_file.close()
+                return False
+            self._lock_file = lock_file
+        return True
+
+    def notify(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            sock.setblocking(False)
+            sock.sendto(b'\0', self.path)
+        except OSError as e:
+            # Nobody is listening or the listener is lagging behind, either way
+            # the sender will pick up the emails on its next poll
+            if e.errno not in (errno.ENOENT, errno.ECONNREFUSED, errno.EAGAIN):
+                raise
+        finally:
+            sock.close()
+
+    def listen(self):
+        if self._socket is None:
+            if not self.acquire_lock():
+                if not self._lock_warned:
+                    logger.warning('Another sender is listening on %s, polling instead' % self.path)
+                    self._lock_warned = True
+                return None
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self._socket.setblocking(False)
+            self._socket.bind(self.path)
+        return self._socket.fileno()
+
+    def drain(self):
+        try:
+            while self._socket.recv(512):
+                pass
+        except BlockingIOError:
+            pass
+
+    def close(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+        if self._lock_file is not None:
+            # Closing the file releases the lock, the lock file itself is kept
+            # as unlinking it could let two processes lock different files
+            self._lock_file.close()
+            self._lock_file = None
+        super().close()
+
+
+_wakeup = None
+
+
+def get_wakeup():
+    """
+    Returns the configured wakeup channel, or None if ``WAKEUP`` isn't set.
+    """
+    global _wakeup
+    config = get_wakeup_config()
+    if not config:
+        return None
+    if _wakeup is None:
+        backend = import_string(config.get('BACKEND', 'post_office.wakeup.SocketWakeup'))
+        _wakeup = backend(**config.get('OPTIONS', {}))
+    return _wakeup
+
+
+def notify():
+    wakeup = get_wakeup()
+    if wakeup is None:
+        return
+    try:
+        wakeup.notify()
+    except Exception as e:
+        # Failing to wake up the sender must never prevent emails from being queued
+        logger.warning('Failed to notify sender: %s' % e)
+
+
+def queued_mail_handler(sender, **kwargs):
+    """
+    To be called by post_office.signals.email_queued.send()
+    """
+    transaction.on_commit(notify)
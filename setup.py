@@ -70,6 +70,7 @@ setup(
     extras_require={
         'test': TESTS_REQUIRE,
         'prevent-XSS': ['bleach'],
+        'async': ['aiosmtplib>=2.0'],
     },
     cmdclass={'test': Tox}
 )